@@ -71,6 +71,7 @@
         "views/pms_room_type_views.xml",
         "views/pms_room_views.xml",
         "views/pms_room_closure_reason_views.xml",
+        "views/pms_autoinvoicing_run_views.xml",
         "views/account_payment_views.xml",
         "views/account_move_views.xml",
         "views/account_bank_statement_views.xml",
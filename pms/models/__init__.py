@@ -43,6 +43,9 @@ from . import account_bank_statement_line
 from . import account_bank_statement
 from . import account_journal
 from . import pms_availability
+from . import pms_occupancy_index
+from . import pms_property_kpi
+from . import pms_autoinvoicing_run
 from . import res_partner_id_number
 from . import pms_automated_mails
 from . import payment_transaction
@@ -1,11 +1,18 @@
 # Copyright 2017  Dario Lodeiros
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
-import itertools as it
 import json
+import logging
+import time
 
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
 
+_logger = logging.getLogger(__name__)
+
+# Budget of the payments matcher: partial sums explored and seconds
+MATCH_PAYS_MAX_STATES = 250000
+MATCH_PAYS_MAX_SECONDS = 2.0
+
 
 class AccountMove(models.Model):
     _inherit = "account.move"
@@ -252,51 +259,105 @@ class AccountMove(models.Model):
 
     def _autoreconcile_folio_payments(self):
         """
-        Reconcile payments with the invoice
+        Reconcile payments with the invoices: the outstanding lines of
+        all the folios of the invoices are read at once and matched
+        with each invoice by amount
         """
         # TODO: Add setting option to enable automatic payment reconciliation
-        for move in self.filtered(lambda m: m.state == "posted"):
-            if move.is_invoice(include_receipts=True) and move.folio_ids:
-                to_reconcile_payments_widget_vals = json.loads(
-                    move.invoice_outstanding_credits_debits_widget
-                )
-                if not to_reconcile_payments_widget_vals:
-                    continue
-                current_amounts = {
-                    vals["move_id"]: vals["amount"]
-                    for vals in to_reconcile_payments_widget_vals["content"]
-                }
-                pay_term_lines = move.line_ids.filtered(
-                    lambda line: line.account_id.user_type_id.type
-                    in ("receivable", "payable")
-                )
-                to_propose = (
-                    self.env["account.move"]
-                    .browse(list(current_amounts.keys()))
-                    .line_ids.filtered(
-                        lambda line: line.account_id == pay_term_lines.account_id
-                        and line.folio_ids in move.folio_ids
+        moves = self.filtered(
+            lambda m: m.state == "posted"
+            and m.payment_state in ("not_paid", "partial")
+            and m.folio_ids
+            and m.is_invoice(include_receipts=True)
+        )
+        if not moves:
+            return True
+        pay_term_lines_by_move = {
+            move: move.line_ids.filtered(
+                lambda line: line.account_id.user_type_id.type
+                in ("receivable", "payable")
+            )
+            for move in moves
+        }
+        candidates, order = self._get_folio_payment_candidates(
+            moves, pay_term_lines_by_move
+        )
+        reconciled_ids = set()
+        for move, pay_term_lines in pay_term_lines_by_move.items():
+            inbound = move.is_inbound()
+            line_ids = set()
+            partner_id = move.commercial_partner_id.id
+            for account_id in pay_term_lines.account_id.ids:
+                for folio_id in move.folio_ids.ids:
+                    line_ids.update(
+                        line_id
+                        for line_id, balance in candidates.get(
+                            (account_id, folio_id, partner_id), []
+                        )
+                        if line_id not in reconciled_ids and (balance < 0) == inbound
                     )
-                )
-                to_reconcile = self.match_pays_by_amount(
-                    payments=to_propose, invoice=move
-                )
-                if to_reconcile:
-                    try:
-                        (pay_term_lines + to_reconcile).reconcile()
-                    except Exception as e:
-                        message = (
-                            _(
-                                """
-                            An error occurred while reconciling
-                            the invoice with the payments: %s
+            if not line_ids:
+                continue
+            to_reconcile = self.match_pays_by_amount(
+                payments=self.env["account.move.line"].browse(
+                    sorted(line_ids, key=order.get)
+                ),
+                invoice=move,
+            )
+            if to_reconcile:
+                try:
+                    (pay_term_lines + to_reconcile).reconcile()
+                    reconciled_ids.update(to_reconcile.ids)
+                except Exception as e:
+                    message = (
+                        _(
                             """
-                            )
-                            % str(e)
+                        An error occurred while reconciling
+                        the invoice with the payments: %s
+                        """
                         )
-                        move.message_post(body=message)
+                        % str(e)
+                    )
+                    move.message_post(body=message)
         return True
 
+    @api.model
+    def _get_folio_payment_candidates(self, moves, pay_term_lines_by_move):
+        """
+        Read the outstanding lines of the folios of the moves in the
+        payment term accounts of the moves, in one query. As in the
+        outstanding credits widget, only the lines of the commercial
+        partners of the moves are proposed.
+        :return: ({(account_id, folio_id, partner_id): [(line_id, balance)]},
+            {line_id: position in the account.move.line order})
+        """
+        account_ids = set()
+        for pay_term_lines in pay_term_lines_by_move.values():
+            account_ids.update(pay_term_lines.account_id.ids)
+        lines = self.env["account.move.line"].search(
+            [
+                ("account_id", "in", list(account_ids)),
+                ("parent_state", "=", "posted"),
+                ("reconciled", "=", False),
+                ("move_id", "not in", moves.ids),
+                ("folio_ids", "in", moves.folio_ids.ids),
+                ("partner_id", "in", moves.commercial_partner_id.ids),
+                "|",
+                ("amount_residual", "!=", 0.0),
+                ("amount_residual_currency", "!=", 0.0),
+            ]
+        )
+        candidates = {}
+        order = {}
+        for position, line in enumerate(lines):
+            # Only the payments of a single folio are proposed
+            if len(line.folio_ids) != 1:
+                continue
+            key = (line.account_id.id, line.folio_ids.id, line.partner_id.id)
+            candidates.setdefault(key, []).append((line.id, line.balance))
+            order[line.id] = position
+        return candidates, order
+
     def _post(self, soft=True):
         """
         Overwrite the original method to add the folio_ids to the invoice
@@ -304,24 +365,110 @@ class AccountMove(models.Model):
         for record in self:
             record._check_pms_valid_invoice(record)
         res = super(AccountMove, self)._post(soft)
+        if self.env.context.get("skip_autoreconcile_folio_payments"):
+            return res
+        start = time.monotonic()
         self._autoreconcile_folio_payments()
+        _logger.info(
+            "Posted %s moves, folio payments reconciled in %.3fs",
+            len(self),
+            time.monotonic() - start,
+        )
         return res
 
     def match_pays_by_amount(self, payments, invoice):
         """
-        Match payments by amount
+        Match payments by amount: get the payments with the fewest lines
+        (the first ones in order on a tie) whose amounts sum the invoice
+        residual, searching subset sums of integer cents.
+        If the search exceeds its budget, the payments are taken by
+        amount (greater first) while they fit in the residual.
         """
-        for i in range(len(payments)):
-            combinations = list(it.combinations(payments, i + 1))
-            for combi in combinations:
-                # TODO: compare with currency differences
-                if sum(abs(item.balance) for item in combi) == invoice.amount_residual:
-                    return payments.filtered(
-                        lambda p: p.id in [item.id for item in combi]
-                    )
-                if sum(invoice.folio_ids.mapped("pending_amount")) == 0:
-                    return payments
-        return []
+        if not payments:
+            return []
+        start = time.monotonic()
+        # TODO: compare with currency differences
+        factor = 10**invoice.currency_id.decimal_places
+        amounts = [int(round(abs(item.balance) * factor)) for item in payments]
+        target = int(round(invoice.amount_residual * factor))
+        if (
+            amounts[0] != target
+            and sum(invoice.folio_ids.mapped("pending_amount")) == 0
+        ):
+            return payments
+        indexes = self._match_amounts(
+            amounts, target, start + MATCH_PAYS_MAX_SECONDS, MATCH_PAYS_MAX_STATES
+        )
+        method = "subset sum"
+        if indexes is False:
+            method = "greedy fallback"
+            indexes = self._match_amounts_greedy(amounts, target)
+        _logger.info(
+            "Matched %s of %s payments with invoice %s by %s in %.3fs",
+            len(indexes or []),
+            len(payments),
+            invoice.name,
+            method,
+            time.monotonic() - start,
+        )
+        if not indexes:
+            return []
+        return payments.browse([payments[index].id for index in indexes])
+
+    @api.model
+    def _match_amounts(self, amounts, target, deadline, max_states):
+        """
+        Get the fewest amounts summing the target, with the lowest indexes
+        on a tie (the first match of itertools.combinations by size).
+        :param amounts: list of positive integer amounts
+        :return: sorted list of indexes, None if there is no match or
+            False if the budget is exceeded
+        """
+        if target <= 0:
+            return None
+        # fewest[i]: {partial sum: fewest amounts from amounts[i:] to reach it}
+        fewest = [None] * len(amounts) + [{0: 0}]
+        states = 1
+        for index in range(len(amounts) - 1, -1, -1):
+            amount = amounts[index]
+            following = fewest[index + 1]
+            current = dict(following)
+            for total, count in following.items():
+                new_total = total + amount
+                if (
+                    new_total <= target
+                    and current.get(new_total, count + 2) > count + 1
+                ):
+                    current[new_total] = count + 1
+            fewest[index] = current
+            states += len(current)
+            if states > max_states or time.monotonic() > deadline:
+                return False
+        if not fewest[0].get(target):
+            return None
+        indexes = []
+        remaining = target
+        count = fewest[0][target]
+        for index, amount in enumerate(amounts):
+            if not count:
+                break
+            if fewest[index + 1].get(remaining - amount) == count - 1:
+                indexes.append(index)
+                remaining -= amount
+                count -= 1
+        return indexes
+
+    @api.model
+    def _match_amounts_greedy(self, amounts, target):
+        """Take the amounts (greater first, then by index) while they fit
+        in the target, returning the indexes only on an exact match"""
+        indexes = []
+        remaining = target
+        for index in sorted(range(len(amounts)), key=lambda i: (-amounts[i], i)):
+            if 0 < amounts[index] <= remaining:
+                indexes.append(index)
+                remaining -= amounts[index]
+        return sorted(indexes) if indexes and not remaining else None
 
     @api.model
     def _check_pms_valid_invoice(self, move):
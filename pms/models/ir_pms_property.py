@@ -1,4 +1,4 @@
-from odoo import fields, models
+from odoo import api, fields, models, tools
 
 
 class IrPmsProperty(models.Model):
@@ -24,74 +24,163 @@ class IrPmsProperty(models.Model):
 
     value_reference = fields.Text(string="Reference Field Value")
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(IrPmsProperty, self).create(vals_list)
+        self.clear_caches()
+        return records
+
+    def write(self, vals):
+        res = super(IrPmsProperty, self).write(vals)
+        self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super(IrPmsProperty, self).unlink()
+        self.clear_caches()
+        return res
+
+    @api.model
+    @tools.ormcache("model_name", "field_name")
+    def _get_model_field_ids(self, model_name, field_name):
+        """Return the (ir.model id, ir.model.fields id) of the field,
+        or (False, False) if the model does not exist"""
+        model = self.env["ir.model"].search([("model", "=", model_name)])
+        if not model:
+            return False, False
+        field_id = self.env["ir.model.fields"].search(
+            [("name", "=", field_name), ("model_id", "=", model.id)]
+        )
+        return model.id, field_id[0].id
+
+    @api.model
+    @tools.ormcache("pms_property_id", "model_name", "field_name")
+    def _get_property_field_values(self, pms_property_id, model_name, field_name):
+        """
+        Return the raw values of the field in the property, by record id:
+        {record_id: (value_integer, value_float, value_reference)}
+        """
+        model_id, field_id = self._get_model_field_ids(model_name, field_name)
+        if not model_id:
+            return {}
+        self.flush(
+            [
+                "pms_property_id",
+                "field_id",
+                "record",
+                "value_integer",
+                "value_float",
+                "value_reference",
+            ]
+        )
+        self.env.cr.execute(
+            """
+            SELECT   record, value_integer, value_float, value_reference
+            FROM     ir_pms_property
+            WHERE    pms_property_id = %s AND field_id = %s
+            ORDER BY id DESC
+            """,
+            (pms_property_id, field_id),
+        )
+        # The oldest value of a record wins, as ids are read backwards
+        return {row[0]: row[1:] for row in self.env.cr.fetchall()}
+
+    def _convert_field_value(self, raw_value, value_type):
+        value_integer, value_float, value_reference = raw_value
+        if value_type == int:
+            return value_integer
+        elif value_type == float:
+            return value_float
+        index_bracket = value_reference.index("(")
+        index_comma = value_reference.index(",")
+        model_name = value_reference[:index_bracket]
+        resource_id = value_reference[index_bracket + 1 : index_comma]
+        return self.env[model_name].browse(int(resource_id))
+
     def get_field_value(
         self, pms_property_id, model_name, field_name, record_id, value_type
     ):
-        model_id = self.env["ir.model"].browse(model_name).id
-        model = self.env["ir.model"].search([("model", "=", model_id)])
-        if model:
-            field_id = self.env["ir.model.fields"].search(
-                [("name", "=", field_name), ("model_id", "=", model.id)]
-            )
-            ir_pms_property = self.env["ir.pms.property"].search(
-                [
-                    ("pms_property_id", "=", pms_property_id),
-                    ("field_id", "=", field_id[0].id),
-                    ("record", "=", record_id),
-                ]
-            )
-            if ir_pms_property:
-                if value_type == int:
-                    value = ir_pms_property.value_integer
-                elif value_type == float:
-                    value = ir_pms_property.value_float
-                else:
-                    index_bracket = ir_pms_property.value_reference.index("(")
-                    index_comma = ir_pms_property.value_reference.index(",")
-                    model_name = ir_pms_property.value_reference[:index_bracket]
-                    resource_id = ir_pms_property.value_reference[
-                        index_bracket + 1 : index_comma
-                    ]
-                    value = self.env[model_name].browse(int(resource_id))
-                return value
+        model_id, field_id = self._get_model_field_ids(model_name, field_name)
+        if model_id:
+            raw_value = self._get_property_field_values(
+                pms_property_id, model_name, field_name
+            ).get(record_id)
+            if raw_value:
+                return self._convert_field_value(raw_value, value_type)
             return False
 
+    @api.model
+    def get_field_values(self, pms_property_id, records, field_name):
+        """
+        Return the values of the field of the records in the property
+        with a single query, or with none if they are already cached.
+        :return: {record id: value}, False for the records without value
+        """
+        field_type = records._fields[field_name].type
+        value_type = {"integer": int, "float": float, "monetary": float}.get(field_type)
+        raw_values = self._get_property_field_values(
+            pms_property_id, records._name, field_name
+        )
+        values = {}
+        for record in records:
+            raw_value = raw_values.get(record._origin.id)
+            values[record.id] = (
+                self._convert_field_value(raw_value, value_type) if raw_value else False
+            )
+        return values
+
+    def _get_value_vals(self, value):
+        if type(value) == int:
+            return {"value_integer": value}
+        elif type(value) == float:
+            return {"value_float": value}
+        return {"value_reference": str(value)}
+
     def set_field_value(
         self, pms_property_id, model_name, field_name, record_id, value
     ):
-        model_id = self.env["ir.model"].browse(model_name).id
-        model = self.env["ir.model"].search([("model", "=", model_id)])
-        if model:
-            field_id = self.env["ir.model.fields"].search(
-                [("name", "=", field_name), ("model_id", "=", model.id)]
+        self.set_field_values(
+            pms_property_id, model_name, field_name, {record_id: value}
+        )
+
+    @api.model
+    def set_field_values(self, pms_property_id, model_name, field_name, values):
+        """
+        Set the values of the field of many records in the property, writing
+        the existing records with the same value together and creating
+        the missing ones at once.
+        :param values: {record id: value}
+        """
+        model_id, field_id = self._get_model_field_ids(model_name, field_name)
+        if not model_id or not values:
+            return
+        ir_pms_properties = self.env["ir.pms.property"].search(
+            [
+                ("pms_property_id", "=", pms_property_id),
+                ("field_id", "=", field_id),
+                ("record", "in", list(values)),
+            ]
+        )
+        records_by_vals = {}
+        for ir_pms_property in ir_pms_properties:
+            vals = self._get_value_vals(values[ir_pms_property.record])
+            key = tuple(vals.items())
+            records_by_vals[key] = (
+                records_by_vals.get(key, self.browse()) | ir_pms_property
             )
-            ir_pms_property = self.env["ir.pms.property"].search(
-                [
-                    ("pms_property_id", "=", pms_property_id),
-                    ("field_id", "=", field_id[0].id),
-                    ("record", "=", record_id),
-                ]
+        for vals, records in records_by_vals.items():
+            records.write(dict(vals))
+        existing_record_ids = set(ir_pms_properties.mapped("record"))
+        vals_list = [
+            dict(
+                self._get_value_vals(value),
+                pms_property_id=pms_property_id,
+                model_id=model_id,
+                field_id=field_id,
+                record=record_id,
             )
-            if type(value) == int:
-                value_type = "value_integer"
-            elif type(value) == float:
-                value_type = "value_float"
-            else:
-                value_type = "value_reference"
-                value = str(value)
-            if ir_pms_property:
-                ir_pms_property.write(
-                    {
-                        value_type: value,
-                    }
-                )
-            else:
-                self.env["ir.pms.property"].create(
-                    {
-                        "pms_property_id": pms_property_id,
-                        "model_id": model.id,
-                        "field_id": field_id[0].id,
-                        value_type: value,
-                        "record": record_id,
-                    }
-                )
+            for record_id, value in values.items()
+            if record_id not in existing_record_ids
+        ]
+        if vals_list:
+            self.env["ir.pms.property"].create(vals_list)
@@ -0,0 +1,184 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from odoo import api, fields, models
+
+
+class PmsAutoinvoicingRun(models.Model):
+    _name = "pms.autoinvoicing.run"
+    _description = "Autoinvoicing Run"
+    _order = "start_date desc, id desc"
+
+    name = fields.Char(
+        string="Name",
+        help="Name of the autoinvoicing run",
+        compute="_compute_name",
+    )
+    date_reference = fields.Date(
+        string="Reference Date",
+        help="Autoinvoice date of the folio lines invoiced in the run",
+        readonly=True,
+    )
+    start_date = fields.Datetime(
+        string="Start",
+        help="Date and time when the run was launched",
+        readonly=True,
+        default=fields.Datetime.now,
+    )
+    end_date = fields.Datetime(
+        string="End",
+        help="Date and time when the last batch of the run was processed",
+        compute="_compute_summary",
+    )
+    batch_ids = fields.One2many(
+        string="Batches",
+        help="Batches of folios of the run, by property and invoice journal",
+        comodel_name="pms.autoinvoicing.batch",
+        inverse_name="run_id",
+        readonly=True,
+    )
+    state = fields.Selection(
+        string="State",
+        help="Running while any batch of the run is pending",
+        selection=[("running", "Running"), ("done", "Done")],
+        compute="_compute_summary",
+    )
+    # The summary is not stored so that the batches running
+    # concurrently do not write the same run record
+    folio_count = fields.Integer(
+        string="Folios",
+        help="Folios to invoice in the run",
+        compute="_compute_summary",
+    )
+    invoice_count = fields.Integer(
+        string="Invoices",
+        help="Invoices created in the run",
+        compute="_compute_summary",
+    )
+    failed_folio_count = fields.Integer(
+        string="Failed Folios",
+        help="Folios that could not be invoiced in the run",
+        compute="_compute_summary",
+    )
+    duration = fields.Float(
+        string="Duration (s)",
+        help="Seconds from the start of the run to the end of its last batch",
+        compute="_compute_summary",
+    )
+    processing_time = fields.Float(
+        string="Processing Time (s)",
+        help="Seconds spent processing the batches of the run",
+        compute="_compute_summary",
+    )
+    throughput = fields.Float(
+        string="Folios per Minute",
+        help="Folios processed per minute in the run",
+        compute="_compute_summary",
+    )
+
+    @api.depends("date_reference", "start_date")
+    def _compute_name(self):
+        for record in self:
+            record.name = "%s %s" % (record.date_reference or "", record.start_date)
+
+    @api.depends(
+        "start_date",
+        "batch_ids.state",
+        "batch_ids.end_date",
+        "batch_ids.duration",
+        "batch_ids.folio_ids",
+        "batch_ids.invoice_ids",
+        "batch_ids.failed_folio_ids",
+    )
+    def _compute_summary(self):
+        for record in self:
+            batches = record.batch_ids
+            done_batches = batches.filtered(lambda b: b.state != "pending")
+            record.state = "running" if len(done_batches) < len(batches) else "done"
+            record.end_date = max(
+                done_batches.mapped("end_date"), default=record.start_date
+            )
+            record.folio_count = len(batches.folio_ids)
+            record.invoice_count = len(batches.invoice_ids)
+            record.failed_folio_count = len(batches.failed_folio_ids)
+            record.duration = (
+                (record.end_date - record.start_date).total_seconds()
+                if record.start_date and record.end_date
+                else 0.0
+            )
+            record.processing_time = sum(batches.mapped("duration"))
+            record.throughput = (
+                len(done_batches.folio_ids) * 60.0 / record.duration
+                if record.duration
+                else 0.0
+            )
+
+
+class PmsAutoinvoicingBatch(models.Model):
+    _name = "pms.autoinvoicing.batch"
+    _description = "Autoinvoicing Batch"
+    _order = "run_id, id"
+
+    run_id = fields.Many2one(
+        string="Run",
+        help="Autoinvoicing run of the batch",
+        comodel_name="pms.autoinvoicing.run",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    pms_property_id = fields.Many2one(
+        string="Property",
+        help="Property of the folios of the batch",
+        comodel_name="pms.property",
+        readonly=True,
+    )
+    journal_id = fields.Many2one(
+        string="Journal",
+        help="Expected invoice journal of the folios of the batch",
+        comodel_name="account.journal",
+        readonly=True,
+    )
+    folio_ids = fields.Many2many(
+        string="Folios",
+        help="Folios to invoice in the batch",
+        comodel_name="pms.folio",
+        relation="pms_autoinvoicing_batch_folio_rel",
+        column1="batch_id",
+        column2="folio_id",
+        readonly=True,
+    )
+    invoice_ids = fields.Many2many(
+        string="Invoices",
+        help="Invoices created by the batch",
+        comodel_name="account.move",
+        relation="pms_autoinvoicing_batch_invoice_rel",
+        column1="batch_id",
+        column2="move_id",
+        readonly=True,
+    )
+    failed_folio_ids = fields.Many2many(
+        string="Failed Folios",
+        help="Folios of the batch that could not be invoiced",
+        comodel_name="pms.folio",
+        relation="pms_autoinvoicing_batch_failed_folio_rel",
+        column1="batch_id",
+        column2="folio_id",
+        readonly=True,
+    )
+    state = fields.Selection(
+        string="State",
+        help="Pending until the batch is processed, with errors if "
+        "any folio of the batch could not be invoiced",
+        selection=[("pending", "Pending"), ("done", "Done"), ("error", "Errors")],
+        default="pending",
+        readonly=True,
+    )
+    end_date = fields.Datetime(
+        string="End",
+        help="Date and time when the batch was processed",
+        readonly=True,
+    )
+    duration = fields.Float(
+        string="Duration (s)",
+        help="Seconds spent processing the batch",
+        readonly=True,
+    )
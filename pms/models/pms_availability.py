@@ -1,10 +1,16 @@
 # Copyright 2021  Dario Lodeiros
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 import datetime
+import logging
+from collections import Counter
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
 
+from .pms_occupancy_index import INDEX_FIELDS
+
+_logger = logging.getLogger(__name__)
+
 
 class PmsAvailability(models.Model):
     _name = "pms.availability"
@@ -100,122 +106,441 @@ class PmsAvailability(models.Model):
         "child_avail_ids.reservation_line_ids.occupies_availability",
     )
     def _compute_real_avail(self):
+        records = self
+        if self._is_real_avail_incremental() and not self._context.get(
+            "real_avail_full_recompute"
+        ):
+            records = self._filter_real_avail_affected()
+        real_avails = records._get_real_avail_batch()
+        for record in records:
+            record.real_avail = real_avails.get(record.id, 0)
+
+    @api.model
+    def _is_real_avail_incremental(self):
+        return tools.str2bool(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("pms.real_avail_incremental", "False")
+        )
+
+    def _filter_real_avail_affected(self):
+        """
+        Incremental mode: the availabilities whose rooms are not related
+        (same room, parent or child rooms) to the occupancy cells modified
+        by the transaction keep their current counter.
+        :return: the records that must be computed
+        """
+        field = self._fields["real_avail"]
+        cache = self.env.cache
+        to_compute = self.browse()
+        candidates_by_property = {}
         for record in self:
-            Rooms = self.env["pms.room"]
-            total_rooms = Rooms.search_count(
-                [
-                    ("active", "=", True),
-                    ("room_type_id", "=", record.room_type_id.id),
-                    ("pms_property_id", "=", record.pms_property_id.id),
-                ]
+            if (
+                isinstance(record.id, int)
+                and record.room_type_id
+                and record.pms_property_id
+                and record.date
+                and cache.contains(record, field)
+            ):
+                candidates_by_property.setdefault(
+                    record.pms_property_id.id, self.browse()
+                )
+                candidates_by_property[record.pms_property_id.id] |= record
+            else:
+                to_compute |= record
+        if not candidates_by_property:
+            return to_compute
+        # Register the pending changes of the reservation lines
+        self.env["pms.reservation.line"].flush(list(INDEX_FIELDS))
+        OccupancyIndex = self.env["pms.occupancy.index"]
+        for pms_property_id, records in candidates_by_property.items():
+            cells = OccupancyIndex.get_touched_cells(pms_property_id)
+            if cells is None:
+                to_compute |= records
+                continue
+            graph = self._get_shared_rooms_graph(pms_property_id)
+            related_by_date = {}
+            for room_id, date in cells:
+                related_by_date.setdefault(date, set()).update(
+                    self._get_related_rooms(room_id, graph)
+                )
+            for record in records:
+                related_room_ids = related_by_date.get(record.date)
+                room_ids = graph["rooms_by_type"].get(record.room_type_id.id, [])
+                if related_room_ids and related_room_ids.intersection(room_ids):
+                    to_compute |= record
+                else:
+                    record.real_avail = cache.get(record, field)
+        return to_compute
+
+    @api.model
+    def _get_related_rooms(self, room_id, graph):
+        """The room with all its parent and child rooms"""
+        related_room_ids = {room_id}
+        parent_id = graph["parent"].get(room_id)
+        while parent_id and parent_id not in related_room_ids:
+            related_room_ids.add(parent_id)
+            parent_id = graph["parent"].get(parent_id)
+        pending = list(graph["children"].get(room_id, []))
+        while pending:
+            child_id = pending.pop()
+            if child_id not in related_room_ids:
+                related_room_ids.add(child_id)
+                pending.extend(graph["children"].get(child_id, []))
+        return related_room_ids
+
+    @api.model
+    def reconcile_real_avail(self, date_from=False, date_to=False, fix=True):
+        """
+        Verify the stored real availability against the reservation lines
+        and recompute the counters that drifted.
+        :param date_from: first date to verify (today by default)
+        :param date_to: last date to verify (a year from date_from by default)
+        :param fix: if False, the drift is only reported
+        :return: list of dicts with the availability id, the stored value
+            and the real value of the drifted counters
+        """
+        date_from = date_from or fields.Date.today()
+        date_to = date_to or date_from + datetime.timedelta(days=365)
+        self.flush()
+        avails = self.search([("date", ">=", date_from), ("date", "<=", date_to)])
+        if not avails:
+            return []
+        self.env.cr.execute(
+            "SELECT id, real_avail FROM pms_availability WHERE id = ANY(%s)",
+            (avails.ids,),
+        )
+        stored = dict(self.env.cr.fetchall())
+        real_avails = avails._get_real_avail_batch()
+        drift = [
+            {
+                "avail_id": avail_id,
+                "stored": stored.get(avail_id) or 0,
+                "real": real_avail,
+            }
+            for avail_id, real_avail in real_avails.items()
+            if (stored.get(avail_id) or 0) != real_avail
+        ]
+        if drift:
+            _logger.warning(
+                "Real availability drift in %s of %s counters from %s to %s: %s",
+                len(drift),
+                len(avails),
+                date_from,
+                date_to,
+                drift[:20],
+            )
+        if drift and fix:
+            drifted = self.browse([item["avail_id"] for item in drift]).with_context(
+                real_avail_full_recompute=True
+            )
+            drifted.invalidate_cache(["real_avail"], drifted.ids)
+            self.env.add_to_compute(self._fields["real_avail"], drifted)
+            drifted.flush(["real_avail"])
+        return drift
+
+    def _get_real_avail_batch(self):
+        """
+        Compute the real availability of the whole recordset at once.
+        The occupied rooms are read with a single query per property
+        for all the dates involved, and the shared rooms (parent/child)
+        are resolved in memory.
+        :return: dict {availability id: real avail}
+        """
+        result = {}
+        records_by_property = {}
+        for record in self:
+            if record.room_type_id and record.pms_property_id and record.date:
+                records_by_property.setdefault(record.pms_property_id.id, self.browse())
+                records_by_property[record.pms_property_id.id] |= record
+            else:
+                result[record.id] = 0
+        for pms_property_id, records in records_by_property.items():
+            graph = self._get_shared_rooms_graph(pms_property_id)
+            occupied_by_date = self._get_occupied_rooms_by_date(
+                pms_property_id, set(records.mapped("date")), graph["room_ids"]
             )
-            room_ids = record.room_type_id.room_ids.filtered(
-                lambda r: r.pms_property_id == record.pms_property_id and r.active
-            ).ids
-            count_rooms_not_avail = len(
-                record.get_rooms_not_avail(
-                    checkin=record.date,
-                    checkout=record.date + datetime.timedelta(1),
-                    room_ids=room_ids,
-                    pms_property_id=record.pms_property_id.id,
+            for record in records:
+                room_ids = graph["rooms_by_type"].get(record.room_type_id.id, [])
+                occupied_room_ids = occupied_by_date.get(record.date, set())
+                rooms_not_avail = self._filter_rooms_not_avail(
+                    room_ids, occupied_room_ids, graph
                 )
+                result[record.id] = len(room_ids) - len(rooms_not_avail)
+        return result
+
+    @api.model
+    def _get_shared_rooms_graph(self, pms_property_id):
+        """
+        Load the rooms of a property with their shared rooms relations.
+        :return: dict with:
+            'room_ids': ids of all the rooms of the property,
+            'rooms_by_type': {room type id: [active room ids]},
+            'parent': {room id: parent room id},
+            'children': {room id: [active child room ids]},
+        """
+        rooms = (
+            self.env["pms.room"]
+            .with_context(active_test=False)
+            .search_read(
+                [("pms_property_id", "=", pms_property_id)],
+                ["room_type_id", "parent_id", "active"],
+            )
+        )
+        graph = {
+            "room_ids": [],
+            "rooms_by_type": {},
+            "parent": {},
+            "children": {},
+        }
+        for room in rooms:
+            graph["room_ids"].append(room["id"])
+            if room["parent_id"]:
+                graph["parent"][room["id"]] = room["parent_id"][0]
+            if not room["active"]:
+                continue
+            graph["rooms_by_type"].setdefault(room["room_type_id"][0], []).append(
+                room["id"]
+            )
+            if room["parent_id"]:
+                graph["children"].setdefault(room["parent_id"][0], []).append(
+                    room["id"]
+                )
+        return graph
+
+    @api.model
+    def _get_occupied_rooms_by_date(
+        self, pms_property_id, dates, room_ids, current_lines=False
+    ):
+        """
+        Get the rooms occupied in the given dates, from the property
+        occupancy index when it is available or with a single query.
+        :return: dict {date: set of occupied room ids}
+        """
+        if not dates or not room_ids:
+            return {}
+        self.env["pms.reservation.line"].flush(
+            ["date", "room_id", "occupies_availability", "pms_property_id"]
+        )
+        # Lines not stored yet (onchange) can not occupy any room
+        current_lines = [
+            line_id for line_id in current_lines or [] if isinstance(line_id, int)
+        ]
+        excluded_cells = Counter()
+        if current_lines:
+            self.env.cr.execute(
+                """
+                SELECT line.room_id, line.date
+                FROM   pms_reservation_line line
+                WHERE  line.occupies_availability = true
+                   AND line.pms_property_id = %s
+                   AND line.id = ANY(%s)
+                """,
+                (pms_property_id, list(current_lines)),
             )
-            record.real_avail = total_rooms - count_rooms_not_avail
+            excluded_cells.update(self.env.cr.fetchall())
+        occupied_by_date = self.env["pms.occupancy.index"].get_occupied_rooms_by_date(
+            pms_property_id, dates, room_ids, excluded_cells=excluded_cells
+        )
+        if occupied_by_date is not None:
+            return occupied_by_date
+        occupied_by_date = {}
+        self.env.cr.execute(
+            """
+            SELECT line.date, line.room_id
+            FROM   pms_reservation_line line
+            WHERE  line.occupies_availability = true
+               AND line.pms_property_id = %s
+               AND line.room_id = ANY(%s)
+               AND line.date = ANY(%s)
+               AND NOT (line.id = ANY(%s))
+            """,
+            (
+                pms_property_id,
+                list(room_ids),
+                list(dates),
+                current_lines,
+            ),
+        )
+        for date, room_id in self.env.cr.fetchall():
+            occupied_by_date.setdefault(date, set()).add(room_id)
+        return occupied_by_date
+
+    @api.model
+    def _filter_rooms_not_avail(self, room_ids, occupied_room_ids, graph):
+        """
+        Return the rooms of room_ids that can not be sold because they
+        are occupied, or any of their parent or child rooms is occupied.
+        """
+        rooms_not_avail = set()
+        if not occupied_room_ids:
+            return rooms_not_avail
+        for room_id in room_ids:
+            if room_id in occupied_room_ids:
+                rooms_not_avail.add(room_id)
+                continue
+            parent_id = graph["parent"].get(room_id)
+            while parent_id:
+                if parent_id in occupied_room_ids:
+                    rooms_not_avail.add(room_id)
+                    break
+                parent_id = graph["parent"].get(parent_id)
+            if room_id in rooms_not_avail:
+                continue
+            pending = list(graph["children"].get(room_id, []))
+            while pending:
+                child_id = pending.pop()
+                if child_id in occupied_room_ids:
+                    rooms_not_avail.add(room_id)
+                    break
+                pending.extend(graph["children"].get(child_id, []))
+        return rooms_not_avail
 
     @api.depends("reservation_line_ids", "reservation_line_ids.room_id")
     def _compute_parent_avail_id(self):
+        parent_keys = {}
         for record in self:
             parent_rooms = record.room_type_id.mapped("room_ids.parent_id")
             if parent_rooms:
-                parent_room_ids = parent_rooms.filtered(
-                    lambda r: r.pms_property_id == record.pms_property_id
-                ).ids
-                for room_id in parent_room_ids:
-                    room = self.env["pms.room"].browse(room_id)
-                    parent_avail = self.env["pms.availability"].search(
-                        [
-                            ("date", "=", record.date),
-                            ("room_type_id", "=", room.room_type_id.id),
-                            ("pms_property_id", "=", record.pms_property_id.id),
-                        ]
+                parent_keys[record] = [
+                    (room.room_type_id.id, record.date, record.pms_property_id.id)
+                    for room in parent_rooms.filtered(
+                        lambda r: r.pms_property_id == record.pms_property_id
                     )
-                    if parent_avail:
-                        record.parent_avail_id = parent_avail
-                    else:
-                        record.parent_avail_id = self.env["pms.availability"].create(
-                            {
-                                "date": record.date,
-                                "room_type_id": room.room_type_id.id,
-                                "pms_property_id": record.pms_property_id.id,
-                            }
-                        )
+                ]
+        avail_ids = self.ensure_avails(
+            {key for keys in parent_keys.values() for key in keys}
+        )
+        for record, keys in parent_keys.items():
+            for key in keys:
+                record.parent_avail_id = avail_ids[key]
 
     @api.depends("reservation_line_ids", "reservation_line_ids.room_id")
     def _compute_child_avail_ids(self):
+        child_keys = {}
         for record in self:
             child_rooms = record.room_type_id.mapped("room_ids.child_ids")
             if child_rooms:
-                child_room_ids = child_rooms.filtered(
-                    lambda r: r.pms_property_id == record.pms_property_id
-                ).ids
-                for room_id in child_room_ids:
-                    room = self.env["pms.room"].browse(room_id)
-                    child_avail = self.env["pms.availability"].search(
-                        [
-                            ("date", "=", record.date),
-                            ("room_type_id", "=", room.room_type_id.id),
-                            ("pms_property_id", "=", record.pms_property_id.id),
-                        ]
+                child_keys[record] = [
+                    (room.room_type_id.id, record.date, record.pms_property_id.id)
+                    for room in child_rooms.filtered(
+                        lambda r: r.pms_property_id == record.pms_property_id
                     )
-                    if child_avail:
-                        record.child_avail_ids = [(4, child_avail.id)]
-                    else:
-                        record.child_avail_ids = [
-                            (
-                                0,
-                                0,
-                                {
-                                    "date": record.date,
-                                    "room_type_id": room.room_type_id.id,
-                                    "pms_property_id": record.pms_property_id.id,
-                                },
-                            )
-                        ]
+                ]
+        avail_ids = self.ensure_avails(
+            {key for keys in child_keys.values() for key in keys}
+        )
+        for record, keys in child_keys.items():
+            for key in keys:
+                record.child_avail_ids = [(4, avail_ids[key])]
+
+    @api.model
+    def ensure_avails(self, keys):
+        """
+        Get the availability records of the keys, creating the missing ones.
+        :param keys: iterable of (room_type_id, date, pms_property_id)
+        :return: dict {key: availability id}
+        """
+        return self._ensure_avails(keys)[0]
+
+    @api.model
+    def _ensure_avails(self, keys):
+        """
+        Find the availability records of the keys with a single query and
+        insert the missing ones at once, skipping the rows created meanwhile
+        by other transactions (room_type_registry_unique).
+        :return: tuple (dict {key: availability id}, set of created keys)
+        """
+        keys = {key for key in keys if all(key)}
+        if not keys:
+            return {}, set()
+        self.flush(["room_type_id", "date", "pms_property_id"])
+        avail_ids = self._read_avail_ids(keys)
+        missing = keys - set(avail_ids)
+        if not missing:
+            return avail_ids, set()
+        self.check_access_rights("create")
+        missing = sorted(missing)
+        self.env.cr.execute(
+            """
+            INSERT INTO pms_availability
+                   (room_type_id, date, pms_property_id,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT key.room_type_id, key.date, key.pms_property_id,
+                   %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC')
+            FROM   unnest(%s::int[], %s::date[], %s::int[])
+                       AS key(room_type_id, date, pms_property_id)
+            ON CONFLICT (room_type_id, date, pms_property_id) DO NOTHING
+            RETURNING id, room_type_id, date, pms_property_id
+            """,
+            (
+                self.env.uid,
+                self.env.uid,
+                [key[0] for key in missing],
+                [key[1] for key in missing],
+                [key[2] for key in missing],
+            ),
+        )
+        created = {}
+        for avail_id, room_type_id, date, pms_property_id in self.env.cr.fetchall():
+            created[(room_type_id, date, pms_property_id)] = avail_id
+        avail_ids.update(created)
+        if len(created) < len(missing):
+            avail_ids.update(self._read_avail_ids(set(missing) - set(created)))
+        if created:
+            records = self.browse(list(created.values()))
+            # Same as create(): compute the stored fields of the new records
+            for field in self._fields.values():
+                if field.compute and field.store:
+                    self.env.add_to_compute(field, records)
+            records.modified(["room_type_id", "date", "pms_property_id"], create=True)
+            records._validate_fields(["room_type_id", "date", "pms_property_id"])
+            # Same checks as create() on the inserted rows
+            records.check_access_rule("create")
+            if self._check_pms_properties_auto:
+                records._check_pms_properties()
+        return avail_ids, set(created)
+
+    @api.model
+    def _read_avail_ids(self, keys):
+        keys = list(keys)
+        self.env.cr.execute(
+            """
+            SELECT avail.id, avail.room_type_id, avail.date, avail.pms_property_id
+            FROM   pms_availability avail
+                   JOIN unnest(%s::int[], %s::date[], %s::int[])
+                       AS key(room_type_id, date, pms_property_id)
+                   ON  avail.room_type_id = key.room_type_id
+                   AND avail.date = key.date
+                   AND avail.pms_property_id = key.pms_property_id
+            """,
+            (
+                [key[0] for key in keys],
+                [key[1] for key in keys],
+                [key[2] for key in keys],
+            ),
+        )
+        return {
+            (room_type_id, date, pms_property_id): avail_id
+            for avail_id, room_type_id, date, pms_property_id in self.env.cr.fetchall()
+        }
 
     @api.model
     def get_rooms_not_avail(
         self, checkin, checkout, room_ids, pms_property_id, current_lines=False
     ):
-        RoomLines = self.env["pms.reservation.line"]
-        rooms = self.env["pms.room"].browse(room_ids)
-        occupied_room_ids = []
-        for room in rooms.filtered("parent_id"):
-            if self.get_occupied_parent_rooms(
-                room=room.parent_id,
-                checkin=checkin,
-                checkout=checkout,
-            ):
-                occupied_room_ids.append(room.id)
-        for room in rooms.filtered("child_ids"):
-            if self.get_occupied_child_rooms(
-                rooms=room.child_ids,
-                checkin=checkin,
-                checkout=checkout,
-            ):
-                occupied_room_ids.append(room.id)
-        occupied_room_ids.extend(
-            RoomLines.search(
-                [
-                    ("date", ">=", checkin),
-                    ("date", "<=", checkout - datetime.timedelta(1)),
-                    ("room_id", "in", room_ids),
-                    ("pms_property_id", "=", pms_property_id),
-                    ("occupies_availability", "=", True),
-                    ("id", "not in", current_lines if current_lines else []),
-                ]
-            ).mapped("room_id.id")
+        dates = [
+            checkin + datetime.timedelta(days=x)
+            for x in range(0, (checkout - checkin).days)
+        ]
+        graph = self._get_shared_rooms_graph(pms_property_id)
+        occupied_by_date = self._get_occupied_rooms_by_date(
+            pms_property_id, dates, graph["room_ids"], current_lines
         )
-        return occupied_room_ids
+        occupied_room_ids = set()
+        for occupied in occupied_by_date.values():
+            occupied_room_ids |= self._filter_rooms_not_avail(room_ids, occupied, graph)
+        return list(occupied_room_ids)
 
     @api.model
     def get_occupied_parent_rooms(self, room, checkin, checkout):
@@ -2,10 +2,96 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
 import datetime
+from array import array
 
 from odoo import api, fields, models
 from odoo.tools import DEFAULT_SERVER_DATE_FORMAT
 
+# Key of the rule matrices loaded in the current transaction in the
+# precommit data of the cursor (cleared on commit, rollback and savepoints):
+# {(availability_plan_id, pms_property_id): AvailabilityRuleMatrix}
+RULE_MATRICES_DATA_KEY = "pms.availability.plan.rule.matrices"
+
+RULE_MATRIX_INT_FIELDS = (
+    "min_stay",
+    "min_stay_arrival",
+    "max_stay",
+    "max_stay_arrival",
+    "quota",
+    "max_avail",
+    "plan_avail",
+)
+RULE_MATRIX_FLAG_FIELDS = ("closed", "closed_arrival", "closed_departure")
+
+
+class AvailabilityRuleMatrix(object):
+    """Rules of an availability plan in a property in a date window.
+    Each room type has an array per rule field with a cell per day, and
+    a 'has_rule' bytearray marking the days with rule."""
+
+    def __init__(self, date_from, date_to):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.room_types = {}
+
+    def covers(self, date_from, date_to):
+        return self.date_from <= date_from and date_to <= self.date_to
+
+    def set_rule(self, room_type_id, date, values):
+        cells = self.room_types.get(room_type_id)
+        if cells is None:
+            days = (self.date_to - self.date_from).days + 1
+            cells = self.room_types[room_type_id] = {"has_rule": bytearray(days)}
+            for field in RULE_MATRIX_INT_FIELDS:
+                cells[field] = array("i", [0]) * days
+            for field in RULE_MATRIX_FLAG_FIELDS:
+                cells[field] = bytearray(days)
+        day = (date - self.date_from).days
+        cells["has_rule"][day] = 1
+        for field in RULE_MATRIX_INT_FIELDS:
+            cells[field][day] = values[field] or 0
+        for field in RULE_MATRIX_FLAG_FIELDS:
+            cells[field][day] = 1 if values[field] else 0
+
+    def get_rules(self, checkin, checkout, room_type_ids=False):
+        """
+        Evaluate the rules from checkin to checkout (both included) for
+        a stay, the same as any_rule_applies does with each rule.
+        :return: {room_type_id: {date: (plan_avail, rule_applies)}}
+        """
+        nights = (checkout - checkin).days
+        first_day = (checkin - self.date_from).days
+        last_day = (checkout - self.date_from).days
+        if room_type_ids is False:
+            room_type_ids = list(self.room_types)
+        rules = {}
+        for room_type_id in room_type_ids:
+            cells = self.room_types.get(room_type_id)
+            if not cells:
+                continue
+            room_type_rules = {}
+            for day in range(first_day, last_day + 1):
+                if not cells["has_rule"][day]:
+                    continue
+                min_stay_arrival = cells["min_stay_arrival"][day]
+                max_stay_arrival = cells["max_stay_arrival"][day]
+                rule_applies = (
+                    0 < cells["max_stay"][day] < nights
+                    or 0 < cells["min_stay"][day] > nights
+                    or (day == first_day and 0 < max_stay_arrival < nights)
+                    or (day == first_day and 0 < min_stay_arrival > nights)
+                    or cells["closed"][day]
+                    or (day == first_day and cells["closed_arrival"][day])
+                    or (day == last_day and cells["closed_departure"][day])
+                    or cells["quota"][day] == 0
+                    or cells["max_avail"][day] == 0
+                )
+                date = self.date_from + datetime.timedelta(days=day)
+                room_type_rules[date] = (cells["plan_avail"][day], bool(rule_applies))
+            if room_type_rules:
+                rules[room_type_id] = room_type_rules
+        return rules
+
 
 class PmsAvailabilityPlan(models.Model):
     """The room type availability is used as a daily availability plan for room types
@@ -81,6 +167,44 @@ class PmsAvailabilityPlan(models.Model):
             ]
         )
 
+    def get_rule_matrix(self, pms_property_id, date_from, date_to):
+        """
+        Return the rule matrix of the availability plan in a property
+        covering the dates, loaded with a single query and kept until
+        the rules are modified or the transaction ends.
+        """
+        self.ensure_one()
+        self.env["pms.availability.plan.rule"].flush()
+        cr = self.env.cr
+        matrices = cr.precommit.data.setdefault(RULE_MATRICES_DATA_KEY, {})
+        matrix = matrices.get((self.id, pms_property_id))
+        if matrix and matrix.covers(date_from, date_to):
+            return matrix
+        if matrix:
+            date_from = min(date_from, matrix.date_from)
+            date_to = max(date_to, matrix.date_to)
+        matrix = AvailabilityRuleMatrix(date_from, date_to)
+        cr.execute(
+            """
+            SELECT room_type_id, date, {}
+            FROM   pms_availability_plan_rule
+            WHERE  availability_plan_id = %s
+               AND pms_property_id = %s
+               AND date BETWEEN %s AND %s
+            """.format(
+                ", ".join(RULE_MATRIX_INT_FIELDS + RULE_MATRIX_FLAG_FIELDS)
+            ),
+            (self.id, pms_property_id, date_from, date_to),
+        )
+        for row in cr.dictfetchall():
+            matrix.set_rule(row["room_type_id"], row["date"], row)
+        matrices[(self.id, pms_property_id)] = matrix
+        return matrix
+
+    @api.model
+    def _invalidate_rule_matrices(self):
+        self.env.cr.precommit.data.pop(RULE_MATRICES_DATA_KEY, None)
+
     @api.model
     def update_quota(
         self,
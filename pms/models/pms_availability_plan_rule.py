@@ -118,29 +118,31 @@ class PmsAvailabilityPlanRule(models.Model):
         )
     ]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env["pms.availability.plan"]._invalidate_rule_matrices()
+        return super().create(vals_list)
+
+    def _write(self, vals):
+        # Stored computed fields (quota, plan_avail...) are flushed with _write
+        self.env["pms.availability.plan"]._invalidate_rule_matrices()
+        return super()._write(vals)
+
+    def unlink(self):
+        self.env["pms.availability.plan"]._invalidate_rule_matrices()
+        return super().unlink()
+
     @api.depends("room_type_id", "date", "pms_property_id")
     def _compute_avail_id(self):
+        avail_ids = self.env["pms.availability"].ensure_avails(
+            (record.room_type_id.id, record.date, record.pms_property_id.id)
+            for record in self
+        )
         for record in self:
-            if record.room_type_id and record.pms_property_id and record.date:
-                avail = self.env["pms.availability"].search(
-                    [
-                        ("date", "=", record.date),
-                        ("room_type_id", "=", record.room_type_id.id),
-                        ("pms_property_id", "=", record.pms_property_id.id),
-                    ]
-                )
-                if avail:
-                    record.avail_id = avail.id
-                else:
-                    record.avail_id = self.env["pms.availability"].create(
-                        {
-                            "date": record.date,
-                            "room_type_id": record.room_type_id.id,
-                            "pms_property_id": record.pms_property_id.id,
-                        }
-                    )
-            else:
-                record.avail_id = False
+            record.avail_id = avail_ids.get(
+                (record.room_type_id.id, record.date, record.pms_property_id.id),
+                False,
+            )
 
     @api.depends("quota", "max_avail", "real_avail")
     def _compute_plan_avail(self):
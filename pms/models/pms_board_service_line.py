@@ -62,32 +62,27 @@ class PmsBoardServiceLine(models.Model):
 
     @api.depends_context("allowed_pms_property_ids")
     def _compute_amount(self):
+        pms_property_id = (
+            self.env.context.get("property")
+            or self.env.user.get_active_property_ids()[0]
+        )
+        amounts = self.env["ir.pms.property"].get_field_values(
+            pms_property_id, self, "amount"
+        )
         for record in self:
-            pms_property_id = (
-                self.env.context.get("property")
-                or self.env.user.get_active_property_ids()[0]
-            )
-            record.amount = self.env["ir.pms.property"].get_field_value(
-                pms_property_id,
-                self._name,
-                "amount",
-                record.id,
-                type(record.amount),
-            )
+            record.amount = amounts.get(record.id, False)
 
     def _inverse_amount(self):
-        for record in self:
-            pms_property_id = (
-                self.env.context.get("property")
-                or self.env.user.get_active_property_ids()[0]
-            )
-            self.env["ir.pms.property"].set_field_value(
-                pms_property_id,
-                self._name,
-                "amount",
-                record.id,
-                record.amount,
-            )
+        pms_property_id = (
+            self.env.context.get("property")
+            or self.env.user.get_active_property_ids()[0]
+        )
+        self.env["ir.pms.property"].set_field_values(
+            pms_property_id,
+            self._name,
+            "amount",
+            {record.id: record.amount for record in self},
+        )
 
     @api.onchange("product_id")
     def onchange_product_id(self):
@@ -846,26 +846,101 @@ class PmsCheckinPartner(models.Model):
 
     @api.model
     def import_room_list_json(self, roomlist_json):
-        roomlist_json = json.loads(roomlist_json)
-        for checkin_dict in roomlist_json:
+        errors = self.import_room_list(json.loads(roomlist_json))
+        if errors:
+            raise ValidationError("\n".join(errors))
+
+    @api.model
+    def import_room_list(self, roomlist):
+        """
+        Write the values of a room list in their checkin partners, looking up
+        all the checkin partners and related records at once and writing the
+        checkins with the same values together. The rows that can not be
+        imported do not prevent importing the rest.
+        :param roomlist: list of dicts with the checkin identifier, the
+            reservation_id and the checkin values, optionally with the
+            "row" label used in the error messages
+        :return: list of error messages of the rows not imported
+        """
+        identifiers = [checkin_dict["identifier"] for checkin_dict in roomlist]
+        checkins = self.sudo().search([("identifier", "in", identifiers)])
+        checkins_by_identifier = {checkin.identifier: checkin for checkin in checkins}
+        names_by_field = {}
+        for checkin_dict in roomlist:
+            for key, value in checkin_dict.items():
+                field = self._fields.get(key)
+                if field and field.type == "many2one" and isinstance(value, str):
+                    names_by_field.setdefault(key, set()).add(value)
+        ids_by_name = {}
+        for fname, names in names_by_field.items():
+            comodel = self.env[self._fields[fname].comodel_name]
+            ids_by_name[fname] = {
+                record.name: record.id
+                for record in comodel.search([("name", "in", list(names))])
+            }
+        errors = []
+        rows_by_vals = {}
+        for count, checkin_dict in enumerate(roomlist, 1):
+            row = checkin_dict.get("row") or _("Row %s") % count
             identifier = checkin_dict["identifier"]
-            reservation_id = checkin_dict["reservation_id"]
-            checkin = (
-                self.sudo()
-                .env["pms.checkin.partner"]
-                .search([("identifier", "=", identifier)])
-            )
-            reservation = self.env["pms.reservation"].browse(reservation_id)
+            checkin = checkins_by_identifier.get(identifier)
             if not checkin:
-                raise ValidationError(
-                    _("%s not found in checkins (%s)"), identifier, reservation.name
+                reservation = self.env["pms.reservation"].browse(
+                    checkin_dict["reservation_id"]
                 )
-            checkin_vals = {}
-            for key, value in checkin_dict.items():
-                if key in ("reservation_id", "folio_id", "identifier"):
+                errors.append(
+                    _("%s: %s not found in checkins (%s)")
+                    % (row, identifier, reservation.name)
+                )
+                continue
+            try:
+                checkin_vals = self._get_room_list_vals(checkin_dict, ids_by_name)
+            except ValueError as e:
+                errors.append("%s: %s" % (row, e))
+                continue
+            rows_by_vals.setdefault(tuple(sorted(checkin_vals.items())), []).append(
+                (row, checkin)
+            )
+        for vals, rows in rows_by_vals.items():
+            checkins = self.sudo().browse([checkin.id for row, checkin in rows])
+            try:
+                with self.env.cr.savepoint():
+                    checkins.write(dict(vals))
+                continue
+            except Exception as e:
+                if len(rows) == 1:
+                    errors.append("%s: %s" % (rows[0][0], e))
                     continue
-                checkin_vals[key] = value
-            checkin.write(checkin_vals)
+            # Retry the checkins one by one to find the rows with errors
+            for row, checkin in rows:
+                try:
+                    with self.env.cr.savepoint():
+                        checkin.write(dict(vals))
+                except Exception as e:
+                    errors.append("%s: %s" % (row, e))
+        return errors
+
+    @api.model
+    def _get_room_list_vals(self, checkin_dict, ids_by_name):
+        checkin_vals = {}
+        for key, value in checkin_dict.items():
+            if key in ("reservation_id", "folio_id", "identifier", "row"):
+                continue
+            field = self._fields[key]
+            if value in (None, ""):
+                value = False
+            elif field.type == "many2one" and isinstance(value, str):
+                if value not in ids_by_name.get(key, {}):
+                    raise ValueError(_("%s not found (%s)") % (field.string, value))
+                value = ids_by_name[key][value]
+            elif field.type in ("date", "datetime") and isinstance(value, datetime):
+                value = field.to_string(value.date() if field.type == "date" else value)
+            elif field.type == "char" and isinstance(value, int):
+                value = str(value)
+            elif field.type == "char" and isinstance(value, float):
+                value = str(int(value)) if value.is_integer() else str(value)
+            checkin_vals[key] = value
+        return checkin_vals
 
     @api.model
     def calculate_doc_type_expedition_date_from_validity_date(
@@ -4,6 +4,9 @@
 
 import datetime
 import logging
+import weakref
+from collections import Counter
+from contextlib import contextmanager
 from itertools import groupby
 
 from odoo import _, api, fields, models
@@ -13,6 +16,17 @@ from odoo.tools.misc import get_lang
 
 _logger = logging.getLogger(__name__)
 
+# Folio computations deferred in each transaction, by cursor
+_DEFERRED_RECOMPUTE = weakref.WeakKeyDictionary()
+# Folio computations deferred and done at the end of the deferrals in
+# this worker
+_DEFERRED_RECOMPUTE_STATS = Counter()
+DEFERRED_RECOMPUTE_METHODS = (
+    "_compute_sale_line_ids",
+    "_compute_amount_all",
+    "_compute_amount",
+)
+
 
 class PmsFolio(models.Model):
     _name = "pms.folio"
@@ -489,7 +503,7 @@ class PmsFolio(models.Model):
         string="Max reservation priority on the entire folio",
         help="Max reservation priority on the entire folio",
         compute="_compute_max_reservation_priority",
-        store=True,
+        search="_search_max_reservation_priority",
     )
     invoice_status = fields.Selection(
         string="Invoice Status",
@@ -817,10 +831,12 @@ class PmsFolio(models.Model):
         "reservation_ids.state",
     )
     def _compute_sale_line_ids(self):
-        for folio in self.filtered(lambda f: isinstance(f.id, int)):
+        folios = self._filter_deferred_compute("_compute_sale_line_ids")
+        for folio in folios.filtered(lambda f: isinstance(f.id, int)):
             sale_lines_vals = []
+            sale_lines_vals_to_drop = []
+            has_lines = False
             if folio.reservation_type in ("normal", "staff"):
-                sale_lines_vals_to_drop = []
                 seq = 0
                 for reservation in sorted(
                     folio.reservation_ids.filtered(lambda r: isinstance(r.id, int)),
@@ -828,55 +844,51 @@ class PmsFolio(models.Model):
                 ):
                     seq += reservation.folio_sequence
                     # RESERVATION LINES
-                    reservation_sale_lines = []
-                    reservation_sale_lines_to_drop = []
                     if reservation.reservation_line_ids:
                         (
                             reservation_sale_lines,
                             reservation_sale_lines_to_drop,
+                            lines_count,
                         ) = self._get_reservation_sale_lines(
                             folio, reservation, sequence=seq
                         )
-                    if reservation_sale_lines:
                         sale_lines_vals.extend(reservation_sale_lines)
-                    if reservation_sale_lines_to_drop:
                         sale_lines_vals_to_drop.extend(reservation_sale_lines_to_drop)
-                    seq += len(reservation_sale_lines)
+                        has_lines = True
+                        seq += lines_count
                     # RESERVATION SERVICES
-                    service_sale_lines = []
-                    service_sale_lines_to_drop = []
                     if reservation.service_ids:
                         (
                             service_sale_lines,
                             service_sale_lines_to_drop,
+                            lines_count,
                         ) = self._get_service_sale_lines(
                             folio,
                             reservation,
                             sequence=seq,
                         )
-                        if service_sale_lines:
-                            sale_lines_vals.extend(service_sale_lines)
-                        if service_sale_lines_to_drop:
-                            sale_lines_vals_to_drop.extend(service_sale_lines_to_drop)
-                    seq += len(service_sale_lines)
+                        sale_lines_vals.extend(service_sale_lines)
+                        sale_lines_vals_to_drop.extend(service_sale_lines_to_drop)
+                        has_lines = has_lines or bool(lines_count)
+                        seq += lines_count
                 # FOLIO SERVICES
                 if folio.service_ids.filtered(lambda r: not r.reservation_id):
-                    service_sale_lines = False
-                    service_sale_lines_to_drop = False
                     (
                         service_sale_lines,
                         service_sale_lines_to_drop,
+                        lines_count,
                     ) = self._get_folio_services_sale_lines(folio, sequence=seq + 1)
-                    if service_sale_lines:
-                        sale_lines_vals.extend(service_sale_lines)
-                    if service_sale_lines_to_drop:
-                        sale_lines_vals_to_drop.extend(service_sale_lines_to_drop)
-                if sale_lines_vals:
-                    folio.sale_line_ids = sale_lines_vals
-                if sale_lines_vals_to_drop:
-                    self.env["folio.sale.line"].browse(sale_lines_vals_to_drop).unlink()
-            if not sale_lines_vals:
+                    sale_lines_vals.extend(service_sale_lines)
+                    sale_lines_vals_to_drop.extend(service_sale_lines_to_drop)
+                    has_lines = has_lines or bool(lines_count)
+            if not has_lines:
                 folio.sale_line_ids = False
+                continue
+            # Only the sale lines that change are written
+            if sale_lines_vals:
+                folio.sale_line_ids = sale_lines_vals
+            if sale_lines_vals_to_drop:
+                self.env["folio.sale.line"].browse(sale_lines_vals_to_drop).unlink()
 
     @api.depends("pms_property_id")
     def _compute_company_id(self):
@@ -1178,7 +1190,7 @@ class PmsFolio(models.Model):
         """
         Compute the total amounts of the SO.
         """
-        for folio in self:
+        for folio in self._filter_deferred_compute("_compute_amount_all"):
             amount_untaxed = amount_tax = 0.0
             for line in folio.sale_line_ids:
                 amount_untaxed += line.price_subtotal
@@ -1250,80 +1262,182 @@ class PmsFolio(models.Model):
         "move_ids.amount_residual",
     )
     def _compute_amount(self):
-        for record in self:
-            if record.reservation_type == "out":
-                record.amount_total = 0
-                vals = {
-                    "payment_state": "nothing_to_pay",
-                    "pending_amount": 0,
-                    "invoices_paid": 0,
-                }
-                record.update(vals)
-            else:
-                # first attempt compute amount search payments refs with only one folio
-                mls_one_folio = (
-                    record.payment_ids.filtered(lambda pay: len(pay.folio_ids) == 1)
-                    .mapped("move_id.line_ids")
-                    .filtered(
-                        lambda x: x.account_id.internal_type == "receivable"
-                        and x.parent_state == "posted"
-                    )
-                )
-                advance_amount = record._get_advance_amount(mls_one_folio)
-                # Compute 'payment_state'.
-                vals = record._get_amount_vals(mls_one_folio, advance_amount)
-                # If folio its not paid, search payments refs with more than one folio
-                folio_ids = record.payment_ids.mapped("folio_ids.id")
-                if vals["pending_amount"] > 0 and len(folio_ids) > 1:
-                    folios = self.env["pms.folio"].browse(folio_ids)
-                    mls_multi_folio = folios.payment_ids.mapped(
-                        "move_id.line_ids"
-                    ).filtered(
-                        lambda x: x.account_id.internal_type == "receivable"
-                        and x.parent_state == "posted"
+        folios = self._filter_deferred_compute("_compute_amount")
+        for record in folios.filtered(lambda f: f.reservation_type == "out"):
+            record.amount_total = 0
+            vals = {
+                "payment_state": "nothing_to_pay",
+                "pending_amount": 0,
+                "invoices_paid": 0,
+            }
+            record.update(vals)
+        folios = folios.filtered(lambda f: f.reservation_type != "out")
+        if not folios:
+            return
+        (
+            payments_by_folio,
+            folios_by_payment,
+            amounts_by_payment,
+        ) = folios._get_payments_amounts_data()
+        for record in folios:
+            payment_ids = payments_by_folio.get(record._origin.id, set())
+            # first attempt compute amount search payments refs with only one folio
+            one_folio_payment_ids = {
+                payment_id
+                for payment_id in payment_ids
+                if len(folios_by_payment[payment_id]) == 1
+            }
+            advance_amount = record._get_advance_amount(
+                one_folio_payment_ids, amounts_by_payment
+            )
+            # Compute 'payment_state'.
+            vals = record._get_amount_vals(
+                any(amounts_by_payment.get(p) for p in one_folio_payment_ids),
+                advance_amount,
+            )
+            # If folio its not paid, search payments refs with more than one folio
+            folio_ids = set()
+            for payment_id in payment_ids:
+                folio_ids |= folios_by_payment[payment_id]
+            if vals["pending_amount"] > 0 and len(folio_ids) > 1:
+                multi_folio_payment_ids = set()
+                for folio_id in folio_ids:
+                    multi_folio_payment_ids |= payments_by_folio.get(folio_id, set())
+                if any(amounts_by_payment.get(p) for p in multi_folio_payment_ids):
+                    vals = record._get_amount_vals(
+                        True,
+                        record._get_advance_amount(
+                            multi_folio_payment_ids, amounts_by_payment
+                        ),
+                        list(folio_ids),
+                        folio_advance_amount=advance_amount,
                     )
-                    if mls_multi_folio:
-                        advance_amount = record._get_advance_amount(mls_multi_folio)
-                        vals = record._get_amount_vals(
-                            mls_multi_folio, advance_amount, folio_ids
-                        )
 
-                record.update(vals)
+            record.update(vals)
 
-    def _get_advance_amount(self, mls):
+    def _get_payments_amounts_data(self):
+        """
+        Read the payments of the folios, the folios of those payments and
+        the payments of those folios, and the posted receivable amounts of
+        all these payments aggregated by currency and date.
+        :return: ({folio_id: set of payment ids},
+            {payment_id: set of folio ids},
+            {payment_id: [(currency_id, date, amount)]})
+        """
+        self.flush(["payment_ids"])
+        self.env["account.payment"].flush(["folio_ids", "move_id"])
+        self.env["account.move.line"].flush(
+            [
+                "move_id",
+                "account_id",
+                "parent_state",
+                "currency_id",
+                "amount_currency",
+                "balance",
+                "date",
+                "company_id",
+            ]
+        )
+        self.env["account.account"].flush(["internal_type"])
+        payments_by_folio = {}
+        folios_by_payment = {}
+
+        def add_relations(rows):
+            for folio_id, payment_id in rows:
+                payments_by_folio.setdefault(folio_id, set()).add(payment_id)
+                folios_by_payment.setdefault(payment_id, set()).add(folio_id)
+
+        folio_ids = [folio._origin.id for folio in self if folio._origin.id]
+        if not folio_ids:
+            return payments_by_folio, folios_by_payment, {}
+        self.env.cr.execute(
+            """
+            SELECT folio_id, payment_id
+            FROM   account_payment_folio_rel
+            WHERE  payment_id IN (
+                       SELECT payment_id
+                       FROM   account_payment_folio_rel
+                       WHERE  folio_id = ANY(%s)
+                   )
+            """,
+            (folio_ids,),
+        )
+        add_relations(self.env.cr.fetchall())
+        # Payments of the other folios paid with the same payments
+        other_folio_ids = list(set(payments_by_folio) - set(folio_ids))
+        if other_folio_ids:
+            self.env.cr.execute(
+                """
+                SELECT folio_id, payment_id
+                FROM   account_payment_folio_rel
+                WHERE  folio_id = ANY(%s)
+                """,
+                (other_folio_ids,),
+            )
+            add_relations(self.env.cr.fetchall())
+        amounts_by_payment = {}
+        if folios_by_payment:
+            self.env.cr.execute(
+                """
+                SELECT   pay.id,
+                         COALESCE(aml.currency_id, company.currency_id),
+                         aml.date,
+                         -SUM(CASE WHEN aml.currency_id IS NOT NULL
+                                   THEN aml.amount_currency
+                                   ELSE aml.balance END)
+                FROM     account_payment pay
+                JOIN     account_move_line aml ON aml.move_id = pay.move_id
+                JOIN     account_account account ON account.id = aml.account_id
+                JOIN     res_company company ON company.id = aml.company_id
+                WHERE    pay.id = ANY(%s)
+                   AND   account.internal_type = 'receivable'
+                   AND   aml.parent_state = 'posted'
+                GROUP BY pay.id, 2, aml.date
+                """,
+                (list(folios_by_payment),),
+            )
+            for payment_id, currency_id, date, amount in self.env.cr.fetchall():
+                amounts_by_payment.setdefault(payment_id, []).append(
+                    (currency_id, date, amount)
+                )
+        return payments_by_folio, folios_by_payment, amounts_by_payment
+
+    def _get_advance_amount(self, payment_ids, amounts_by_payment):
+        """Sum the amounts of the payments in the folio currency"""
         self.ensure_one()
         advance_amount = 0.0
-        for line in mls:
-            line_currency = line.currency_id or line.company_id.currency_id
-            line_amount = line.amount_currency if line.currency_id else line.balance
-            line_amount *= -1
-            if line_currency != self.currency_id:
-                advance_amount += line.currency_id._convert(
-                    line_amount,
-                    self.currency_id,
-                    self.company_id,
-                    line.date or fields.Date.today(),
-                )
-            else:
-                advance_amount += line_amount
+        for payment_id in payment_ids:
+            for currency_id, date, amount in amounts_by_payment.get(payment_id, []):
+                if currency_id != self.currency_id.id:
+                    advance_amount += (
+                        self.env["res.currency"]
+                        .browse(currency_id)
+                        ._convert(
+                            amount,
+                            self.currency_id,
+                            self.company_id,
+                            date or fields.Date.today(),
+                        )
+                    )
+                else:
+                    advance_amount += amount
         return advance_amount
 
-    def _get_amount_vals(self, mls, advance_amount, folio_ids=False):
+    def _get_amount_vals(
+        self, has_payments, advance_amount, folio_ids=False, folio_advance_amount=0.0
+    ):
+        """
+        :param has_payments: whether any posted receivable line was found
+        :param advance_amount: amount paid by the payments of the folios
+        :param folio_ids: folios sharing payments with this folio
+        :param folio_advance_amount: amount paid by the payments of only
+            this folio, with folio_ids
+        """
         self.ensure_one()
         folios = self
         if folio_ids:
             folios = self.env["pms.folio"].browse(folio_ids)
-            mls_one_folio = (
-                self.payment_ids.filtered(lambda pay: len(pay.folio_ids) == 1)
-                .mapped("move_id.line_ids")
-                .filtered(
-                    lambda x: x.account_id.internal_type == "receivable"
-                    and x.parent_state == "posted"
-                )
-            )
-            amount_folio_residual = self.amount_total - self._get_advance_amount(
-                mls_one_folio
-            )
+            amount_folio_residual = self.amount_total - folio_advance_amount
             amount_total_residual = sum(folios.mapped("amount_total")) - advance_amount
         else:
             amount_folio_residual = amount_total_residual = (
@@ -1338,7 +1452,7 @@ class PmsFolio(models.Model):
         #         total = total - sum(folio.service_ids.mapped("price_total"))
         payment_state = "not_paid"
         if (
-            mls
+            has_payments
             and float_compare(
                 amount_total_residual,
                 total,
@@ -1370,9 +1484,29 @@ class PmsFolio(models.Model):
 
     @api.depends("reservation_ids", "reservation_ids.priority")
     def _compute_max_reservation_priority(self):
-        for record in self.filtered("reservation_ids"):
+        for record in self:
             reservation_priors = record.reservation_ids.mapped("priority")
-            record.max_reservation_priority = max(reservation_priors)
+            record.max_reservation_priority = max(reservation_priors, default=0)
+
+    def _search_max_reservation_priority(self, operator, value):
+        if operator not in ("=", "!=", ">=", ">", "<=", "<"):
+            raise UserError(
+                _("Unsupported operator %s for searching on priority") % (operator,)
+            )
+        self.env["pms.reservation"].flush(
+            ["folio_id", "priority_base", "priority_factor", "priority_date"]
+        )
+        query = """
+            SELECT   folio_id
+            FROM     pms_reservation
+            GROUP BY folio_id
+            HAVING   MAX(priority_base
+                         + priority_factor * COALESCE(priority_date - %s, 0))
+                     {operator} %s
+        """.format(
+            operator=operator
+        )
+        return [("id", "inselect", (query, (fields.date.today(), value)))]
 
     def _compute_checkin_partner_count(self):
         for record in self:
@@ -2195,8 +2329,7 @@ class PmsFolio(models.Model):
 
         # Review: force to autoreconcile payment with invoices already created
         pay.flush()
-        for move in folio.move_ids:
-            move._autoreconcile_folio_payments()
+        folio.move_ids._autoreconcile_folio_payments()
 
         # Automatic register payment in cash register
         # TODO: cash_register to avoid flow in the new api (delete it in the future)
@@ -2395,8 +2528,16 @@ class PmsFolio(models.Model):
 
     @api.model
     def _get_reservation_sale_lines(self, folio, reservation, sequence):
+        """
+        Return the commands to synchronize the sale lines of the reservation
+        with its nights, the ids of the sale lines to remove and the number
+        of sale lines (section included) of the reservation
+        """
         sale_reservation_vals = []
-        if not reservation.sale_line_ids.filtered(lambda x: x.name == reservation.name):
+        section = reservation.sale_line_ids.filtered(
+            lambda x: x.name == reservation.name
+        )
+        if not section:
             sale_reservation_vals.append(
                 (
                     0,
@@ -2417,148 +2558,114 @@ class PmsFolio(models.Model):
             )
         else:
             sequence += 1
-            sale_reservation_vals.append(
-                (
-                    1,
-                    reservation.sale_line_ids.filtered(
-                        lambda x: x.name == reservation.name
-                    ).id,
-                    {
-                        "sequence": sequence,
-                    },
-                )
-            )
-        expected_reservation_lines = self.env["pms.reservation.line"].read_group(
-            [
-                ("reservation_id", "=", reservation.id),
-                ("cancel_discount", "<", 100),
-            ],
-            ["price", "discount", "cancel_discount", "default_invoice_to"],
-            ["price", "discount", "cancel_discount", "default_invoice_to"],
-            lazy=False,
-        )
+            if section.sequence != sequence:
+                sale_reservation_vals.append((1, section.id, {"sequence": sequence}))
+        groups = self._group_lines_to_sale(reservation.reservation_line_ids, "price")
         current_sale_line_ids = reservation.sale_line_ids.filtered(
             lambda x: x.reservation_id.id == reservation.id
             and not x.display_type
             and not x.service_id
         )
-
-        for index, item in enumerate(expected_reservation_lines):
+        pairs, folio_sale_lines_to_remove = self._match_sale_lines(
+            groups, current_sale_line_ids, "reservation_line_ids"
+        )
+        for (price, discount, cancel_discount, partner), lines, sale_line in pairs:
             sequence += 1
-            lines_to = self.env["pms.reservation.line"].search(item["__domain"])
-            final_discount = self.concat_discounts(
-                item["discount"], item["cancel_discount"]
-            )
-            partner_invoice = lines_to.mapped("default_invoice_to")
-            if current_sale_line_ids and index <= (len(current_sale_line_ids) - 1):
-                current = {
-                    "price_unit": item["price"],
-                    "discount": final_discount,
-                    "reservation_line_ids": [(6, 0, lines_to.ids)],
-                    "sequence": sequence,
-                    "default_invoice_to": partner_invoice[0].id
-                    if partner_invoice
-                    else current_sale_line_ids[index].default_invoice_to,
-                }
-                sale_reservation_vals.append(
-                    (1, current_sale_line_ids[index].id, current)
-                )
+            vals = {
+                "price_unit": price,
+                "discount": self.concat_discounts(discount, cancel_discount),
+                "reservation_line_ids": [(6, 0, lines.ids)],
+                "sequence": sequence,
+            }
+            if sale_line:
+                if partner:
+                    vals["default_invoice_to"] = partner.id
+                vals = self._get_sale_line_changed_vals(sale_line, vals)
+                if vals:
+                    sale_reservation_vals.append((1, sale_line.id, vals))
             else:
-                new = {
-                    "reservation_id": reservation.id,
-                    "price_unit": item["price"],
-                    "discount": final_discount,
-                    "folio_id": folio.id,
-                    "product_id": reservation.room_type_id.product_id.id,
-                    "tax_ids": [(6, 0, reservation.tax_ids.ids)],
-                    "reservation_line_ids": [(6, 0, lines_to.ids)],
-                    "sequence": sequence,
-                    "default_invoice_to": partner_invoice[0].id
-                    if partner_invoice
-                    else False,
-                }
-                sale_reservation_vals.append((0, 0, new))
-        folio_sale_lines_to_remove = []
-        if len(expected_reservation_lines) < len(current_sale_line_ids):
-            folio_sale_lines_to_remove = [
-                value.id
-                for index, value in enumerate(current_sale_line_ids)
-                if index > (len(expected_reservation_lines) - 1)
-            ]
-        return sale_reservation_vals, folio_sale_lines_to_remove
+                vals.update(
+                    {
+                        "reservation_id": reservation.id,
+                        "folio_id": folio.id,
+                        "product_id": reservation.room_type_id.product_id.id,
+                        "tax_ids": [(6, 0, reservation.tax_ids.ids)],
+                        "default_invoice_to": partner.id,
+                    }
+                )
+                sale_reservation_vals.append((0, 0, vals))
+        return (
+            sale_reservation_vals,
+            folio_sale_lines_to_remove.ids,
+            len(groups) + 1,
+        )
 
     @api.model
     def _get_service_sale_lines(self, folio, reservation, sequence):
+        """
+        Return the commands to synchronize the sale lines of the reservation
+        services with their service lines, the ids of the sale lines to
+        remove and the number of sale lines of the services
+        """
         sale_service_vals = []
-        folio_sale_lines_to_remove = []
+        folio_sale_lines_to_remove = self.env["folio.sale.line"]
+        lines_count = 0
         for service in reservation.service_ids:
-            expected_reservation_services = self.env["pms.service.line"].read_group(
-                [
-                    ("reservation_id", "=", reservation.id),
-                    ("service_id", "=", service.id),
-                    ("cancel_discount", "<", 100),
-                ],
-                ["price_unit", "discount", "cancel_discount", "default_invoice_to"],
-                ["price_unit", "discount", "cancel_discount", "default_invoice_to"],
-                lazy=False,
+            groups = self._group_lines_to_sale(
+                service.service_line_ids.filtered(
+                    lambda x: x.reservation_id == reservation
+                ),
+                "price_unit",
             )
             current_sale_service_ids = reservation.sale_line_ids.filtered(
                 lambda x: x.reservation_id.id == reservation.id
                 and not x.display_type
                 and x.service_id.id == service.id
             )
-
-            for index, item in enumerate(expected_reservation_services):
-                lines_to = self.env["pms.service.line"].search(item["__domain"])
-                final_discount = self.concat_discounts(
-                    item["discount"], item["cancel_discount"]
-                )
-                partner_invoice = lines_to.mapped("default_invoice_to")
-                if current_sale_service_ids and index <= (
-                    len(current_sale_service_ids) - 1
-                ):
-                    current = {
-                        "price_unit": item["price_unit"],
-                        "discount": final_discount,
-                        "service_line_ids": [(6, 0, lines_to.ids)],
-                        "sequence": sequence,
-                        "default_invoice_to": partner_invoice[0].id
-                        if partner_invoice
-                        else current_sale_service_ids[index].default_invoice_to,
-                    }
-                    sale_service_vals.append(
-                        (1, current_sale_service_ids[index].id, current)
-                    )
+            pairs, sale_lines_left = self._match_sale_lines(
+                groups, current_sale_service_ids, "service_line_ids"
+            )
+            for (price, discount, cancel_discount, partner), lines, sale_line in pairs:
+                vals = {
+                    "price_unit": price,
+                    "discount": self.concat_discounts(discount, cancel_discount),
+                    "service_line_ids": [(6, 0, lines.ids)],
+                    "sequence": sequence,
+                }
+                if sale_line:
+                    if partner:
+                        vals["default_invoice_to"] = partner.id
+                    vals = self._get_sale_line_changed_vals(sale_line, vals)
+                    if vals:
+                        sale_service_vals.append((1, sale_line.id, vals))
                 else:
-                    new = {
-                        "service_id": service.id,
-                        "price_unit": item["price_unit"],
-                        "discount": final_discount,
-                        "folio_id": folio.id,
-                        "reservation_id": reservation.id,
-                        "service_line_ids": [(6, 0, lines_to.ids)],
-                        "product_id": service.product_id.id,
-                        "tax_ids": [(6, 0, service.tax_ids.ids)],
-                        "sequence": sequence,
-                        "default_invoice_to": partner_invoice[0].id
-                        if partner_invoice
-                        else False,
-                    }
-                    sale_service_vals.append((0, 0, new))
+                    vals.update(
+                        {
+                            "service_id": service.id,
+                            "folio_id": folio.id,
+                            "reservation_id": reservation.id,
+                            "product_id": service.product_id.id,
+                            "tax_ids": [(6, 0, service.tax_ids.ids)],
+                            "default_invoice_to": partner.id,
+                        }
+                    )
+                    sale_service_vals.append((0, 0, vals))
                 sequence = sequence + 1
-            if len(expected_reservation_services) < len(current_sale_service_ids):
-                folio_sale_lines_to_remove = [
-                    value.id
-                    for index, value in enumerate(current_sale_service_ids)
-                    if index > (len(expected_reservation_services) - 1)
-                ]
-        return sale_service_vals, folio_sale_lines_to_remove
+            folio_sale_lines_to_remove |= sale_lines_left
+            lines_count += len(groups)
+        return sale_service_vals, folio_sale_lines_to_remove.ids, lines_count
 
     @api.model
     def _get_folio_services_sale_lines(self, folio, sequence):
+        """
+        Return the commands to synchronize the sale lines of the services
+        without reservation with their service lines, the ids of the sale
+        lines to remove and the number of sale lines of the services
+        """
         folio_services = folio.service_ids.filtered(lambda x: not x.reservation_id)
         sale_folio_lines = []
-        sale_folio_lines_to_remove = []
+        sale_folio_lines_to_remove = self.env["folio.sale.line"]
+        lines_count = 0
         if folio_services:
             if not folio.sale_line_ids.filtered(lambda x: x.name == _("Others")):
                 folio.sale_line_ids = [
@@ -2579,16 +2686,12 @@ class PmsFolio(models.Model):
                 ]
             for folio_service in folio_services:
                 sequence += 1
-                expected_folio_services = self.env["pms.service.line"].read_group(
-                    [
-                        ("service_id.folio_id", "=", folio.id),
-                        ("service_id", "=", folio_service.id),
-                        ("reservation_id", "=", False),
-                        ("cancel_discount", "<", 100),
-                    ],
-                    ["price_unit", "discount", "cancel_discount"],
-                    ["price_unit", "discount", "cancel_discount"],
-                    lazy=False,
+                groups = self._group_lines_to_sale(
+                    folio_service.service_line_ids.filtered(
+                        lambda x: not x.reservation_id
+                    ),
+                    "price_unit",
+                    by_partner=False,
                 )
                 current_folio_service_ids = folio.sale_line_ids.filtered(
                     lambda x: x.service_id.folio_id.id == folio.id
@@ -2596,47 +2699,115 @@ class PmsFolio(models.Model):
                     and not x.reservation_id
                     and x.service_id.id == folio_service.id
                 )
-
-                for index, item in enumerate(expected_folio_services):
-                    lines_to = self.env["pms.service.line"].search(item["__domain"])
-                    final_discount = self.concat_discounts(
-                        item["discount"], item["cancel_discount"]
-                    )
-                    if current_folio_service_ids and index <= (
-                        len(current_folio_service_ids) - 1
-                    ):
-                        current = {
-                            "price_unit": item["price_unit"],
-                            "discount": final_discount,
-                            "service_line_ids": [(6, 0, lines_to.ids)],
-                            "sequence": sequence,
-                        }
-                        sale_folio_lines.append(
-                            (1, current_folio_service_ids[index].id, current)
-                        )
+                pairs, sale_lines_left = self._match_sale_lines(
+                    groups, current_folio_service_ids, "service_line_ids"
+                )
+                for (
+                    (price, discount, cancel_discount, _partner),
+                    lines,
+                    sale_line,
+                ) in pairs:
+                    vals = {
+                        "price_unit": price,
+                        "discount": self.concat_discounts(discount, cancel_discount),
+                        "service_line_ids": [(6, 0, lines.ids)],
+                        "sequence": sequence,
+                    }
+                    if sale_line:
+                        vals = self._get_sale_line_changed_vals(sale_line, vals)
+                        if vals:
+                            sale_folio_lines.append((1, sale_line.id, vals))
                     else:
-                        new = {
-                            "service_id": folio_service.id,
-                            "price_unit": item["price_unit"],
-                            "discount": final_discount,
-                            "folio_id": folio.id,
-                            "service_line_ids": [(6, 0, lines_to.ids)],
-                            "product_id": folio_service.product_id.id,
-                            "tax_ids": [(6, 0, folio_service.tax_ids.ids)],
-                            "sequence": sequence,
-                        }
-                        sale_folio_lines.append((0, 0, new))
-                if len(expected_folio_services) < len(current_folio_service_ids):
-                    sale_folio_lines_to_remove = [
-                        value.id
-                        for index, value in enumerate(current_folio_service_ids)
-                        if index > (len(expected_folio_services) - 1)
-                    ]
+                        vals.update(
+                            {
+                                "service_id": folio_service.id,
+                                "folio_id": folio.id,
+                                "product_id": folio_service.product_id.id,
+                                "tax_ids": [(6, 0, folio_service.tax_ids.ids)],
+                            }
+                        )
+                        sale_folio_lines.append((0, 0, vals))
+                sale_folio_lines_to_remove |= sale_lines_left
+                lines_count += len(groups)
         else:
             sale_folio_lines_to_remove = folio.sale_line_ids.filtered(
                 lambda x: x.name == _("Others")
             )
-        return sale_folio_lines, sale_folio_lines_to_remove
+        return sale_folio_lines, sale_folio_lines_to_remove.ids, lines_count
+
+    @api.model
+    def _group_lines_to_sale(self, lines, price_field, by_partner=True):
+        """
+        Group the reservation or service lines not fully cancelled by
+        price, discount, cancel discount and invoice partner, in the
+        order of a read_group by those fields.
+        :return: list of ((price, discount, cancel_discount, partner), lines)
+        """
+        groups = {}
+        for line in lines:
+            if line.cancel_discount >= 100:
+                continue
+            key = (
+                line[price_field],
+                line.discount,
+                line.cancel_discount,
+                line.default_invoice_to if by_partner else False,
+            )
+            groups.setdefault(key, []).append(line.id)
+        return [
+            (key, lines.browse(line_ids))
+            for key, line_ids in sorted(
+                groups.items(),
+                key=lambda item: item[0][:3]
+                + (
+                    not item[0][3],
+                    item[0][3] and item[0][3].display_name or "",
+                    item[0][3] and item[0][3].id or 0,
+                ),
+            )
+        ]
+
+    @api.model
+    def _match_sale_lines(self, groups, sale_lines, lines_field):
+        """
+        Pair each group of lines with a current sale line: the sale line
+        already linked to the same lines if any, otherwise the first sale
+        line not paired yet.
+        :return: list of (key, lines, sale line or False) and the sale
+            lines not paired
+        """
+        by_lines = {}
+        for sale_line in sale_lines:
+            by_lines.setdefault(frozenset(sale_line[lines_field].ids), sale_line)
+        pairs = []
+        paired_ids = set()
+        for key, lines in groups:
+            sale_line = by_lines.pop(frozenset(lines.ids), False)
+            if sale_line:
+                paired_ids.add(sale_line.id)
+            pairs.append([key, lines, sale_line])
+        free_sale_lines = [
+            sale_line for sale_line in sale_lines if sale_line.id not in paired_ids
+        ]
+        for pair in pairs:
+            if not pair[2] and free_sale_lines:
+                pair[2] = free_sale_lines.pop(0)
+        return pairs, sale_lines.browse([sale_line.id for sale_line in free_sale_lines])
+
+    @api.model
+    def _get_sale_line_changed_vals(self, sale_line, vals):
+        """Return the values of vals that differ from the sale line ones"""
+        changed_vals = {}
+        for field_name, value in vals.items():
+            field = sale_line._fields[field_name]
+            if field.type in ("one2many", "many2many"):
+                if set(sale_line[field_name].ids) != set(value[0][2]):
+                    changed_vals[field_name] = value
+            elif field.convert_to_cache(value, sale_line) != field.convert_to_cache(
+                sale_line[field_name], sale_line
+            ):
+                changed_vals[field_name] = value
+        return changed_vals
 
     @api.model
     def _prepare_down_payment_section_line(self, **optional_values):
@@ -2674,6 +2845,86 @@ class PmsFolio(models.Model):
         )
         return UserError(msg)
 
+    @api.model
+    @contextmanager
+    def _defer_recompute(self):
+        """
+        Defer the computation of the sale lines and amounts of the folios
+        modified inside the block, computing each folio once at the end:
+
+            with self.env["pms.folio"]._defer_recompute():
+                reservations.write(...)
+
+        The values of those fields are stale inside the block. If the
+        block raises, the deferred computations are dropped with the
+        transaction changes.
+        """
+        cr = self.env.cr
+        deferral = _DEFERRED_RECOMPUTE.setdefault(cr, {"depth": 0, "pending": set()})
+        deferral["depth"] += 1
+        try:
+            yield
+        finally:
+            deferral["depth"] -= 1
+            if not deferral["depth"]:
+                _DEFERRED_RECOMPUTE.pop(cr, None)
+        if not deferral["depth"]:
+            folios = self._mark_deferred_to_compute(deferral["pending"])
+            _DEFERRED_RECOMPUTE_STATS["recomputed"] += len(deferral["pending"])
+            folios.recompute()
+
+    def _filter_deferred_compute(self, method):
+        """
+        Return the folios to compute now with the method, registering the
+        others to compute at the end of the current deferral
+        """
+        deferral = _DEFERRED_RECOMPUTE.get(self.env.cr)
+        if not deferral:
+            return self
+        folios = self.filtered(lambda f: isinstance(f.id, int))
+        deferral["pending"].update((method, folio_id) for folio_id in folios.ids)
+        _DEFERRED_RECOMPUTE_STATS["deferred"] += len(folios)
+        return self - folios
+
+    @api.model
+    def _mark_deferred_to_compute(self, pending):
+        """Mark the fields of the deferred computations to compute, and the
+        fields depending on them"""
+        folio_ids_by_method = {}
+        for method, folio_id in pending:
+            folio_ids_by_method.setdefault(method, set()).add(folio_id)
+        all_folios = self.browse()
+        for method, folio_ids in folio_ids_by_method.items():
+            folios = self.browse(folio_ids).exists()
+            fields_to_compute = [
+                field
+                for field in self._fields.values()
+                if field.store and field.compute == method
+            ]
+            for field in fields_to_compute:
+                self.env.add_to_compute(field, folios)
+            folios.modified([field.name for field in fields_to_compute])
+            all_folios |= folios
+        return all_folios
+
+    @api.model
+    def get_deferred_recompute_stats(self):
+        """
+        Folio computations deferred inside _defer_recompute blocks in this
+        worker, and done at the end of the blocks
+        :return: dict with 'deferred', 'recomputed' and 'coalesced'
+        """
+        return {
+            "deferred": _DEFERRED_RECOMPUTE_STATS["deferred"],
+            "recomputed": _DEFERRED_RECOMPUTE_STATS["recomputed"],
+            "coalesced": _DEFERRED_RECOMPUTE_STATS["deferred"]
+            - _DEFERRED_RECOMPUTE_STATS["recomputed"],
+        }
+
+    @api.model
+    def reset_deferred_recompute_stats(self):
+        _DEFERRED_RECOMPUTE_STATS.clear()
+
     @api.model
     def concat_discounts(self, discount, cancel_discount):
         discount_factor = 1.0
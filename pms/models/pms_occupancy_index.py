@@ -0,0 +1,349 @@
+import datetime
+import logging
+import threading
+import weakref
+
+from odoo import api, models
+
+_logger = logging.getLogger(__name__)
+
+# Occupancy indexes loaded in this worker: {dbname: {pms_property_id:
+# PropertyOccupancy}}
+_INDEXES = {}
+_INDEXES_LOCK = threading.RLock()
+# State of the transactions using the index, by cursor
+_TRANSACTIONS = weakref.WeakKeyDictionary()
+
+# Days loaded around the requested dates when an index is built
+INDEX_MARGIN_DAYS = 90
+INDEX_FIELDS = ("room_id", "date", "occupies_availability", "pms_property_id")
+# Key of the pending signaling flag in the precommit data of the cursor
+SIGNAL_DATA_KEY = "pms.occupancy.index.signal"
+
+
+class PropertyOccupancy(object):
+    """Room x day occupancy counters of a property in a date window.
+    Each room has a bytearray with a cell per day storing how many
+    reservation lines occupy the room that day (saturated to 255).
+    """
+
+    def __init__(self, date_from, date_to):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.rooms = {}
+        self.version = 0
+
+    def covers(self, dates):
+        return all(self.date_from <= date <= self.date_to for date in dates)
+
+    def _cells(self, room_id):
+        cells = self.rooms.get(room_id)
+        if cells is None:
+            cells = self.rooms[room_id] = bytearray(
+                (self.date_to - self.date_from).days + 1
+            )
+        return cells
+
+    def set_count(self, room_id, date, count):
+        if self.date_from <= date <= self.date_to:
+            self._cells(room_id)[(date - self.date_from).days] = min(count, 255)
+
+    def get_count(self, room_id, date):
+        cells = self.rooms.get(room_id)
+        return cells[(date - self.date_from).days] if cells else 0
+
+
+class PmsOccupancyIndex(models.AbstractModel):
+    """Per property occupancy index used to answer which rooms are occupied
+    without querying the reservation lines each time.
+
+    The index of a property is built lazily in each worker with the committed
+    reservation lines and patched after every commit that changes them.
+
+    Every transaction that changes the occupancy of a property inserts a row
+    of the property in pms_occupancy_index_signaling before committing, so the
+    version of a property (the sum of the weights of its rows) changes in the
+    same commit as its reservation lines. An index is only used by the
+    transactions that see its version, and the transactions that modify the
+    reservation lines of a property keep answering from the database for that
+    property until they are committed.
+    """
+
+    _name = "pms.occupancy.index"
+    _description = "Occupancy Index"
+
+    def init(self):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pms_occupancy_index_signaling (
+                pms_property_id integer NOT NULL,
+                weight integer NOT NULL DEFAULT 1,
+                txid bigint NOT NULL DEFAULT txid_current()
+            )
+            """
+        )
+        cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS pms_occupancy_index_signaling_property_idx
+            ON pms_occupancy_index_signaling (pms_property_id, txid)
+            """
+        )
+
+    @api.model
+    def _get_transaction(self):
+        cr = self.env.cr
+        transaction = _TRANSACTIONS.get(cr)
+        if transaction is None:
+            transaction = _TRANSACTIONS[cr] = {
+                "versions": {},
+                "touched": {},
+                "rooms_changed": set(),
+            }
+            cr.postcommit.add(self._on_commit)
+            cr.postrollback.add(self._on_rollback)
+        return transaction
+
+    @api.model
+    def _get_db_indexes(self):
+        with _INDEXES_LOCK:
+            return _INDEXES.setdefault(self.env.cr.dbname, {})
+
+    @api.model
+    def _read_version(self, pms_property_id, cr=None):
+        cr = cr or self.env.cr
+        cr.execute(
+            """
+            SELECT COALESCE(SUM(weight), 0)
+            FROM   pms_occupancy_index_signaling
+            WHERE  pms_property_id = %s
+            """,
+            (pms_property_id,),
+        )
+        return cr.fetchone()[0]
+
+    @api.model
+    def _get_version(self, pms_property_id):
+        """Version of the property occupancy seen by the current
+        transaction, read once per transaction"""
+        versions = self._get_transaction()["versions"]
+        if pms_property_id not in versions:
+            versions[pms_property_id] = self._read_version(pms_property_id)
+        return versions[pms_property_id]
+
+    @api.model
+    def _get_property_index(self, pms_property_id, dates):
+        """
+        Return the occupancy index of the property covering the dates,
+        building it if it is cold. Returns None if the index can not be
+        used in this transaction (the property occupancy was modified and
+        not committed yet, or the index has other version than the one
+        seen by the transaction), so that the caller falls back to SQL.
+        """
+        if not dates:
+            return None
+        transaction = self._get_transaction()
+        if pms_property_id in transaction["touched"]:
+            return None
+        version = self._get_version(pms_property_id)
+        db_indexes = self._get_db_indexes()
+        index = db_indexes.get(pms_property_id)
+        if index and index.version > version:
+            # The transaction started before the last changes
+            return None
+        if index and index.version == version and index.covers(dates):
+            return index
+        date_from = min(dates) - datetime.timedelta(days=INDEX_MARGIN_DAYS)
+        date_to = max(dates) + datetime.timedelta(days=INDEX_MARGIN_DAYS)
+        if index and index.version == version:
+            date_from = min(date_from, index.date_from)
+            date_to = max(date_to, index.date_to)
+        index = self._build_property_index(pms_property_id, date_from, date_to)
+        with _INDEXES_LOCK:
+            current = db_indexes.get(pms_property_id)
+            if not current or current.version <= index.version:
+                db_indexes[pms_property_id] = index
+        return index if index.version == version else None
+
+    @api.model
+    def _build_property_index(self, pms_property_id, date_from, date_to):
+        # The index only contains committed occupancy: it is read with a new
+        # cursor, whose version and reservation lines belong to the same
+        # snapshot
+        index = PropertyOccupancy(date_from, date_to)
+        with self.pool.cursor() as cr:
+            index.version = self._read_version(pms_property_id, cr=cr)
+            cr.execute(
+                """
+                SELECT room_id, date, COUNT(*)
+                FROM   pms_reservation_line
+                WHERE  occupies_availability = true
+                   AND room_id IS NOT NULL
+                   AND pms_property_id = %s
+                   AND date BETWEEN %s AND %s
+                GROUP  BY room_id, date
+                """,
+                (pms_property_id, date_from, date_to),
+            )
+            for room_id, date, count in cr.fetchall():
+                index.set_count(room_id, date, count)
+        return index
+
+    @api.model
+    def get_occupied_rooms_by_date(
+        self, pms_property_id, dates, room_ids, excluded_cells=False
+    ):
+        """
+        Return {date: set of occupied room ids} from the index, or None
+        if the index can not be used.
+        :param excluded_cells: Counter of (room_id, date) occupied by lines
+            that must not be taken into account
+        """
+        index = self._get_property_index(pms_property_id, dates)
+        if index is None:
+            return None
+        excluded_cells = excluded_cells or {}
+        occupied_by_date = {}
+        for date in dates:
+            occupied = {
+                room_id
+                for room_id in room_ids
+                if index.get_count(room_id, date)
+                > excluded_cells.get((room_id, date), 0)
+            }
+            if occupied:
+                occupied_by_date[date] = occupied
+        return occupied_by_date
+
+    # Changes tracking
+    @api.model
+    def _touch(self, keys):
+        """Register the (pms_property_id, room_id, date) cells modified by
+        the current transaction"""
+        if not keys:
+            return
+        transaction = self._get_transaction()
+        for pms_property_id, room_id, date in keys:
+            if not pms_property_id:
+                continue
+            cells = transaction["touched"].setdefault(pms_property_id, set())
+            if room_id and date:
+                cells.add((room_id, date))
+        # The precommit callbacks are run (and cleared) by the savepoints
+        # too, the signal is registered again after them
+        precommit = self.env.cr.precommit
+        if not precommit.data.get(SIGNAL_DATA_KEY):
+            precommit.data[SIGNAL_DATA_KEY] = True
+            precommit.add(self._signal_changes)
+
+    @api.model
+    def _touch_rooms(self, pms_property_ids):
+        """Register the properties whose rooms (room types, shared rooms,
+        active...) were modified by the current transaction"""
+        self._get_transaction()["rooms_changed"].update(pms_property_ids)
+
+    @api.model
+    def get_touched_cells(self, pms_property_id):
+        """
+        Return the (room_id, date) cells of the property modified by the
+        current transaction, or None if its rooms were modified.
+        """
+        transaction = self._get_transaction()
+        if pms_property_id in transaction["rooms_changed"]:
+            return None
+        return transaction["touched"].get(pms_property_id, set())
+
+    @api.model
+    def _read_line_keys(self, line_ids):
+        if not line_ids:
+            return []
+        self.env.cr.execute(
+            """
+            SELECT pms_property_id, room_id, date
+            FROM   pms_reservation_line
+            WHERE  id = ANY(%s)
+            """,
+            (list(line_ids),),
+        )
+        return self.env.cr.fetchall()
+
+    def _signal_changes(self):
+        """Bump the version of the properties modified by the transaction,
+        once per transaction and property"""
+        transaction = _TRANSACTIONS.get(self.env.cr)
+        if not transaction or not transaction["touched"]:
+            return
+        self.env.cr.execute(
+            """
+            INSERT INTO pms_occupancy_index_signaling (pms_property_id)
+            SELECT property.id
+            FROM   unnest(%s::integer[]) AS property(id)
+            WHERE  NOT EXISTS (
+                SELECT 1
+                FROM   pms_occupancy_index_signaling signal
+                WHERE  signal.pms_property_id = property.id
+                   AND signal.txid = txid_current()
+            )
+            """,
+            (list(transaction["touched"]),),
+        )
+
+    @api.model
+    def compact_signaling(self):
+        """Replace the signaling rows of each property by a single row with
+        the same version"""
+        self.env.cr.execute(
+            """
+            WITH deleted AS (
+                DELETE FROM pms_occupancy_index_signaling
+                RETURNING pms_property_id, weight
+            )
+            INSERT INTO pms_occupancy_index_signaling (pms_property_id, weight)
+            SELECT pms_property_id, SUM(weight)
+            FROM   deleted
+            GROUP  BY pms_property_id
+            """
+        )
+
+    def _on_rollback(self):
+        _TRANSACTIONS.pop(self.env.cr, None)
+
+    def _on_commit(self):
+        cr = self.env.cr
+        transaction = _TRANSACTIONS.pop(cr, None)
+        if not transaction or not transaction["touched"]:
+            return
+        db_indexes = self._get_db_indexes()
+        # The cursor is in a new transaction, it reads the committed data
+        for pms_property_id, cells in transaction["touched"].items():
+            index = db_indexes.get(pms_property_id)
+            if not index:
+                continue
+            version = self._read_version(pms_property_id)
+            counts = {}
+            room_ids = list({room_id for room_id, date in cells})
+            if room_ids:
+                cr.execute(
+                    """
+                    SELECT room_id, date, COUNT(*)
+                    FROM   pms_reservation_line
+                    WHERE  occupies_availability = true
+                       AND pms_property_id = %s
+                       AND room_id = ANY(%s)
+                       AND date = ANY(%s)
+                    GROUP  BY room_id, date
+                    """,
+                    (pms_property_id, room_ids, list({d for r, d in cells})),
+                )
+                counts = {(room_id, date): c for room_id, date, c in cr.fetchall()}
+            with _INDEXES_LOCK:
+                if db_indexes.get(pms_property_id) is not index:
+                    continue
+                if index.version + 1 != version:
+                    # Other transactions changed the occupancy of the
+                    # property meanwhile
+                    del db_indexes[pms_property_id]
+                    continue
+                for room_id, date in cells:
+                    index.set_count(room_id, date, counts.get((room_id, date), 0))
+                index.version = version
@@ -4,7 +4,9 @@
 
 import base64
 import datetime
+import logging
 import time
+from collections import defaultdict
 
 import pytz
 from dateutil.relativedelta import relativedelta
@@ -16,6 +18,11 @@ from odoo.tools import DEFAULT_SERVER_DATE_FORMAT
 
 from odoo.addons.base.models.res_partner import _tz_get
 
+_logger = logging.getLogger(__name__)
+
+# Default folios invoiced by each autoinvoicing job
+AUTOINVOICING_BATCH_SIZE = 50
+
 
 def get_default_logo():
     with open(
@@ -284,30 +291,22 @@ class PmsProperty(models.Model):
             )
             if pricelist_id and not real_avail:
                 # TODO: only closed_departure take account checkout date!
-                domain_rules = [
-                    ("date", ">=", checkin),
-                    ("date", "<=", checkout),
-                    ("pms_property_id", "=", pms_property.id),
-                ]
-                if room_type_id:
-                    domain_rules.append(("room_type_id", "=", room_type_id))
-
                 pricelist = self.env["product.pricelist"].browse(pricelist_id)
                 if pricelist.availability_plan_id:
-                    domain_rules.append(
-                        ("availability_plan_id", "=", pricelist.availability_plan_id.id)
+                    rules = pricelist.availability_plan_id.get_rule_matrix(
+                        pms_property.id, checkin, checkout
+                    ).get_rules(
+                        checkin, checkout, [room_type_id] if room_type_id else False
                     )
-                    rule_items = self.env["pms.availability.plan.rule"].search(
-                        domain_rules
-                    )
-
-                    if len(rule_items) > 0:
-                        room_types_to_remove = []
-                        for item in rule_items:
-                            if pricelist.availability_plan_id.any_rule_applies(
-                                checkin, checkout, item
-                            ):
-                                room_types_to_remove.append(item.room_type_id.id)
+                    room_types_to_remove = [
+                        rule_room_type_id
+                        for rule_room_type_id, room_type_rules in rules.items()
+                        if any(
+                            rule_applies
+                            for plan_avail, rule_applies in room_type_rules.values()
+                        )
+                    ]
+                    if room_types_to_remove:
                         free_rooms = free_rooms.filtered(
                             lambda x: x.room_type_id.id not in room_types_to_remove
                         )
@@ -422,42 +421,135 @@ class PmsProperty(models.Model):
             if current_lines and not isinstance(current_lines, list):
                 current_lines = [current_lines]
 
-            domain_rules = [
-                ("date", ">=", checkin),
-                ("date", "<=", checkout),
-                ("pms_property_id", "=", pms_property.id),
-            ]
-            if room_type_id:
-                domain_rules.append(("room_type_id", "=", room_type_id))
-
             pricelist = False
             if pricelist_id:
                 pricelist = self.env["product.pricelist"].browse(pricelist_id)
             if pricelist and pricelist.availability_plan_id and not real_avail:
-                domain_rules.append(
-                    ("availability_plan_id", "=", pricelist.availability_plan_id.id)
+                rules = pricelist.availability_plan_id.get_rule_matrix(
+                    pms_property.id, checkin, checkout
+                ).get_rules(
+                    checkin, checkout, [room_type_id] if room_type_id else False
                 )
-                rule_groups = self.env["pms.availability.plan.rule"].read_group(
-                    domain_rules,
-                    ["plan_avail:sum"],
-                    ["date:day"],
-                    lazy=False,
-                )
-                if len(rule_groups) > 0:
+                if rules:
                     # If in the group per day, some room type has the sale blocked,
                     # we must subtract from that day the availability of that room type
-                    for group in rule_groups:
-                        items = self.env["pms.availability.plan.rule"].search(
-                            group["__domain"]
-                        )
-                        for item in items:
-                            if pricelist.availability_plan_id.any_rule_applies(
-                                checkin, checkout, item
-                            ):
-                                group["plan_avail"] -= item.plan_avail
-                    count_free_rooms = min(i["plan_avail"] for i in rule_groups)
+                    plan_avail_by_date = {}
+                    for room_type_rules in rules.values():
+                        for date, (plan_avail, rule_applies) in room_type_rules.items():
+                            plan_avail_by_date.setdefault(date, 0)
+                            if not rule_applies:
+                                plan_avail_by_date[date] += plan_avail
+                    count_free_rooms = min(plan_avail_by_date.values())
             record.availability = count_free_rooms
 
+    def get_availability_matrix(
+        self,
+        checkin,
+        checkout,
+        pricelist_id=False,
+        room_type_ids=False,
+        real_avail=False,
+        current_lines=False,
+    ):
+        """
+        Compute the availability of all the room types of the property for
+        all the nights of a stay with a constant number of queries.
+        :param room_type_ids: room types to compute, all the room types
+            of the property if not set
+        :param real_avail: if True, the availability plan rules are ignored
+        :return: dict {room_type_id: {
+            'free_room_ids': rooms free for the whole stay,
+            'availability': same value than the 'availability' field
+                computed with the room type in context,
+            'dates': {date: {
+                'free_rooms': free rooms that night,
+                'plan_avail': plan avail of the rule (None without rule),
+                'rule_applies': if a rule restricts the stay that day,
+            }},
+        }}
+        """
+        self.ensure_one()
+        if isinstance(checkin, str):
+            checkin = datetime.datetime.strptime(
+                checkin, DEFAULT_SERVER_DATE_FORMAT
+            ).date()
+        if isinstance(checkout, str):
+            checkout = datetime.datetime.strptime(
+                checkout, DEFAULT_SERVER_DATE_FORMAT
+            ).date()
+        if room_type_ids is False:
+            room_type_ids = (
+                self.env["pms.room.type"]
+                .search(
+                    [
+                        "|",
+                        ("pms_property_ids", "=", False),
+                        ("pms_property_ids", "in", self.id),
+                    ]
+                )
+                .ids
+            )
+        Avail = self.env["pms.availability"]
+        nights = [
+            checkin + datetime.timedelta(days=x)
+            for x in range(0, (checkout - checkin).days)
+        ]
+        graph = Avail._get_shared_rooms_graph(self.id)
+        occupied_by_date = Avail._get_occupied_rooms_by_date(
+            self.id, nights, graph["room_ids"], current_lines
+        )
+        matrix = {}
+        for room_type_id in room_type_ids:
+            room_ids = graph["rooms_by_type"].get(room_type_id, [])
+            rooms_not_avail = set()
+            dates = {}
+            for night in nights:
+                night_not_avail = Avail._filter_rooms_not_avail(
+                    room_ids, occupied_by_date.get(night, set()), graph
+                )
+                rooms_not_avail |= night_not_avail
+                dates[night] = {
+                    "free_rooms": len(room_ids) - len(night_not_avail),
+                    "plan_avail": None,
+                    "rule_applies": False,
+                }
+            free_room_ids = [
+                room_id for room_id in room_ids if room_id not in rooms_not_avail
+            ]
+            matrix[room_type_id] = {
+                "free_room_ids": free_room_ids,
+                "availability": len(free_room_ids),
+                "dates": dates,
+            }
+
+        pricelist = self.env["product.pricelist"].browse(pricelist_id)
+        if not pricelist or not pricelist.availability_plan_id or real_avail:
+            return matrix
+        rules = pricelist.availability_plan_id.get_rule_matrix(
+            self.id, checkin, checkout
+        ).get_rules(checkin, checkout, room_type_ids)
+        rule_avails = {}
+        for room_type_id, room_type_rules in rules.items():
+            room_type_avail = matrix[room_type_id]
+            for date, (plan_avail, rule_applies) in room_type_rules.items():
+                date_avail = room_type_avail["dates"].setdefault(
+                    date, {"free_rooms": None}
+                )
+                date_avail.update(
+                    {"plan_avail": plan_avail, "rule_applies": rule_applies}
+                )
+                rule_avails.setdefault(room_type_id, []).append(
+                    0 if rule_applies else plan_avail
+                )
+                if rule_applies:
+                    room_type_avail["free_room_ids"] = []
+        for room_type_id, room_type_avail in matrix.items():
+            if room_type_id in rule_avails:
+                room_type_avail["availability"] = min(rule_avails[room_type_id])
+            else:
+                room_type_avail["availability"] = len(room_type_avail["free_room_ids"])
+        return matrix
+
     @api.model
     def splitted_availability(
         self,
@@ -625,65 +717,94 @@ class PmsProperty(models.Model):
 
     @api.model
     def daily_closing(
-        self, pms_property_ids, room_type_ids=False, availability_plan_ids=False
+        self,
+        pms_property_ids,
+        room_type_ids=False,
+        availability_plan_ids=False,
+        with_delay=False,
     ):
         """
         This method is used to close the daily availability of rooms
+        :param room_type_ids: room types to close, by default the room
+            types of each property
+        :param availability_plan_ids: availability plans to close, by
+            default the availability plans of each property
+        :param with_delay: close each property in a queue job
         """
         pms_properties = self.browse(pms_property_ids)
+        if with_delay:
+            for pms_property in pms_properties:
+                self.with_delay(
+                    description=_("Daily closing of %s") % pms_property.name
+                ).daily_closing(pms_property.ids, room_type_ids, availability_plan_ids)
+            return True
+        today = fields.date.today()
+        room_types = (
+            self.env["pms.room.type"].browse(room_type_ids)
+            if room_type_ids
+            else self.env["pms.room.type"].search([])
+        )
+        availability_plans = (
+            self.env["pms.availability.plan"].browse(availability_plan_ids)
+            if availability_plan_ids
+            else self.env["pms.availability.plan"].search([])
+        )
+        keys = set()
         for pms_property in pms_properties:
+            property_room_types = room_types
             if not room_type_ids:
-                room_type_ids = (
-                    self.env["pms.room.type"]
-                    .search(
-                        [
-                            "|",
-                            ("pms_property_ids", "in", pms_property.id),
-                            ("pms_property_ids", "=", False),
-                        ]
-                    )
-                    .ids
+                property_room_types = room_types.filtered(
+                    lambda r: not r.pms_property_ids
+                    or pms_property in r.pms_property_ids
                 )
+            property_availability_plans = availability_plans
             if not availability_plan_ids:
-                availability_plan_ids = (
-                    self.env["pms.availability.plan"]
-                    .search(
-                        [
-                            "|",
-                            ("pms_property_ids", "in", pms_property.id),
-                            ("pms_property_ids", "=", False),
-                        ]
-                    )
-                    .ids
+                property_availability_plans = availability_plans.filtered(
+                    lambda p: not p.pms_property_ids
+                    or pms_property in p.pms_property_ids
                 )
-            for room_type in self.env["pms.room.type"].browse(room_type_ids):
-                for availability_plan in self.env["pms.availability.plan"].browse(
-                    availability_plan_ids
-                ):
-                    rule = self.env["pms.availability.plan.rule"].search(
-                        [
-                            ("pms_property_id", "=", pms_property.id),
-                            ("room_type_id", "=", room_type.id),
-                            ("availability_plan_id", "=", availability_plan.id),
-                            ("date", "=", fields.date.today()),
-                        ]
-                    )
-                    if not rule:
-                        rule = self.env["pms.availability.plan.rule"].create(
-                            {
-                                "pms_property_id": pms_property.id,
-                                "room_type_id": room_type.id,
-                                "availability_plan_id": availability_plan.id,
-                                "date": fields.date.today(),
-                                "closed": True,
-                            }
-                        )
-                    elif not rule.closed:
-                        rule.write(
-                            {
-                                "closed": True,
-                            }
-                        )
+            keys.update(
+                (pms_property.id, room_type.id, availability_plan.id)
+                for room_type in property_room_types
+                for availability_plan in property_availability_plans
+            )
+        if not keys:
+            return True
+        Rule = self.env["pms.availability.plan.rule"]
+        rules = Rule.search(
+            [
+                ("pms_property_id", "in", pms_properties.ids),
+                ("room_type_id", "in", room_types.ids),
+                ("availability_plan_id", "in", availability_plans.ids),
+                ("date", "=", today),
+            ]
+        )
+        existing_keys = set()
+        rule_ids_to_close = []
+        for rule in rules:
+            key = (
+                rule.pms_property_id.id,
+                rule.room_type_id.id,
+                rule.availability_plan_id.id,
+            )
+            existing_keys.add(key)
+            if key in keys and not rule.closed:
+                rule_ids_to_close.append(rule.id)
+        Rule.browse(rule_ids_to_close).write({"closed": True})
+        Rule.create(
+            [
+                {
+                    "pms_property_id": pms_property_id,
+                    "room_type_id": room_type_id,
+                    "availability_plan_id": availability_plan_id,
+                    "date": today,
+                    "closed": True,
+                }
+                for pms_property_id, room_type_id, availability_plan_id in sorted(
+                    keys - existing_keys
+                )
+            ]
+        )
         return True
 
     @api.model
@@ -718,11 +839,9 @@ class PmsProperty(models.Model):
                         "Not invoiced due to pending amounts and cancelled reservations"
                     )
                 )
-        for folio in folios_to_invoice:
-            if with_delay:
-                self.with_delay().autoinvoice_folio(folio)
-            else:
-                self.autoinvoice_folio(folio)
+        self._autoinvoice_folios_by_batches(
+            folios_to_invoice, date_reference, with_delay=with_delay
+        )
         # 2- Validate the draft invoices created by the folios
         draft_invoices_to_post = self.env["account.move"].search(
             [
@@ -731,11 +850,16 @@ class PmsProperty(models.Model):
                 ("folio_ids", "!=", False),
             ]
         )
-        for invoice in draft_invoices_to_post:
-            if with_delay:
+        if with_delay:
+            for invoice in draft_invoices_to_post:
                 self.with_delay().autovalidate_folio_invoice(invoice)
-            else:
-                self.autovalidate_folio_invoice(invoice)
+        else:
+            # The payments of the posted invoices are reconciled at once
+            for invoice in draft_invoices_to_post:
+                self.autovalidate_folio_invoice(
+                    invoice.with_context(skip_autoreconcile_folio_payments=True)
+                )
+            draft_invoices_to_post._autoreconcile_folio_payments()
 
         # 3- Reverse the downpayment invoices that not was included in final invoice
         downpayments_invoices_to_reverse = self.env["account.move.line"].search(
@@ -802,79 +926,194 @@ class PmsProperty(models.Model):
         except Exception as e:
             invoice.message_post(body=_("Error in autovalidate invoice: " + str(e)))
 
+    @api.model
+    def _autoinvoice_folios_by_batches(self, folios, date_reference, with_delay=False):
+        """
+        Invoice the folios in batches of the same property, invoice journal
+        and invoice date, registering the run in a pms.autoinvoicing.run.
+        With with_delay, each batch is a job in the autoinvoicing sub-channel
+        of its property, so that the properties are invoiced concurrently
+        (according to the capacity of the channels in the job runner). The
+        sub-channels are not declared: the job runner runs the ones without
+        configured capacity in the autoinvoicing channel. The jobs are
+        identified by their batch, so that a batch is never enqueued twice.
+        """
+        batch_size = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("pms.autoinvoicing_batch_size", AUTOINVOICING_BATCH_SIZE)
+        )
+        groups = defaultdict(list)
+        for folio in folios:
+            groups[self._get_autoinvoicing_batch_key(folio)].append(folio.id)
+        batches_vals = []
+        for (pms_property, journal, _invoice_date), folio_ids in groups.items():
+            for index in range(0, len(folio_ids), batch_size):
+                batches_vals.append(
+                    {
+                        "pms_property_id": pms_property.id,
+                        "journal_id": journal.id,
+                        "folio_ids": [(6, 0, folio_ids[index : index + batch_size])],
+                    }
+                )
+        run = (
+            self.env["pms.autoinvoicing.run"]
+            .sudo()
+            .create(
+                {
+                    "date_reference": date_reference,
+                    "batch_ids": [(0, 0, vals) for vals in batches_vals],
+                }
+            )
+        )
+        for number, batch in enumerate(run.batch_ids, 1):
+            if with_delay:
+                self.with_delay(
+                    channel="root.autoinvoicing folios.property_%s"
+                    % batch.pms_property_id.id,
+                    identity_key="pms_autoinvoicing_batch_%s" % batch.id,
+                    description=_("Autoinvoicing %s: batch %s of %s")
+                    % (batch.pms_property_id.name, number, len(run.batch_ids)),
+                ).autoinvoice_folios(batch.folio_ids, batch)
+            else:
+                self.autoinvoice_folios(batch.folio_ids, batch)
+        return run
+
+    @api.model
+    def _get_autoinvoicing_batch_key(self, folio):
+        """
+        Return the (property, journal, invoice date) of the invoices of the
+        folio, the folios invoiced in the same _create_invoices call must
+        share the invoice date computed by the invoicing policy.
+        """
+        pms_property = folio.pms_property_id
+        lines = folio.sale_line_ids.filtered(
+            lambda line: line.qty_to_invoice > 0
+            and line.autoinvoice_date
+            and line.autoinvoice_date <= fields.Date.today()
+        )
+        journal = pms_property.with_context(
+            autoinvoice=True
+        )._get_folio_default_journal(lines[:1].default_invoice_to.id)
+        invoice_date = False
+        if pms_property.default_invoicing_policy == "checkout":
+            invoice_date = max(lines.reservation_id.mapped("checkout"), default=False)
+        return pms_property, journal, invoice_date
+
     def autoinvoice_folio(self, folio):
         try:
             with self.env.cr.savepoint():
-                # REVIEW: folio sale line "_compute_auotinvoice_date" sometimes
-                # dont work in services (probably cache issue¿?), we ensure that the date is
-                # set or recompute this
-                for line in folio.sale_line_ids.filtered(
-                    lambda l: not l.autoinvoice_date
-                ):
-                    line._compute_autoinvoice_date()
-                invoices = folio.with_context(autoinvoice=True)._create_invoices(
-                    grouped=True,
-                    final=False,
-                )
-                downpayments = folio.sale_line_ids.filtered(
-                    lambda l: l.is_downpayment and l.qty_invoiced > 0
-                )
-                for invoice in invoices:
-                    if (
-                        invoice.amount_total
-                        > invoice.pms_property_id.max_amount_simplified_invoice
-                        and invoice.journal_id.is_simplified_invoice
-                    ):
-                        hosts_to_invoice = (
-                            invoice.folio_ids.partner_invoice_ids.filtered(
-                                lambda p: p._check_enought_invoice_data()
-                            ).mapped("id")
-                        )
-                        if hosts_to_invoice:
-                            invoice.partner_id = hosts_to_invoice[0]
-                            invoice.journal_id = (
-                                invoice.pms_property_id.journal_normal_invoice_id
-                            )
-                        else:
-                            mens = _(
-                                "The total amount of the simplified invoice is higher than the "
-                                "maximum amount allowed for simplified invoices, and dont have "
-                                "enought data in hosts to create a normal invoice."
-                            )
-                            folio.sudo().message_post(body=mens)
-                            raise ValidationError(mens)
-                    for downpayment in downpayments.filtered(
-                        lambda d: d.default_invoice_to == invoice.partner_id
-                    ):
-                        # If the downpayment invoice partner is the same that the
-                        # folio partner, we include the downpayment in the normal invoice
-                        invoice_down_payment_vals = downpayment._prepare_invoice_line(
-                            sequence=max(invoice.invoice_line_ids.mapped("sequence"))
-                            + 1,
-                        )
-                        invoice.write(
-                            {"invoice_line_ids": [(0, 0, invoice_down_payment_vals)]}
-                        )
-                    invoice.action_post()
-                # The downpayment invoices that not was included in final invoice, are reversed
-                downpayment_invoices = (
-                    downpayments.filtered(
-                        lambda d: d.qty_invoiced > 0
-                    ).invoice_lines.mapped("move_id")
-                ).filtered(lambda i: i.is_simplified_invoice)
-                if downpayment_invoices:
-                    default_values_list = [
-                        {
-                            "ref": _(f'Reversal of: {move.name + " - " + move.ref}'),
-                        }
-                        for move in downpayment_invoices
-                    ]
-                    downpayment_invoices.with_context(
-                        {"sii_refund_type": "I"}
-                    )._reverse_moves(default_values_list, cancel=True)
+                self._autoinvoice_folios(folio)
         except Exception as e:
             folio.sudo().message_post(body=_("Error in autoinvoicing folio: " + str(e)))
 
+    def autoinvoice_folios(self, folios, batch=False):
+        """
+        Invoice a batch of folios of the same property with a single
+        _create_invoices call. If it fails, the folios are invoiced one
+        by one to isolate the failing ones.
+        :param batch: pms.autoinvoicing.batch record updated with the result
+        """
+        start = time.monotonic()
+        invoices = self.env["account.move"]
+        failed_folios = self.env["pms.folio"]
+        try:
+            with self.env.cr.savepoint():
+                invoices = self._autoinvoice_folios(folios)
+        except Exception:
+            for folio in folios:
+                try:
+                    with self.env.cr.savepoint():
+                        invoices |= self._autoinvoice_folios(folio)
+                except Exception as e:
+                    failed_folios |= folio
+                    folio.sudo().message_post(
+                        body=_("Error in autoinvoicing folio: " + str(e))
+                    )
+        duration = time.monotonic() - start
+        _logger.info(
+            "Autoinvoiced %s folios (%s failed) with %s invoices in %.3fs",
+            len(folios),
+            len(failed_folios),
+            len(invoices),
+            duration,
+        )
+        if batch:
+            batch.sudo().write(
+                {
+                    "invoice_ids": [(6, 0, invoices.ids)],
+                    "failed_folio_ids": [(6, 0, failed_folios.ids)],
+                    "state": "error" if failed_folios else "done",
+                    "end_date": fields.Datetime.now(),
+                    "duration": duration,
+                }
+            )
+        return invoices
+
+    def _autoinvoice_folios(self, folios):
+        # REVIEW: folio sale line "_compute_auotinvoice_date" sometimes
+        # dont work in services (probably cache issue¿?), we ensure that the date is
+        # set or recompute this
+        for line in folios.sale_line_ids.filtered(lambda l: not l.autoinvoice_date):
+            line._compute_autoinvoice_date()
+        invoices = folios.with_context(autoinvoice=True)._create_invoices(
+            grouped=True,
+            final=False,
+        )
+        downpayments = folios.sale_line_ids.filtered(
+            lambda l: l.is_downpayment and l.qty_invoiced > 0
+        )
+        for invoice in invoices:
+            if (
+                invoice.amount_total
+                > invoice.pms_property_id.max_amount_simplified_invoice
+                and invoice.journal_id.is_simplified_invoice
+            ):
+                hosts_to_invoice = invoice.folio_ids.partner_invoice_ids.filtered(
+                    lambda p: p._check_enought_invoice_data()
+                ).mapped("id")
+                if hosts_to_invoice:
+                    invoice.partner_id = hosts_to_invoice[0]
+                    invoice.journal_id = (
+                        invoice.pms_property_id.journal_normal_invoice_id
+                    )
+                else:
+                    mens = _(
+                        "The total amount of the simplified invoice is higher than the "
+                        "maximum amount allowed for simplified invoices, and dont have "
+                        "enought data in hosts to create a normal invoice."
+                    )
+                    invoice.folio_ids.sudo().message_post(body=mens)
+                    raise ValidationError(mens)
+            for downpayment in downpayments.filtered(
+                lambda d: d.folio_id in invoice.folio_ids
+                and d.default_invoice_to == invoice.partner_id
+            ):
+                # If the downpayment invoice partner is the same that the
+                # folio partner, we include the downpayment in the normal invoice
+                invoice_down_payment_vals = downpayment._prepare_invoice_line(
+                    sequence=max(invoice.invoice_line_ids.mapped("sequence")) + 1,
+                )
+                invoice.write({"invoice_line_ids": [(0, 0, invoice_down_payment_vals)]})
+        invoices.action_post()
+        # The downpayment invoices that not was included in final invoice, are reversed
+        downpayment_invoices = (
+            downpayments.filtered(lambda d: d.qty_invoiced > 0).invoice_lines.mapped(
+                "move_id"
+            )
+        ).filtered(lambda i: i.is_simplified_invoice)
+        if downpayment_invoices:
+            default_values_list = [
+                {
+                    "ref": _(f'Reversal of: {move.name + " - " + move.ref}'),
+                }
+                for move in downpayment_invoices
+            ]
+            downpayment_invoices.with_context({"sii_refund_type": "I"})._reverse_moves(
+                default_values_list, cancel=True
+            )
+        return invoices
+
     @api.constrains("journal_normal_invoice_id")
     def _check_journal_normal_invoice(self):
         for pms_property in self.filtered("journal_normal_invoice_id"):
@@ -923,16 +1162,18 @@ class PmsProperty(models.Model):
                 ("date", "<=", end_date),
             ]
         )
-        group_adr = self.env["pms.reservation.line"].read_group(
-            domain,
-            ["price:avg"],
-            ["date:day"],
-        )
+        group_adr = [
+            day_totals
+            for day_totals in self.env["pms.property.kpi"].read_line_totals(
+                domain, ["date:day"]
+            )
+            if day_totals["room_nights"]
+        ]
         if not len(group_adr):
             return 0
         adr = 0
-        for day_adr in group_adr:
-            adr += day_adr["price"]
+        for day_totals in group_adr:
+            adr += day_totals["revenue"] / day_totals["room_nights"]
 
         return round(adr / len(group_adr), 2)
 
@@ -957,26 +1198,22 @@ class PmsProperty(models.Model):
         price_domain = expression.AND(
             [domain, [("reservation_id.reservation_type", "=", "normal")]]
         )
-        sum_group_price = self.env["pms.reservation.line"].read_group(
-            price_domain,
-            ["price"],
-            [],
-        )
+        Kpi = self.env["pms.property.kpi"]
+        revenue = Kpi.read_line_totals(price_domain)[0]["revenue"]
         not_allowed_rooms_domain = expression.AND(
             [
                 domain,
                 [("reservation_id.reservation_type", "!=", "normal")],
             ]
         )
-        count_room_days_not_allowed = len(
-            self.env["pms.reservation.line"].search(not_allowed_rooms_domain)
-        )
+        not_allowed_totals = Kpi.read_line_totals(not_allowed_rooms_domain)
+        count_room_days_not_allowed = not_allowed_totals[0]["room_nights"]
         date_range_days = (end_date - start_date).days + 1
         count_total_room_days = len(self.room_ids) * date_range_days
         count_available_room_days = count_total_room_days - count_room_days_not_allowed
-        if not sum_group_price[0]["price"]:
+        if not revenue:
             return 0
-        revpar = round(sum_group_price[0]["price"] / count_available_room_days, 2)
+        revpar = round(revenue / count_available_room_days, 2)
         return revpar
 
     @api.model
@@ -0,0 +1,333 @@
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from odoo import api, fields, models
+from odoo.osv import expression
+from odoo.tools import sql
+
+# Reservation line fields whose changes modify the KPIs of its day
+KPI_FIELDS = (
+    "date",
+    "pms_property_id",
+    "reservation_id",
+    "room_id",
+    "occupies_availability",
+    "sale_channel_id",
+    "price",
+)
+# Reservation fields that are KPI dimensions
+KPI_RESERVATION_FIELDS = ("reservation_type", "room_type_id")
+# Advisory lock taken by the transaction refreshing the KPIs
+KPI_REFRESH_LOCK = 0x504D534B5049  # "PMSKPI"
+
+
+class PmsPropertyKpi(models.Model):
+    """Room nights and revenue of the reservation lines of each property
+    and day, by the dimensions used in the statistics (sale channel, room
+    type, reservation type...).
+
+    The reservation line changes append their (property, day) cells to the
+    pms_property_kpi_dirty log, in the same transaction and without updating
+    any existing row, and a cron recomputes the logged cells. The reads sum
+    the KPIs of the clean cells and the reservation lines of the logged
+    ones, so they are exact without writing anything. The statistics of a
+    period sum a few rows per day instead of reading every line.
+    """
+
+    _name = "pms.property.kpi"
+    _description = "Property Daily KPI"
+    _order = "date, pms_property_id"
+
+    pms_property_id = fields.Many2one(
+        string="Property",
+        help="Property of the reservation lines",
+        comodel_name="pms.property",
+        readonly=True,
+        index=True,
+    )
+    date = fields.Date(
+        string="Date",
+        help="Date of the reservation lines",
+        readonly=True,
+        index=True,
+    )
+    sale_channel_id = fields.Many2one(
+        string="Sale Channel",
+        help="Sale channel of the reservation lines",
+        comodel_name="pms.sale.channel",
+        readonly=True,
+    )
+    room_type_id = fields.Many2one(
+        string="Room Type",
+        help="Room type of the reservations",
+        comodel_name="pms.room.type",
+        readonly=True,
+    )
+    reservation_type = fields.Selection(
+        string="Reservation Type",
+        help="Type of the reservations",
+        selection=[("normal", "Normal"), ("staff", "Staff"), ("out", "Out of Service")],
+        readonly=True,
+    )
+    occupies_availability = fields.Boolean(
+        string="Occupies",
+        help="Whether the reservation lines occupy the rooms",
+        readonly=True,
+    )
+    room_nights = fields.Integer(
+        string="Room Nights",
+        help="Number of reservation lines",
+        readonly=True,
+    )
+    revenue = fields.Float(
+        string="Revenue",
+        help="Sum of the prices of the reservation lines",
+        readonly=True,
+    )
+
+    def init(self):
+        cr = self.env.cr
+        if not sql.table_exists(cr, "pms_property_kpi_dirty"):
+            cr.execute(
+                """
+                CREATE TABLE pms_property_kpi_dirty (
+                    id bigserial PRIMARY KEY,
+                    pms_property_id integer NOT NULL,
+                    date date NOT NULL
+                )
+                """
+            )
+            cr.execute(
+                """
+                CREATE INDEX pms_property_kpi_dirty_cell_idx
+                ON pms_property_kpi_dirty (pms_property_id, date)
+                """
+            )
+            # The KPIs of the existing lines are computed by the cron
+            self._mark_all_dirty()
+
+    @api.model
+    def _get_kpi_dimensions(self):
+        """
+        Return the dimensions of the KPIs:
+        {kpi field: (SQL expression, reservation line field path)}
+        The expressions can use the line, reservation and room tables.
+        """
+        return {
+            "pms_property_id": ("line.pms_property_id", "pms_property_id"),
+            "date": ("line.date", "date"),
+            "sale_channel_id": ("line.sale_channel_id", "sale_channel_id"),
+            "room_type_id": (
+                "reservation.room_type_id",
+                "reservation_id.room_type_id",
+            ),
+            "reservation_type": (
+                "reservation.reservation_type",
+                "reservation_id.reservation_type",
+            ),
+            "occupies_availability": (
+                "line.occupies_availability",
+                "occupies_availability",
+            ),
+        }
+
+    # Changes tracking
+    @api.model
+    def _mark_dirty(self, keys):
+        """Mark the (pms_property_id, date) cells to recompute"""
+        keys = {
+            (pms_property_id, date)
+            for pms_property_id, date in keys
+            if pms_property_id and date
+        }
+        if not keys:
+            return
+        pms_property_ids, dates = zip(*keys)
+        # The log is append only, concurrent transactions never update the
+        # same rows
+        self.env.cr.execute(
+            """
+            INSERT INTO pms_property_kpi_dirty (pms_property_id, date)
+            SELECT * FROM unnest(%s::integer[], %s::date[])
+            """,
+            (list(pms_property_ids), list(dates)),
+        )
+
+    @api.model
+    def _mark_lines_dirty(self, column, ids):
+        """Mark the cells of the reservation lines with the column
+        (id, reservation_id, room_id) in ids"""
+        assert column in ("id", "reservation_id", "room_id")
+        if not ids:
+            return
+        query = """
+            SELECT DISTINCT pms_property_id, date
+            FROM   pms_reservation_line
+            WHERE  {column} = ANY(%s)
+        """.format(
+            column=column
+        )
+        self.env.cr.execute(query, (list(ids),))
+        self._mark_dirty(self.env.cr.fetchall())
+
+    @api.model
+    def _mark_all_dirty(self):
+        self.env.cr.execute(
+            """
+            INSERT INTO pms_property_kpi_dirty (pms_property_id, date)
+            SELECT DISTINCT pms_property_id, date
+            FROM   pms_reservation_line
+            WHERE  pms_property_id IS NOT NULL AND date IS NOT NULL
+            """
+        )
+
+    @api.model
+    def refresh_kpis(self):
+        """Recompute the KPIs of the logged cells. Only a transaction at a
+        time refreshes the KPIs, the others return without waiting."""
+        self.env["base"].flush()
+        cr = self.env.cr
+        cr.execute("SELECT pg_try_advisory_xact_lock(%s)", (KPI_REFRESH_LOCK,))
+        if not cr.fetchone()[0]:
+            return
+        # The rows logged by the transactions not committed yet are not
+        # visible here, they are kept for the next refresh
+        cr.execute(
+            """
+            WITH deleted AS (
+                DELETE FROM pms_property_kpi_dirty
+                RETURNING pms_property_id, date
+            )
+            SELECT DISTINCT pms_property_id, date FROM deleted
+            """
+        )
+        cells = cr.fetchall()
+        if not cells:
+            return
+        pms_property_ids, dates = (list(values) for values in zip(*cells))
+        cr.execute(
+            """
+            DELETE FROM pms_property_kpi kpi
+            USING  unnest(%s::integer[], %s::date[]) AS cell(pms_property_id, date)
+            WHERE  kpi.pms_property_id = cell.pms_property_id
+               AND kpi.date = cell.date
+            """,
+            (pms_property_ids, dates),
+        )
+        dimensions = self._get_kpi_dimensions()
+        query = """
+            INSERT INTO pms_property_kpi (
+                {columns}, room_nights, revenue,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT {expressions}, COUNT(*), COALESCE(SUM(line.price), 0),
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM   unnest(%(pms_property_ids)s::integer[], %(dates)s::date[])
+                   AS cell(pms_property_id, date)
+            JOIN   pms_reservation_line line
+                   ON line.pms_property_id = cell.pms_property_id
+                  AND line.date = cell.date
+            JOIN   pms_reservation reservation
+                   ON reservation.id = line.reservation_id
+            LEFT JOIN pms_room room ON room.id = line.room_id
+            GROUP  BY {group_by}
+        """.format(
+            columns=", ".join(dimensions),
+            expressions=", ".join(
+                sql_expression for sql_expression, path in dimensions.values()
+            ),
+            group_by=", ".join(str(i) for i in range(1, len(dimensions) + 1)),
+        )
+        cr.execute(
+            query,
+            {
+                "uid": self.env.uid,
+                "pms_property_ids": pms_property_ids,
+                "dates": dates,
+            },
+        )
+        self.invalidate_cache()
+
+    # Reading
+    @api.model
+    def _get_kpi_domain(self, line_domain):
+        """Translate a reservation line domain to a KPI domain, or return
+        None if any of its conditions is not over a dimension of the KPIs"""
+        fields_by_path = {
+            path: field
+            for field, (sql_expression, path) in self._get_kpi_dimensions().items()
+        }
+        kpi_domain = []
+        for leaf in line_domain:
+            if isinstance(leaf, str):
+                kpi_domain.append(leaf)
+            elif leaf[0] in fields_by_path:
+                kpi_domain.append((fields_by_path[leaf[0]], leaf[1], leaf[2]))
+            else:
+                return None
+        return kpi_domain
+
+    @api.model
+    def read_line_totals(self, line_domain, groupby=()):
+        """
+        Return the room nights and revenue of the reservation lines of the
+        domain: [{groupby..., "room_nights": int, "revenue": float}]
+        The groupby fields are reservation line fields. The domains that
+        filter by other fields than the dimensions of the KPIs are grouped
+        over the reservation lines.
+        """
+        groupby = list(groupby)
+        Line = self.env["pms.reservation.line"]
+        kpi_domain = self._get_kpi_domain(line_domain)
+        if kpi_domain is None:
+            return self._read_line_group_totals(line_domain, groupby)
+        self.env["base"].flush()
+        # The cells logged as dirty are read from the reservation lines
+        dirty_query = """
+            SELECT {table}.id
+            FROM   {table}
+            JOIN   pms_property_kpi_dirty dirty
+                   ON dirty.pms_property_id = {table}.pms_property_id
+                  AND dirty.date = {table}.date
+        """
+        kpi_dirty_query = (dirty_query.format(table=self._table), [])
+        line_dirty_query = (dirty_query.format(table=Line._table), [])
+        groups = self.read_group(
+            expression.AND([kpi_domain, [("id", "not inselect", kpi_dirty_query)]]),
+            ["room_nights:sum", "revenue:sum"],
+            groupby,
+            lazy=False,
+        )
+        totals = {}
+        for group in groups:
+            key = tuple(group[field] for field in groupby)
+            totals[key] = dict(
+                {field: group[field] for field in groupby},
+                room_nights=group["room_nights"] or 0,
+                revenue=group["revenue"] or 0.0,
+            )
+        dirty_totals = self._read_line_group_totals(
+            expression.AND([line_domain, [("id", "inselect", line_dirty_query)]]),
+            groupby,
+        )
+        for group in dirty_totals:
+            key = tuple(group[field] for field in groupby)
+            if key in totals:
+                totals[key]["room_nights"] += group["room_nights"]
+                totals[key]["revenue"] += group["revenue"]
+            else:
+                totals[key] = group
+        return list(totals.values())
+
+    @api.model
+    def _read_line_group_totals(self, line_domain, groupby):
+        groups = self.env["pms.reservation.line"].read_group(
+            line_domain, ["price:sum"], groupby, lazy=False
+        )
+        return [
+            dict(
+                {key: group[key] for key in groupby},
+                room_nights=group["__count"],
+                revenue=group["price"] or 0.0,
+            )
+            for group in groups
+        ]
@@ -8,6 +8,8 @@ import time
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
 
+from .pms_property_kpi import KPI_RESERVATION_FIELDS
+
 _logger = logging.getLogger(__name__)
 
 
@@ -41,8 +43,34 @@ class PmsReservation(models.Model):
     priority = fields.Integer(
         string="Priority",
         help="Priority of a reservation",
-        store="True",
         compute="_compute_priority",
+        search="_search_priority",
+    )
+    priority_base = fields.Integer(
+        string="Priority Base",
+        help="Technical field, constant part of the priority",
+        compute="_compute_priority_components",
+        store=True,
+    )
+    priority_factor = fields.Integer(
+        string="Priority Factor",
+        help="Technical field, priority added for each day until the priority date",
+        compute="_compute_priority_components",
+        store=True,
+    )
+    priority_date = fields.Date(
+        string="Priority Date",
+        help="Technical field, date until which the days of the priority are counted",
+        compute="_compute_priority_components",
+        store=True,
+    )
+    priority_bucket_date = fields.Date(
+        string="Priority Bucket Date",
+        help="Technical field, date when the priority formula of the "
+        "reservation changes and its components must be recomputed",
+        compute="_compute_priority_components",
+        store=True,
+        index=True,
     )
     preferred_room_id = fields.Many2one(
         string="Room",
@@ -778,63 +806,99 @@ class PmsReservation(models.Model):
         "folio_payment_state",
         "to_assign",
     )
-    def _compute_priority(self):
+    def _compute_priority_components(self):
+        # The priority is priority_base + priority_factor * days until
+        # priority_date, the components only change when the state or the
+        # payment change, or on priority_bucket_date
         # TODO: Notifications priority
         for record in self:
+            components = (0, 0, False, False)
             if record.to_assign or record.state in (
                 "arrival_delayed",
                 "departure_delayed",
             ):
-                record.priority = 1
+                components = (1, 0, False, False)
             elif record.state == "cancel":
-                record.priority = record.cancel_priority()
+                components = record.cancel_priority()
             elif record.state == "onboard":
-                record.priority = record.onboard_priority()
-            elif record.state in ("draf", "confirm"):
-                record.priority = record.reservations_future_priority()
+                components = record.onboard_priority()
+            elif record.state in ("draft", "confirm"):
+                components = record.reservations_future_priority()
             elif record.state == "done":
-                record.priority = record.reservations_past_priority()
+                components = record.reservations_past_priority()
+            (
+                record.priority_base,
+                record.priority_factor,
+                record.priority_date,
+                record.priority_bucket_date,
+            ) = components
+
+    @api.depends("priority_base", "priority_factor", "priority_date")
+    def _compute_priority(self):
+        today = fields.date.today()
+        for record in self:
+            days = (record.priority_date - today).days if record.priority_date else 0
+            record.priority = record.priority_base + record.priority_factor * days
 
+    def _search_priority(self, operator, value):
+        if operator not in ("=", "!=", ">=", ">", "<=", "<"):
+            raise UserError(
+                _("Unsupported operator %s for searching on priority") % (operator,)
+            )
+        self.flush(["priority_base", "priority_factor", "priority_date"])
+        query = """
+            SELECT id
+            FROM   pms_reservation
+            WHERE  priority_base
+                   + priority_factor * COALESCE(priority_date - %s, 0) {operator} %s
+        """.format(
+            operator=operator
+        )
+        return [("id", "inselect", (query, (fields.date.today(), value)))]
+
+    # The priority methods return the components of the priority:
+    # (priority_base, priority_factor, priority_date, priority_bucket_date)
     def cancel_priority(self):
         self.ensure_one()
         if self.folio_pending_amount > 0:
-            return 2
+            return 2, 0, False, False
         elif self.checkout >= fields.date.today():
-            return 100
+            return 100, 0, False, self.checkout + datetime.timedelta(days=1)
         else:
-            return 1000 * (fields.date.today() - self.checkout).days
+            # 1000 * days from checkout
+            return 0, -1000, self.checkout, False
 
     def onboard_priority(self):
         self.ensure_one()
-        days_for_checkout = (self.checkout - fields.date.today()).days
+        # days for checkout
         if self.folio_pending_amount > 0:
-            return days_for_checkout
+            return 0, 1, self.checkout, False
         else:
-            return 3 * days_for_checkout
+            return 0, 3, self.checkout, False
 
     def reservations_future_priority(self):
         self.ensure_one()
         days_for_checkin = (self.checkin - fields.date.today()).days
         if days_for_checkin < 3:
-            return 2 * days_for_checkin
+            return 0, 2, self.checkin, False
         elif days_for_checkin < 20:
-            return 3 * days_for_checkin
+            return 0, 3, self.checkin, self.checkin - datetime.timedelta(days=2)
         else:
-            return 4 * days_for_checkin
+            return 0, 4, self.checkin, self.checkin - datetime.timedelta(days=19)
 
     def reservations_past_priority(self):
         self.ensure_one()
         if self.folio_pending_amount > 0:
-            return 3
+            return 3, 0, False, False
         days_from_checkout = (fields.date.today() - self.checkout).days
         if days_from_checkout <= 1:
-            return 6
+            return 6, 0, False, self.checkout + datetime.timedelta(days=2)
         elif days_from_checkout < 15:
-            return 5 * days_from_checkout
+            return 0, -5, self.checkout, self.checkout + datetime.timedelta(days=15)
         elif days_from_checkout <= 90:
-            return 10 * days_from_checkout
-        elif days_from_checkout > 90:
-            return 100 * days_from_checkout
+            return 0, -10, self.checkout, self.checkout + datetime.timedelta(days=91)
+        else:
+            return 0, -100, self.checkout, False
 
     @api.depends("pricelist_id", "room_type_id")
     def _compute_board_service_room_id(self):
@@ -2223,6 +2287,24 @@ class PmsReservation(models.Model):
             self._check_capacity()
         return res
 
+    def _write(self, vals):
+        res = super()._write(vals)
+        if any(field in vals for field in KPI_RESERVATION_FIELDS):
+            self.env["pms.property.kpi"]._mark_lines_dirty("reservation_id", self.ids)
+        return res
+
+    def unlink(self):
+        # The reservation lines are deleted in cascade by the database
+        self.env["pms.reservation.line"].flush(
+            ["reservation_id", "pms_property_id", "room_id", "date"]
+        )
+        self.env["pms.property.kpi"]._mark_lines_dirty("reservation_id", self.ids)
+        OccupancyIndex = self.env["pms.occupancy.index"]
+        OccupancyIndex._touch(
+            OccupancyIndex._read_line_keys(self.reservation_line_ids.ids)
+        )
+        return super().unlink()
+
     def _get_folio_vals(self, reservation_vals):
         folio_vals = {
             "pms_property_id": reservation_vals["pms_property_id"],
@@ -2330,8 +2412,17 @@ class PmsReservation(models.Model):
 
     @api.model
     def update_daily_priority_reservation(self):
-        reservations = self.env["pms.reservation"].search([("priority", "<", 1000)])
-        reservations._compute_priority()
+        """
+        Recompute the priority components of the reservations whose priority
+        formula changes today, the priority of the other reservations is
+        relative to today and is not written
+        """
+        reservations = self.env["pms.reservation"].search(
+            [("priority_bucket_date", "<=", fields.date.today())]
+        )
+        reservations._compute_priority_components()
+        self.invalidate_cache(["priority"])
+        self.env["pms.folio"].invalidate_cache(["max_reservation_priority"])
         return True
 
     def action_confirm(self):
@@ -3,10 +3,14 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 import datetime
 import logging
+from collections import Counter, defaultdict
 
 from odoo import _, api, fields, models
 from odoo.exceptions import ValidationError
 
+from .pms_occupancy_index import INDEX_FIELDS
+from .pms_property_kpi import KPI_FIELDS
+
 _logger = logging.getLogger(__name__)
 
 
@@ -185,184 +189,246 @@ class PmsReservationLine(models.Model):
         # negative discounts (= surcharge) are included in the display price
         return max(base_price, final_price)
 
-    # flake8: noqa=C901
     @api.depends("reservation_id.room_type_id", "reservation_id.preferred_room_id")
     def _compute_room_id(self):
-        for line in self.filtered("reservation_id.room_type_id").sorted(
-            key=lambda r: (r.reservation_id, r.date)
-        ):
-            reservation = line.reservation_id
-            if (
-                reservation.preferred_room_id
-                and reservation.preferred_room_id != line.room_id
-            ) or (
-                (reservation.preferred_room_id or reservation.room_type_id)
-                and not line.room_id
-            ):
-                free_room_select = True if reservation.preferred_room_id else False
-
-                # we get the rooms available for the entire stay
-                # (real_avail if True if the reservation was created with
-                # specific room selected)
-                pms_property = line.pms_property_id
-                pms_property = pms_property.with_context(
-                    checkin=reservation.checkin,
-                    checkout=reservation.checkout,
-                    room_type_id=reservation.room_type_id.id
-                    if not free_room_select
-                    else False,
-                    current_lines=reservation.reservation_line_ids.ids,
-                    pricelist_id=reservation.pricelist_id.id,
-                    real_avail=True,
+        rooms_by_line, manual_assigned = self._solve_room_assignment()
+        for line, room_id in rooms_by_line.items():
+            line.room_id = room_id
+        # Avoid that reservation._compute_splitted set the
+        # reservation like splitted in intermediate calculations
+        for reservation in manual_assigned.with_context(not_split=True):
+            reservation.to_assign = False
+
+    def assign_rooms(self):
+        """
+        Solve the room assignment of the lines and write all the rooms
+        at once, with a write per room.
+        :return: dict {line: room id} with the assigned rooms
+        """
+        rooms_by_line, manual_assigned = self._solve_room_assignment()
+        lines_by_room = {}
+        for line, room_id in rooms_by_line.items():
+            lines_by_room.setdefault(room_id, self.browse())
+            lines_by_room[room_id] |= line
+        for room_id, lines in lines_by_room.items():
+            lines.write({"room_id": room_id})
+        if manual_assigned:
+            manual_assigned.with_context(not_split=True).write({"to_assign": False})
+        return rooms_by_line
+
+    def _get_lines_to_assign(self):
+        return self.filtered(
+            lambda line: line.reservation_id.room_type_id
+            and (
+                (
+                    line.reservation_id.preferred_room_id
+                    and line.reservation_id.preferred_room_id != line.room_id
                 )
-                rooms_available = pms_property.free_room_ids
+                or not line.room_id
+            )
+        )
 
-                # Check if the room assigment is manual or automatic to set the
-                # to_assign value on reservation
-                manual_assigned = False
-                if (
-                    free_room_select
-                    and reservation.preferred_room_id.id
-                    not in reservation.reservation_line_ids.room_id.ids
-                    and self.env.user._is_property_member(pms_property.id)
-                ):
-                    # This case is a preferred_room_id manually assigned
-                    manual_assigned = True
-                # if there is availability for the entire stay
-                if rooms_available:
-                    # Avoid that reservation._compute_splitted set the
-                    # reservation like splitted in intermediate calculations
-                    reservation = reservation.with_context(not_split=True)
-                    # if the reservation has a preferred room
-                    if reservation.preferred_room_id:
-
-                        # if the preferred room is available
-                        if reservation.preferred_room_id in rooms_available:
-                            line.room_id = reservation.preferred_room_id
-                            reservation.to_assign = (
-                                False if manual_assigned else reservation.to_assign
-                            )
-
-                        # if the preferred room is NOT available
-                        else:
-                            if (
-                                self.env.context.get("force_overbooking")
-                                or not line.occupies_availability
-                            ):
-                                line.room_id = reservation.preferred_room_id
-                            else:
-                                raise ValidationError(
-                                    _("%s: No room available in %s <-> %s.")
-                                    % (
-                                        reservation.preferred_room_id.name,
-                                        reservation.checkin,
-                                        reservation.checkout,
-                                    )
-                                )
-
-                    # otherwise we assign the first of those
-                    # available for the entire stay
-                    else:
-                        line.room_id = rooms_available[0]
-                # check that the reservation cannot be allocated even by dividing it
-                elif not self.env["pms.property"].splitted_availability(
-                    checkin=reservation.checkin,
-                    checkout=reservation.checkout,
-                    room_type_id=reservation.room_type_id.id,
-                    current_lines=line._origin.reservation_id.reservation_line_ids.ids,
-                    pricelist=reservation.pricelist_id,
-                    pms_property_id=line.pms_property_id.id,
-                    real_avail=True,
+    def _solve_room_assignment(self):
+        """
+        Assign rooms to the lines of a batch of reservations together.
+        The occupancy of the whole stay window of each property is loaded
+        once, and the rooms assigned to a reservation are taken into account
+        when solving the next ones.
+        - A preferred room is assigned if it is free (or forcing overbooking).
+        - Otherwise the first room of the room type free for the whole stay.
+        - Otherwise the stay is splitted with the minimal number of rooms,
+          keeping the room of the night before when possible.
+        :return: tuple (dict {line: room id}, reservations whose preferred
+            room was manually assigned)
+        """
+        rooms_by_line = {}
+        manual_assigned = self.env["pms.reservation"]
+        lines_to_assign = self._get_lines_to_assign()
+        Avail = self.env["pms.availability"]
+        for pms_property in lines_to_assign.pms_property_id:
+            property_lines = lines_to_assign.filtered(
+                lambda line: line.pms_property_id == pms_property
+            )
+            reservations = property_lines.reservation_id
+            all_lines = reservations.reservation_line_ids
+            dates = set()
+            for reservation in reservations:
+                dates.update(
+                    reservation.checkin + datetime.timedelta(days=x)
+                    for x in range(0, (reservation.checkout - reservation.checkin).days)
+                )
+            dates.update(all_lines.mapped("date"))
+            graph = Avail._get_shared_rooms_graph(pms_property.id)
+            occupancy = {}
+            for date, room_ids in Avail._get_occupied_rooms_by_date(
+                pms_property.id, dates, graph["room_ids"], all_lines.ids
+            ).items():
+                occupancy[date] = Counter(room_ids)
+            kept_lines = (all_lines - property_lines).filtered(
+                lambda line: line.room_id and line.occupies_availability
+            )
+            self._update_occupancy(occupancy, kept_lines, 1)
+
+            for reservation in reservations:
+                own_kept_lines = kept_lines & reservation.reservation_line_ids
+                self._update_occupancy(occupancy, own_kept_lines, -1)
+                lines = (property_lines & reservation.reservation_line_ids).sorted(
+                    "date"
+                )
+                reservation_rooms, manual = self._solve_reservation_room_assignment(
+                    reservation, lines, occupancy, graph
+                )
+                if manual:
+                    manual_assigned |= reservation
+                rooms_by_line.update(reservation_rooms)
+                for line, room_id in reservation_rooms.items():
+                    if line.occupies_availability:
+                        occupancy.setdefault(line.date, Counter())[room_id] += 1
+                self._update_occupancy(occupancy, own_kept_lines, 1)
+        return rooms_by_line, manual_assigned
+
+    @api.model
+    def _update_occupancy(self, occupancy, lines, increment):
+        for line in lines:
+            occupancy.setdefault(line.date, Counter())[line.room_id.id] += increment
+
+    @api.model
+    def _get_free_room_ids(self, room_ids, dates, occupancy, graph):
+        """Return the rooms of room_ids free (taking into account the
+        shared rooms) in all the dates"""
+        free_room_ids = list(room_ids)
+        for date in dates:
+            if not free_room_ids:
+                break
+            occupied = {
+                room_id
+                for room_id, count in occupancy.get(date, {}).items()
+                if count > 0
+            }
+            rooms_not_avail = self.env["pms.availability"]._filter_rooms_not_avail(
+                free_room_ids, occupied, graph
+            )
+            free_room_ids = [
+                room_id for room_id in free_room_ids if room_id not in rooms_not_avail
+            ]
+        return free_room_ids
+
+    def _solve_reservation_room_assignment(self, reservation, lines, occupancy, graph):
+        rooms_by_line = {}
+        manual_assigned = False
+        if not lines:
+            return rooms_by_line, manual_assigned
+        preferred_room = reservation.preferred_room_id
+        nights = [
+            reservation.checkin + datetime.timedelta(days=x)
+            for x in range(0, (reservation.checkout - reservation.checkin).days)
+        ]
+        room_type_room_ids = graph["rooms_by_type"].get(reservation.room_type_id.id, [])
+        if preferred_room:
+            candidate_room_ids = [
+                room_id
+                for room_ids in graph["rooms_by_type"].values()
+                for room_id in room_ids
+            ]
+            # Check if the room assigment is manual or automatic to set the
+            # to_assign value on reservation
+            manual_assigned = (
+                preferred_room.id not in reservation.reservation_line_ids.room_id.ids
+                and self.env.user._is_property_member(reservation.pms_property_id.id)
+            )
+        else:
+            candidate_room_ids = room_type_room_ids
+        # we get the rooms available for the entire stay
+        rooms_available = self._get_free_room_ids(
+            candidate_room_ids, nights, occupancy, graph
+        )
+        if rooms_available:
+            if preferred_room:
+                if preferred_room.id in rooms_available:
+                    room_id = preferred_room.id
+                elif self.env.context.get("force_overbooking") or not any(
+                    lines.mapped("occupies_availability")
                 ):
-                    if self.env.context.get("force_overbooking"):
-                        line.room_id = reservation.room_type_id.room_ids.filtered(
-                            lambda r: r.pms_property_id == line.pms_property_id
-                        )[0]
-                    else:
-                        raise ValidationError(
-                            _("%s: No room type available")
-                            % (reservation.room_type_id.name)
+                    room_id = preferred_room.id
+                    manual_assigned = False
+                else:
+                    raise ValidationError(
+                        _("%s: No room available in %s <-> %s.")
+                        % (
+                            preferred_room.name,
+                            reservation.checkin,
+                            reservation.checkout,
                         )
+                    )
+            else:
+                # we assign the first of those available for the entire stay
+                room_id = rooms_available[0]
+                manual_assigned = False
+            for line in lines:
+                rooms_by_line[line] = room_id
+            return rooms_by_line, manual_assigned
+
+        manual_assigned = False
+        # check that the reservation cannot be allocated even by dividing it
+        if not all(
+            self._get_free_room_ids(room_type_room_ids, [night], occupancy, graph)
+            for night in nights
+        ):
+            if self.env.context.get("force_overbooking"):
+                room_id = reservation.room_type_id.room_ids.filtered(
+                    lambda r: r.pms_property_id == reservation.pms_property_id
+                )[0].id
+                for line in lines:
+                    rooms_by_line[line] = room_id
+                return rooms_by_line, manual_assigned
+            raise ValidationError(
+                _("%s: No room type available") % (reservation.room_type_id.name)
+            )
 
-                # the reservation can be allocated into several rooms
-                else:
-                    rooms_ranking = dict()
-
-                    # we go through the rooms of the type
-                    for room in self.env["pms.room"].search(
-                        [
-                            ("room_type_id", "=", reservation.room_type_id.id),
-                            ("pms_property_id", "=", reservation.pms_property_id.id),
-                        ]
-                    ):
-                        # we iterate the dates from the date of the line to the checkout
-                        for date_iterator in [
-                            line.date + datetime.timedelta(days=x)
-                            for x in range(0, (reservation.checkout - line.date).days)
-                        ]:
-                            # if the room is already assigned for
-                            # a date we go to the next room
-                            ids = reservation.reservation_line_ids.ids
-                            if (
-                                self.env["pms.reservation.line"].search_count(
-                                    [
-                                        ("date", "=", date_iterator),
-                                        ("room_id", "=", room.id),
-                                        ("id", "not in", ids),
-                                        ("occupies_availability", "=", True),
-                                    ]
-                                )
-                                > 0
-                            ):
-                                break
-                            # if the room is not assigned for a date we
-                            # add it to the ranking / update its ranking
-                            else:
-                                rooms_ranking[room.id] = (
-                                    1
-                                    if room.id not in rooms_ranking
-                                    else rooms_ranking[room.id] + 1
-                                )
-
-                    if len(rooms_ranking) > 0:
-                        # we get the best score in the ranking
-                        best = max(rooms_ranking.values())
-
-                        # we keep the rooms with the best ranking
-                        bests = {
-                            key: value
-                            for (key, value) in rooms_ranking.items()
-                            if value == best
-                        }
-
-                        # if there is a tie in the rankings
-                        if len(bests) > 1:
-
-                            # we get the line from last night
-                            date_last_night = line.date + datetime.timedelta(days=-1)
-                            line_past_night = self.env["pms.reservation.line"].search(
-                                [
-                                    ("date", "=", date_last_night),
-                                    ("reservation_id", "=", reservation.id),
-                                ]
-                            )
-                            # if there is the night before and if the room
-                            # from the night before is in the ranking
-                            if line_past_night and line_past_night.room_id.id in bests:
-                                line.room_id = line_past_night.room_id.id
-
-                            # if the room from the night before is not in the ranking
-                            # or there is no night before
-                            else:
-                                # At this point we set the room with the best ranking,
-                                # no matter what it is
-                                line.room_id = list(bests.keys())[0]
-
-                        # if there is no tie in the rankings
-                        else:
-                            # At this point we set the room with the best ranking,
-                            # no matter what it is
-                            line.room_id = list(bests.keys())[0]
+        # the reservation can be allocated into several rooms
+        rooms_by_line = self._solve_splitted_room_assignment(
+            reservation, lines, room_type_room_ids, nights, occupancy, graph
+        )
+        return rooms_by_line, manual_assigned
+
+    def _solve_splitted_room_assignment(
+        self, reservation, lines, room_ids, nights, occupancy, graph
+    ):
+        """For each night we rank the rooms by the consecutive nights they
+        are free, and assign the best one (the room from the night before
+        in case of tie)"""
+        rooms_by_line = {}
+        room_by_date = {
+            line.date: line.room_id.id
+            for line in reservation.reservation_line_ids - lines
+        }
+        for line in lines:
+            rooms_ranking = {}
+            free_room_ids = room_ids
+            for date_iterator in [night for night in nights if night >= line.date]:
+                free_room_ids = self._get_free_room_ids(
+                    free_room_ids, [date_iterator], occupancy, graph
+                )
+                if not free_room_ids:
+                    break
+                for room_id in free_room_ids:
+                    rooms_ranking[room_id] = rooms_ranking.get(room_id, 0) + 1
+            if not rooms_ranking:
+                continue
+            # we keep the rooms with the best ranking
+            best = max(rooms_ranking.values())
+            bests = [
+                room_id for room_id, value in rooms_ranking.items() if value == best
+            ]
+            # if there is a tie, we keep the room from the night before
+            room_past_night = room_by_date.get(line.date - datetime.timedelta(days=1))
+            if len(bests) > 1 and room_past_night in bests:
+                room_id = room_past_night
+            else:
+                room_id = bests[0]
+            rooms_by_line[line] = room_id
+            room_by_date[line.date] = room_id
+        return rooms_by_line
 
     @api.depends(
         "reservation_id",
@@ -371,6 +437,7 @@ class PmsReservationLine(models.Model):
         "reservation_id.pms_property_id",
     )
     def _compute_price(self):
+        lines_by_reservation = defaultdict(self.browse)
         for line in self:
             reservation = line.reservation_id
             if (
@@ -381,26 +448,60 @@ class PmsReservationLine(models.Model):
             ):
                 line.price = 0
             elif not line.price or self._context.get("force_recompute"):
-                room_type_id = reservation.room_type_id.id
-                product = self.env["pms.room.type"].browse(room_type_id).product_id
-                partner = self.env["res.partner"].browse(reservation.partner_id.id)
-                product = product.with_context(
-                    lang=partner.lang,
-                    partner=partner.id,
-                    quantity=1,
-                    date=reservation.date_order,
-                    consumption_date=line.date,
-                    pricelist=reservation.pricelist_id.id,
-                    uom=product.uom_id.id,
-                    property=reservation.pms_property_id.id,
-                )
-                line.price = self.env["account.tax"]._fix_tax_included_price_company(
-                    line._get_display_price(product),
-                    product.taxes_id,
-                    reservation.tax_ids,
-                    reservation.pms_property_id.company_id,
+                lines_by_reservation[reservation] |= line
+        for reservation, lines in lines_by_reservation.items():
+            lines._compute_price_stay(reservation)
+        # TODO: Out of service 0 amount
+
+    def _compute_price_stay(self, reservation):
+        """Compute the price of the reservation lines with a single
+        pricelist pass for the whole stay"""
+        room_type_id = reservation.room_type_id.id
+        product = self.env["pms.room.type"].browse(room_type_id).product_id
+        partner = self.env["res.partner"].browse(reservation.partner_id.id)
+        product = product.with_context(
+            lang=partner.lang,
+            partner=partner.id,
+            quantity=1,
+            date=reservation.date_order,
+            pricelist=reservation.pricelist_id.id,
+            uom=product.uom_id.id,
+            property=reservation.pms_property_id.id,
+        )
+        pricelist = reservation.pricelist_id
+        stay_lines = self.filtered("date")
+        if pricelist.discount_policy == "with_discount" and stay_lines:
+            prices = pricelist.with_context(product._context).price_stay(
+                reservation.pms_property_id.id,
+                product,
+                stay_lines.mapped("date"),
+                date=reservation.date_order,
+                partner=partner,
+            )[product.id]
+            display_prices = [
+                (line, price) for line, (price, rule_id) in zip(stay_lines, prices)
+            ]
+        else:
+            # The display price of the pricelists without discount
+            # is computed with the sale date of each night
+            stay_lines = self.env["pms.reservation.line"]
+            display_prices = []
+        for line in self - stay_lines:
+            display_prices.append(
+                (
+                    line,
+                    line._get_display_price(
+                        product.with_context(consumption_date=line.date)
+                    ),
                 )
-                # TODO: Out of service 0 amount
+            )
+        for line, price in display_prices:
+            line.price = self.env["account.tax"]._fix_tax_included_price_company(
+                price,
+                product.taxes_id,
+                reservation.tax_ids,
+                reservation.pms_property_id.company_id,
+            )
 
     @api.depends("reservation_id.state", "is_reselling")
     def _compute_occupies_availability(self):
@@ -421,49 +522,51 @@ class PmsReservationLine(models.Model):
 
     @api.depends("room_id", "pms_property_id", "date", "occupies_availability")
     def _compute_avail_id(self):
+        avail_ids, created_keys = self.env["pms.availability"]._ensure_avails(
+            (
+                record.room_id.room_type_id.id,
+                record.date,
+                record.pms_property_id.id,
+            )
+            for record in self
+        )
         for record in self:
-            if record.room_id.room_type_id and record.date and record.pms_property_id:
-                avail = self.env["pms.availability"].search(
-                    [
-                        ("date", "=", record.date),
-                        ("room_type_id", "=", record.room_id.room_type_id.id),
-                        ("pms_property_id", "=", record.pms_property_id.id),
-                    ]
-                )
-                if avail:
-                    room_ids = record.room_id.room_type_id.room_ids.filtered(
-                        lambda r: r.pms_property_id == record.pms_property_id
-                    ).ids
-                    if (
-                        record.occupies_availability
-                        and not (
-                            self.env.context.get("avoid_availability_check", False)
-                            or self.env.context.get("force_overbooking", False)
-                        )
-                        and record.room_id.id
-                        in avail.get_rooms_not_avail(
-                            checkin=record.date,
-                            checkout=record.date + datetime.timedelta(1),
-                            room_ids=room_ids,
-                            pms_property_id=record.pms_property_id.id,
-                            current_lines=record.ids,
-                        )
-                    ):
-                        raise ValidationError(
-                            _("There is no availability for the room type %s on %s")
-                            % (record.room_id.room_type_id.name, record.date)
-                        )
-                    record.avail_id = avail.id
-                else:
-                    record.avail_id = self.env["pms.availability"].create(
-                        {
-                            "date": record.date,
-                            "room_type_id": record.room_id.room_type_id.id,
-                            "pms_property_id": record.pms_property_id.id,
-                        }
-                    )
-            else:
+            key = (
+                record.room_id.room_type_id.id,
+                record.date,
+                record.pms_property_id.id,
+            )
+            if key not in avail_ids:
                 record.avail_id = False
+                continue
+            avail = self.env["pms.availability"].browse(avail_ids[key])
+            # The availability created now has no other line to check
+            if key in created_keys:
+                created_keys.discard(key)
+            else:
+                room_ids = record.room_id.room_type_id.room_ids.filtered(
+                    lambda r: r.pms_property_id == record.pms_property_id
+                ).ids
+                if (
+                    record.occupies_availability
+                    and not (
+                        self.env.context.get("avoid_availability_check", False)
+                        or self.env.context.get("force_overbooking", False)
+                    )
+                    and record.room_id.id
+                    in avail.get_rooms_not_avail(
+                        checkin=record.date,
+                        checkout=record.date + datetime.timedelta(1),
+                        room_ids=room_ids,
+                        pms_property_id=record.pms_property_id.id,
+                        current_lines=record.ids,
+                    )
+                ):
+                    raise ValidationError(
+                        _("There is no availability for the room type %s on %s")
+                        % (record.room_id.room_type_id.name, record.date)
+                    )
+            record.avail_id = avail.id
 
     @api.depends("price", "discount", "cancel_discount")
     def _compute_price_day_total(self):
@@ -519,6 +622,12 @@ class PmsReservationLine(models.Model):
                 date=line.date,
                 pms_property_id=reservation.pms_property_id.id,
             )
+        OccupancyIndex = self.env["pms.occupancy.index"]
+        keys = OccupancyIndex._read_line_keys(records.ids)
+        OccupancyIndex._touch(keys)
+        self.env["pms.property.kpi"]._mark_dirty(
+            (pms_property_id, date) for pms_property_id, room_id, date in keys
+        )
         return records
 
     @api.depends("sale_channel_id", "reservation_id.agency_id")
@@ -561,6 +670,32 @@ class PmsReservationLine(models.Model):
         res = super().write(vals)
         return res
 
+    def _write(self, vals):
+        # Keep track of the occupancy and KPI cells changed by this
+        # transaction, also when the stored computed fields are flushed
+        if not any(field in vals for field in KPI_FIELDS):
+            return super()._write(vals)
+        OccupancyIndex = self.env["pms.occupancy.index"]
+        keys = OccupancyIndex._read_line_keys(self.ids)
+        res = super()._write(vals)
+        keys += OccupancyIndex._read_line_keys(self.ids)
+        if any(field in vals for field in INDEX_FIELDS):
+            OccupancyIndex._touch(keys)
+        self.env["pms.property.kpi"]._mark_dirty(
+            (pms_property_id, date) for pms_property_id, room_id, date in keys
+        )
+        return res
+
+    def unlink(self):
+        self.flush(list(KPI_FIELDS))
+        OccupancyIndex = self.env["pms.occupancy.index"]
+        keys = OccupancyIndex._read_line_keys(self.ids)
+        OccupancyIndex._touch(keys)
+        self.env["pms.property.kpi"]._mark_dirty(
+            (pms_property_id, date) for pms_property_id, room_id, date in keys
+        )
+        return super().unlink()
+
     # Constraints and onchanges
     @api.constrains("date")
     def constrains_duplicated_date(self):
@@ -5,6 +5,9 @@
 from odoo import _, api, fields, models
 from odoo.exceptions import ValidationError
 
+# Fields of the rooms that change the availability of the room types
+ROOMS_STRUCTURE_FIELDS = ("room_type_id", "parent_id", "active", "pms_property_id")
+
 
 class PmsRoom(models.Model):
     """The rooms for lodging can be for sleeping, usually called rooms,
@@ -206,7 +209,9 @@ class PmsRoom(models.Model):
                 vals.update({"short_name": short_name})
             else:
                 vals.update({"short_name": vals["name"]})
-        return super(PmsRoom, self).create(vals)
+        room = super(PmsRoom, self).create(vals)
+        self.env["pms.occupancy.index"]._touch_rooms(room.pms_property_id.ids)
+        return room
 
     def write(self, vals):
         if vals.get("name") and not vals.get("short_name"):
@@ -215,7 +220,16 @@ class PmsRoom(models.Model):
                 vals.update({"short_name": short_name})
             else:
                 vals.update({"short_name": vals["name"]})
-        return super(PmsRoom, self).write(vals)
+        if any(field in vals for field in ROOMS_STRUCTURE_FIELDS):
+            self.env["pms.occupancy.index"]._touch_rooms(self.pms_property_id.ids)
+        res = super(PmsRoom, self).write(vals)
+        if "pms_property_id" in vals:
+            self.env["pms.occupancy.index"]._touch_rooms(self.pms_property_id.ids)
+        return res
+
+    def unlink(self):
+        self.env["pms.occupancy.index"]._touch_rooms(self.pms_property_id.ids)
+        return super(PmsRoom, self).unlink()
 
     def calculate_short_name(self, vals):
         short_name = vals["name"][:2].upper()
@@ -1,12 +1,33 @@
 # Copyright 2017  Alexandre Díaz, Pablo Quesada, Darío Lodeiros
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 import logging
+import threading
+import weakref
+from collections import Counter
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
+from odoo.tools.lru import LRU
 
 _logger = logging.getLogger(__name__)
 
+# Key of the pricelist items resolved in the current transaction, in the
+# precommit data of the cursor (cleared on commit, rollback and savepoints)
+ITEMS_CACHE_DATA_KEY = "pms.pricelist.items.cache"
+# Key of the pricelist items version seen by the current transaction
+ITEMS_VERSION_DATA_KEY = "pms.pricelist.items.version"
+# Key of the pending signaling flag in the precommit data of the cursor
+ITEMS_SIGNAL_DATA_KEY = "pms.pricelist.items.signal"
+# Cursors whose transaction modified pricelist items
+_ITEMS_MODIFIED = weakref.WeakKeyDictionary()
+# Pricelist items shared by the requests of this worker:
+# {dbname: (version, LRU)}
+_ITEMS_SHARED_CACHE = {}
+_ITEMS_SHARED_CACHE_LOCK = threading.RLock()
+ITEMS_SHARED_CACHE_SIZE = 8192
+# Hits and misses of the pricelist items cache in this worker
+_ITEMS_CACHE_STATS = Counter()
+
 
 class ProductPricelist(models.Model):
     """Before creating a 'daily' pricelist, you need to consider the following:
@@ -76,77 +97,388 @@ class ProductPricelist(models.Model):
     def _compute_price_rule_get_items(
         self, products_qty_partner, date, uom_id, prod_tmpl_ids, prod_ids, categ_ids
     ):
-        board_service = True if self._context.get("board_service") else False
         if (
             "property" in self._context
             and self._context["property"]
             and self._context.get("consumption_date")
         ):
-            self.env.cr.execute(
-                """
-                SELECT item.id
-                FROM   product_pricelist_item item
-                       LEFT JOIN product_category categ
-                            ON item.categ_id = categ.id
-                       LEFT JOIN product_pricelist_pms_property_rel cab
-                            ON item.pricelist_id = cab.product_pricelist_id
-                       LEFT JOIN product_pricelist_item_pms_property_rel lin
-                            ON item.id = lin.product_pricelist_item_id
-                WHERE  (lin.pms_property_id = %s OR lin.pms_property_id IS NULL)
-                   AND (cab.pms_property_id = %s OR cab.pms_property_id IS NULL)
-                   AND (item.product_tmpl_id IS NULL
-                        OR item.product_tmpl_id = ANY(%s))
-                   AND (item.product_id IS NULL OR item.product_id = ANY(%s))
-                   AND (item.categ_id IS NULL OR item.categ_id = ANY(%s))
-                   AND (item.pricelist_id = %s)
-                   AND (item.date_start IS NULL OR item.date_start <=%s)
-                   AND (item.date_end IS NULL OR item.date_end >=%s)
-                   AND (item.date_start_consumption IS NULL
-                        OR item.date_start_consumption <=%s)
-                   AND (item.date_end_consumption IS NULL
-                        OR item.date_end_consumption >=%s)
-                GROUP  BY item.id
-                ORDER  BY item.applied_on,
-                          /* REVIEW: priotrity date sale / date consumption */
-                          item.date_end - item.date_start ASC,
-                          item.date_end_consumption - item.date_start_consumption ASC,
-                          NULLIF((SELECT COUNT(1)
-                           FROM   product_pricelist_item_pms_property_rel l
-                           WHERE  item.id = l.product_pricelist_item_id)
-                          + (SELECT COUNT(1)
-                             FROM   product_pricelist_pms_property_rel c
-                             WHERE  item.pricelist_id = c.product_pricelist_id),0)
-                          NULLS LAST,
-                          item.id DESC;
-                """,
-                (
-                    self._context["property"],
-                    self._context["property"],
-                    prod_tmpl_ids,
-                    prod_ids,
-                    categ_ids,
-                    self.id,
-                    date,
-                    date,
-                    self._context["consumption_date"],
-                    self._context["consumption_date"],
-                ),
+            key = (
+                self.id,
+                self._context["property"],
+                tuple(sorted(prod_tmpl_ids)),
+                tuple(sorted(prod_ids)),
+                tuple(sorted(categ_ids)),
+                date,
+                self._context["consumption_date"],
+                self._context.get("board_service") or False,
             )
-            item_ids = [x[0] for x in self.env.cr.fetchall()]
-            items = self.env["product.pricelist.item"].browse(item_ids)
-            if board_service:
-                items = items.filtered(
-                    lambda x: x.board_service_room_type_id.id
-                    == self._context.get("board_service")
-                )
+            items_cache = self._get_pms_items_cache()
+            if key in items_cache:
+                _ITEMS_CACHE_STATS["hits"] += 1
+                return self.env["product.pricelist.item"].browse(items_cache[key])
+            _ITEMS_CACHE_STATS["misses"] += 1
+            if self._is_pms_items_cross_request_cache():
+                item_ids = self._get_pms_item_ids_cached(key)
             else:
-                items = items.filtered(lambda x: not x.board_service_room_type_id.id)
+                item_ids = self._get_pms_item_ids(key)
+            items_cache[key] = item_ids
+            items = self.env["product.pricelist.item"].browse(item_ids)
         else:
             items = super(ProductPricelist, self)._compute_price_rule_get_items(
                 products_qty_partner, date, uom_id, prod_tmpl_ids, prod_ids, categ_ids
             )
         return items
 
+    def init(self):
+        super().init()
+        # Each transaction that modifies pricelist items inserts a row, the
+        # number of rows is the version of the items shared cache
+        self.env.cr.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pms_pricelist_items_signaling (
+                txid bigint NOT NULL DEFAULT txid_current()
+            )
+            """
+        )
+
+    @api.model
+    def _get_pms_items_cache(self):
+        """Pricelist items resolved in the current transaction"""
+        cr = self.env.cr
+        items_cache = cr.precommit.data.get(ITEMS_CACHE_DATA_KEY)
+        if items_cache is None:
+            items_cache = cr.precommit.data[ITEMS_CACHE_DATA_KEY] = {}
+            # The items resolved before a rollback are never served after it
+            if not cr.postrollback.data.get(ITEMS_CACHE_DATA_KEY):
+                cr.postrollback.data[ITEMS_CACHE_DATA_KEY] = True
+                cr.postrollback.add(self._clear_pms_items_cache)
+        return items_cache
+
+    def _clear_pms_items_cache(self):
+        self.env.cr.precommit.data.pop(ITEMS_CACHE_DATA_KEY, None)
+
+    @api.model
+    def _is_pms_items_cross_request_cache(self):
+        return tools.str2bool(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("pms.pricelist_items_cross_request_cache", "False")
+        )
+
+    @api.model
+    def _get_pms_items_shared_cache(self):
+        """
+        Return the pricelist items cache shared by the requests of this
+        worker, or None if it can not be used in this transaction (the
+        transaction modified pricelist items, or it doesn't see the last
+        changes of the cached items).
+        """
+        cr = self.env.cr
+        if cr in _ITEMS_MODIFIED:
+            return None
+        data = cr.precommit.data
+        if ITEMS_VERSION_DATA_KEY not in data:
+            cr.execute("SELECT COUNT(*) FROM pms_pricelist_items_signaling")
+            data[ITEMS_VERSION_DATA_KEY] = cr.fetchone()[0]
+        version = data[ITEMS_VERSION_DATA_KEY]
+        with _ITEMS_SHARED_CACHE_LOCK:
+            cache_version, cache = _ITEMS_SHARED_CACHE.get(cr.dbname, (-1, None))
+            if cache_version < version:
+                cache = LRU(ITEMS_SHARED_CACHE_SIZE)
+                _ITEMS_SHARED_CACHE[cr.dbname] = (version, cache)
+            elif cache_version > version:
+                return None
+        return cache
+
+    @api.model
+    def _invalidate_pms_items_cache(self):
+        cr = self.env.cr
+        cr.precommit.data.pop(ITEMS_CACHE_DATA_KEY, None)
+        if cr not in _ITEMS_MODIFIED:
+            _ITEMS_MODIFIED[cr] = True
+            cr.postcommit.add(self._on_pms_items_transaction_end)
+            cr.postrollback.add(self._on_pms_items_transaction_end)
+        # The other requests drop their shared caches when the transaction
+        # is committed; the precommit callbacks are run (and cleared) by
+        # the savepoints too, the signal is registered again after them
+        if not cr.precommit.data.get(ITEMS_SIGNAL_DATA_KEY):
+            cr.precommit.data[ITEMS_SIGNAL_DATA_KEY] = True
+            cr.precommit.add(self._signal_pms_items_changes)
+
+    def _signal_pms_items_changes(self):
+        self.env.cr.execute(
+            """
+            INSERT INTO pms_pricelist_items_signaling (txid)
+            SELECT txid_current()
+            WHERE  NOT EXISTS (
+                SELECT 1
+                FROM   pms_pricelist_items_signaling
+                WHERE  txid = txid_current()
+            )
+            """
+        )
+
+    def _on_pms_items_transaction_end(self):
+        _ITEMS_MODIFIED.pop(self.env.cr, None)
+
+    @api.model
+    def get_pms_items_cache_stats(self):
+        """
+        Hits and misses of the pricelist items cache in this worker
+        :return: dict with 'hits' and 'misses'
+        """
+        return {
+            "hits": _ITEMS_CACHE_STATS["hits"],
+            "misses": _ITEMS_CACHE_STATS["misses"],
+        }
+
+    @api.model
+    def reset_pms_items_cache_stats(self):
+        _ITEMS_CACHE_STATS.clear()
+
+    @api.model
+    def _get_pms_item_ids_cached(self, key):
+        shared_cache = self._get_pms_items_shared_cache()
+        if shared_cache is None:
+            return self._get_pms_item_ids(key)
+        item_ids = shared_cache.get(key)
+        if item_ids is None:
+            item_ids = shared_cache[key] = self._get_pms_item_ids(key)
+        return item_ids
+
+    @api.model
+    def _get_pms_item_ids(self, key):
+        """
+        Get the items of a pricelist that apply in a property for a sale
+        date and a consumption date, sorted by priority.
+        :param key: tuple (pricelist id, property id, product template ids,
+            product ids, category ids, sale date, consumption date,
+            board service room type id)
+        :return: tuple of item ids
+        """
+        (
+            pricelist_id,
+            pms_property_id,
+            prod_tmpl_ids,
+            prod_ids,
+            categ_ids,
+            date,
+            consumption_date,
+            board_service,
+        ) = key
+        items_by_date = self.browse(pricelist_id)._get_pms_items_by_date(
+            pms_property_id,
+            prod_tmpl_ids,
+            prod_ids,
+            categ_ids,
+            date,
+            [consumption_date],
+            board_service,
+        )
+        return tuple(items_by_date[consumption_date].ids)
+
+    def _get_pms_items_by_date(
+        self,
+        pms_property_id,
+        prod_tmpl_ids,
+        prod_ids,
+        categ_ids,
+        date,
+        consumption_dates,
+        board_service=False,
+    ):
+        """
+        Get the items of the pricelist that apply in a property for a sale
+        date and each consumption date, with a single query for the whole
+        consumption window.
+        :return: {consumption_date: product.pricelist.item sorted by priority}
+        """
+        self.ensure_one()
+        self.env["product.pricelist.item"].flush()
+        self.env.cr.execute(
+            """
+            SELECT item.id, item.date_start_consumption, item.date_end_consumption
+            FROM   product_pricelist_item item
+                   LEFT JOIN product_category categ
+                        ON item.categ_id = categ.id
+                   LEFT JOIN product_pricelist_pms_property_rel cab
+                        ON item.pricelist_id = cab.product_pricelist_id
+                   LEFT JOIN product_pricelist_item_pms_property_rel lin
+                        ON item.id = lin.product_pricelist_item_id
+            WHERE  (lin.pms_property_id = %s OR lin.pms_property_id IS NULL)
+               AND (cab.pms_property_id = %s OR cab.pms_property_id IS NULL)
+               AND (item.product_tmpl_id IS NULL
+                    OR item.product_tmpl_id = ANY(%s))
+               AND (item.product_id IS NULL OR item.product_id = ANY(%s))
+               AND (item.categ_id IS NULL OR item.categ_id = ANY(%s))
+               AND (item.pricelist_id = %s)
+               AND (item.date_start IS NULL OR item.date_start <=%s)
+               AND (item.date_end IS NULL OR item.date_end >=%s)
+               AND (item.date_start_consumption IS NULL
+                    OR item.date_start_consumption <=%s)
+               AND (item.date_end_consumption IS NULL
+                    OR item.date_end_consumption >=%s)
+            GROUP  BY item.id
+            ORDER  BY item.applied_on,
+                      /* REVIEW: priotrity date sale / date consumption */
+                      item.date_end - item.date_start ASC,
+                      item.date_end_consumption - item.date_start_consumption ASC,
+                      NULLIF((SELECT COUNT(1)
+                       FROM   product_pricelist_item_pms_property_rel l
+                       WHERE  item.id = l.product_pricelist_item_id)
+                      + (SELECT COUNT(1)
+                         FROM   product_pricelist_pms_property_rel c
+                         WHERE  item.pricelist_id = c.product_pricelist_id),0)
+                      NULLS LAST,
+                      item.id DESC;
+            """,
+            (
+                pms_property_id,
+                pms_property_id,
+                list(prod_tmpl_ids),
+                list(prod_ids),
+                list(categ_ids),
+                self.id,
+                date,
+                date,
+                max(consumption_dates),
+                min(consumption_dates),
+            ),
+        )
+        rows = self.env.cr.fetchall()
+        items = self.env["product.pricelist.item"].browse([row[0] for row in rows])
+        if board_service:
+            board_items = items.filtered(
+                lambda x: x.board_service_room_type_id.id == board_service
+            )
+        else:
+            board_items = items.filtered(lambda x: not x.board_service_room_type_id.id)
+        board_item_ids = set(board_items.ids)
+        items_by_date = {}
+        for consumption_date in consumption_dates:
+            items_by_date[consumption_date] = self.env["product.pricelist.item"].browse(
+                [
+                    item_id
+                    for item_id, date_start, date_end in rows
+                    if item_id in board_item_ids
+                    and (not date_start or date_start <= consumption_date)
+                    and (not date_end or date_end >= consumption_date)
+                ]
+            )
+        return items_by_date
+
+    def price_stay(
+        self,
+        pms_property_id,
+        products,
+        dates,
+        date=False,
+        board_service=False,
+        partner=False,
+        quantity=1.0,
+    ):
+        """
+        Compute the price of the products for each night of a stay, reading
+        the pricelist items of the whole stay at once and applying the rules
+        in memory (same as _compute_price_rule does for a single night).
+        :param pms_property_id: property id
+        :param products: product.product recordset
+        :param dates: list of consumption dates
+        :param date: sale date (by default the context date or now)
+        :param board_service: board service room type id of the items
+            (by default the board_service in context)
+        :param partner: res.partner record
+        :param quantity: quantity of each night
+        :return: {product_id: [(price, rule_id) for each date in dates]}
+        """
+        self.ensure_one()
+        if not products or not dates:
+            return {product.id: [] for product in products}
+        date = date or self._context.get("date") or fields.Datetime.now()
+        board_service = board_service or self._context.get("board_service") or False
+        categ_ids = set()
+        for categ in products.mapped("categ_id"):
+            while categ:
+                categ_ids.add(categ.id)
+                categ = categ.parent_id
+        items_by_date = self._get_pms_items_by_date(
+            pms_property_id,
+            products.mapped("product_tmpl_id").ids,
+            products.ids,
+            list(categ_ids),
+            date,
+            dates,
+            board_service,
+        )
+        base_stays = {}
+        prices = {}
+        results = {}
+        for product in products:
+            results[product.id] = []
+            for index, consumption_date in enumerate(dates):
+                price = self._get_pms_base_price(product, "list_price", prices)
+                suitable_rule = False
+                for rule in items_by_date[consumption_date]:
+                    if not rule._pms_applies_on(product, quantity):
+                        continue
+                    if rule.base == "pricelist" and rule.base_pricelist_id:
+                        base_pricelist = rule.base_pricelist_id
+                        if base_pricelist not in base_stays:
+                            base_stays[base_pricelist] = base_pricelist.price_stay(
+                                pms_property_id,
+                                products,
+                                dates,
+                                date=date,
+                                board_service=board_service,
+                                partner=partner,
+                                quantity=quantity,
+                            )
+                        price = base_pricelist.currency_id._convert(
+                            base_stays[base_pricelist][product.id][index][0],
+                            self.currency_id,
+                            self.env.company,
+                            date,
+                            round=False,
+                        )
+                    else:
+                        price = self._get_pms_base_price(product, rule.base, prices)
+                    if price is not False:
+                        price = rule._compute_price(
+                            price,
+                            product.uom_id,
+                            product,
+                            quantity=quantity,
+                            partner=partner,
+                        )
+                        suitable_rule = rule
+                    break
+                if not suitable_rule or (
+                    suitable_rule.compute_price != "fixed"
+                    and suitable_rule.base != "pricelist"
+                ):
+                    if suitable_rule and suitable_rule.base == "standard_price":
+                        currency = product.cost_currency_id
+                    else:
+                        currency = product.currency_id
+                    price = currency._convert(
+                        price, self.currency_id, self.env.company, date, round=False
+                    )
+                results[product.id].append((price, suitable_rule and suitable_rule.id))
+        return results
+
+    @api.model
+    def _get_pms_base_price(self, product, price_type, prices):
+        if (product, price_type) not in prices:
+            prices[(product, price_type)] = product.price_compute(price_type)[
+                product.id
+            ]
+        return prices[(product, price_type)]
+
+    def write(self, vals):
+        if "pms_property_ids" in vals or "item_ids" in vals:
+            self._invalidate_pms_items_cache()
+        return super().write(vals)
+
     @api.constrains("is_pms_available", "availability_plan_id")
     def _check_is_pms_available(self):
         for record in self:
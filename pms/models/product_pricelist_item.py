@@ -117,6 +117,24 @@ class ProductPricelistItem(models.Model):
                 else False
             )
 
+    def _pms_applies_on(self, product, quantity=1.0):
+        """Check the product conditions of the item for a product variant,
+        as _compute_price_rule does with the items of a night"""
+        self.ensure_one()
+        if self.min_quantity and quantity < self.min_quantity:
+            return False
+        if self.product_tmpl_id and product.product_tmpl_id != self.product_tmpl_id:
+            return False
+        if self.product_id and product != self.product_id:
+            return False
+        if self.categ_id:
+            categ = product.categ_id
+            while categ and categ != self.categ_id:
+                categ = categ.parent_id
+            if not categ:
+                return False
+        return True
+
     def write(self, vals):
         # Check that the price in product room types are not
         # minor that min price in room type defined
@@ -134,18 +152,26 @@ class ProductPricelistItem(models.Model):
                     """The price in product room types can't be minor
                     that min price in room type defined"""
                 )
+        self.env["product.pricelist"]._invalidate_pms_items_cache()
         return super().write(vals)
 
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         # Check that the price in product room types are not
         # minor that min price in room type defined
         # REVIEW: By the momment only check fixed prices
-        if "fixed_price" in vals:
-            product_id = self.env["product.product"].browse(vals["product_id"])
-            if product_id.room_type_id and product_id.room_type_id.min_price:
-                if vals["fixed_price"] < product_id.room_type_id.min_price:
-                    raise ValueError(
-                        """The price in product room types can't be minor
-                        that min price in room type defined"""
-                    )
-        return super().create(vals)
+        for vals in vals_list:
+            if "fixed_price" in vals:
+                product_id = self.env["product.product"].browse(vals["product_id"])
+                if product_id.room_type_id and product_id.room_type_id.min_price:
+                    if vals["fixed_price"] < product_id.room_type_id.min_price:
+                        raise ValueError(
+                            """The price in product room types can't be minor
+                            that min price in room type defined"""
+                        )
+        self.env["product.pricelist"]._invalidate_pms_items_cache()
+        return super().create(vals_list)
+
+    def unlink(self):
+        self.env["product.pricelist"]._invalidate_pms_items_cache()
+        return super().unlink()
@@ -67,71 +67,62 @@ class ProductTemplate(models.Model):
 
     @api.depends_context("allowed_pms_property_ids")
     def _compute_daily_limit(self):
+        pms_property_id = (
+            self.env.context.get("property")
+            or self.env.user.get_active_property_ids()[0]
+        )
+        daily_limits = self.env["ir.pms.property"].get_field_values(
+            pms_property_id, self, "daily_limit"
+        )
         for record in self:
-            pms_property_id = (
-                self.env.context.get("property")
-                or self.env.user.get_active_property_ids()[0]
-            )
-            record.daily_limit = self.env["ir.pms.property"].get_field_value(
-                pms_property_id,
-                self._name,
-                "daily_limit",
-                record.id,
-                type(record.daily_limit),
-            )
+            record.daily_limit = daily_limits.get(record.id, False)
 
     @api.depends_context("allowed_pms_property_ids")
     def _compute_list_price(self):
+        pms_property_id = (
+            self.env.context.get("property")
+            or self.env.user.get_active_property_ids()[0]
+        )
+        list_prices = self.env["ir.pms.property"].get_field_values(
+            pms_property_id, self, "list_price"
+        )
         for record in self:
-            pms_property_id = (
-                self.env.context.get("property")
-                or self.env.user.get_active_property_ids()[0]
-            )
-            record.list_price = self.env["ir.pms.property"].get_field_value(
-                pms_property_id,
-                self._name,
-                "list_price",
-                record.id,
-                type(record.list_price),
-            )
+            record.list_price = list_prices.get(record.id, False)
 
     def _inverse_daily_limit(self):
-        for record in self:
-            pms_property_id = (
-                self.env.context.get("property")
-                or self.env.user.get_active_property_ids()[0]
-            )
-            self.env["ir.pms.property"].set_field_value(
-                pms_property_id,
-                self._name,
-                "daily_limit",
-                record.id,
-                record.daily_limit,
-            )
+        pms_property_id = (
+            self.env.context.get("property")
+            or self.env.user.get_active_property_ids()[0]
+        )
+        self.env["ir.pms.property"].set_field_values(
+            pms_property_id,
+            self._name,
+            "daily_limit",
+            {record.id: record.daily_limit for record in self},
+        )
 
     def _inverse_list_price(self):
-        for record in self:
-            pms_property_id = (
-                self.env.context.get("property")
-                or self.env.user.get_active_property_ids()[0]
+        pms_property_id = (
+            self.env.context.get("property")
+            or self.env.user.get_active_property_ids()[0]
+        )
+        list_prices = {record.id: record.list_price for record in self}
+        self.env["ir.pms.property"].set_field_values(
+            pms_property_id, self._name, "list_price", list_prices
+        )
+        # Set default value in other properties
+        other_properties = self.env["pms.property"].search([])
+        for other_property in other_properties.ids:
+            other_list_prices = self.env["ir.pms.property"].get_field_values(
+                other_property, self, "list_price"
             )
-            self.env["ir.pms.property"].set_field_value(
-                pms_property_id, self._name, "list_price", record.id, record.list_price
+            self.env["ir.pms.property"].set_field_values(
+                other_property,
+                self._name,
+                "list_price",
+                {
+                    record_id: list_price
+                    for record_id, list_price in list_prices.items()
+                    if not other_list_prices[record_id]
+                },
             )
-            # Set default value in other properties
-            other_properties = self.env["pms.property"].search([])
-            for other_property in other_properties.ids:
-                if not self.env["ir.pms.property"].get_field_value(
-                    other_property,
-                    self._name,
-                    "list_price",
-                    record.id,
-                    type(record.list_price),
-                ):
-                    self.env["ir.pms.property"].set_field_value(
-                        other_property,
-                        self._name,
-                        "list_price",
-                        record.id,
-                        record.list_price,
-                    )
@@ -38,6 +38,8 @@ from . import test_pms_wizard_split_join_swap_reservation
 from . import test_product_template
 from . import test_pms_multiproperty
 from . import test_shared_room
+from . import test_pms_occupancy_index
+from . import test_pms_reservation_priority_benchmark
 
 # from . import test_automated_mails
 from . import test_pms_service
@@ -1,7 +1,7 @@
 import datetime
 
 from odoo import fields
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
 
 from .common import TestPms
 
@@ -627,3 +627,189 @@ class TestPmsRoomTypeAvailabilityRules(TestPms):
                     "partner_id": self.partner1.id,
                 }
             )
+
+    def test_rule_matrix_invalidated_on_rule_write(self):
+        """
+        Check that the availability plan rules are evaluated again
+        after a rule is modified in the same transaction.
+        --------------------
+        A closed rule is created for double rooms and the availability
+        is computed. Then the rule is opened and the double rooms must
+        be available again.
+        """
+        # ARRANGE
+        checkin = fields.date.today()
+        checkout = checkin + datetime.timedelta(days=2)
+        rule = self.env["pms.availability.plan.rule"].create(
+            {
+                "availability_plan_id": self.test_room_type_availability1.id,
+                "room_type_id": self.test_room_type_double.id,
+                "date": checkin + datetime.timedelta(days=1),
+                "closed": True,
+                "pms_property_id": self.pms_property3.id,
+            }
+        )
+        availability = self.pms_property3.get_availability_matrix(
+            checkin,
+            checkout,
+            pricelist_id=self.pricelist2.id,
+            room_type_ids=[self.test_room_type_double.id],
+        )
+        # ACT
+        rule.closed = False
+        availability_opened = self.pms_property3.get_availability_matrix(
+            checkin,
+            checkout,
+            pricelist_id=self.pricelist2.id,
+            room_type_ids=[self.test_room_type_double.id],
+        )
+        # ASSERT
+        self.assertFalse(
+            availability[self.test_room_type_double.id]["free_room_ids"],
+            "The closed rule should block the double rooms",
+        )
+        self.assertEqual(
+            set(availability_opened[self.test_room_type_double.id]["free_room_ids"]),
+            {self.test_room1_double.id, self.test_room2_double.id},
+            "The double rooms should be available after opening the rule",
+        )
+
+    def test_rule_matrix_discarded_on_savepoint_rollback(self):
+        """
+        Check that the availability plan rules loaded in a savepoint
+        are not used after the savepoint is rolled back.
+        --------------------
+        A closed rule is created for double rooms and the availability
+        is computed inside a savepoint that is rolled back. Then the
+        double rooms must be available again.
+        """
+        # ARRANGE
+        checkin = fields.date.today()
+        checkout = checkin + datetime.timedelta(days=2)
+        availability = {}
+        # ACT
+        with self.assertRaises(UserError):
+            with self.env.cr.savepoint():
+                self.env["pms.availability.plan.rule"].create(
+                    {
+                        "availability_plan_id": self.test_room_type_availability1.id,
+                        "room_type_id": self.test_room_type_double.id,
+                        "date": checkin + datetime.timedelta(days=1),
+                        "closed": True,
+                        "pms_property_id": self.pms_property3.id,
+                    }
+                )
+                availability = self.pms_property3.get_availability_matrix(
+                    checkin,
+                    checkout,
+                    pricelist_id=self.pricelist2.id,
+                    room_type_ids=[self.test_room_type_double.id],
+                )
+                raise UserError("Rollback the savepoint")
+        self.env["base"].invalidate_cache()
+        availability_rolled_back = self.pms_property3.get_availability_matrix(
+            checkin,
+            checkout,
+            pricelist_id=self.pricelist2.id,
+            room_type_ids=[self.test_room_type_double.id],
+        )
+        # ASSERT
+        self.assertFalse(
+            availability[self.test_room_type_double.id]["free_room_ids"],
+            "The closed rule should block the double rooms",
+        )
+        self.assertEqual(
+            set(
+                availability_rolled_back[self.test_room_type_double.id]["free_room_ids"]
+            ),
+            {self.test_room1_double.id, self.test_room2_double.id},
+            "The rolled back rule should not block the double rooms",
+        )
+
+    def test_ensure_avails(self):
+        """
+        Check that the availability records are created only for the
+        missing keys and that their real availability is computed.
+        --------------------
+        Create the availability of today for double rooms and call
+        ensure_avails with today and tomorrow keys.
+        """
+        # ARRANGE
+        today = fields.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        Avail = self.env["pms.availability"]
+        key_today = (self.test_room_type_double.id, today, self.pms_property3.id)
+        key_tomorrow = (self.test_room_type_double.id, tomorrow, self.pms_property3.id)
+        avail_today = Avail.search(
+            [
+                ("room_type_id", "=", self.test_room_type_double.id),
+                ("date", "=", today),
+                ("pms_property_id", "=", self.pms_property3.id),
+            ]
+        ) or Avail.create(
+            {
+                "room_type_id": self.test_room_type_double.id,
+                "date": today,
+                "pms_property_id": self.pms_property3.id,
+            }
+        )
+        # ACT
+        avail_ids = Avail.ensure_avails([key_today, key_tomorrow, key_tomorrow])
+        # ASSERT
+        self.assertEqual(
+            avail_ids[key_today],
+            avail_today.id,
+            "The existing availability should be reused",
+        )
+        self.assertEqual(
+            Avail.browse(avail_ids[key_tomorrow]).real_avail,
+            2,
+            "The real availability of the created availability should be computed",
+        )
+
+    def test_daily_closing(self):
+        """
+        Check that the daily closing closes the existing rules of today and
+        creates the missing ones only for the room types of each property.
+        --------------------
+        Create an open rule of today for single rooms in property 3 and
+        close property 1 and property 3.
+        """
+        # ARRANGE
+        today = fields.date.today()
+        Rule = self.env["pms.availability.plan.rule"]
+        open_rule = Rule.create(
+            {
+                "availability_plan_id": self.test_room_type_availability1.id,
+                "room_type_id": self.test_room_type_single.id,
+                "date": today,
+                "pms_property_id": self.pms_property3.id,
+            }
+        )
+        # ACT
+        self.env["pms.property"].daily_closing(
+            [self.pms_property1.id, self.pms_property3.id]
+        )
+        # ASSERT
+        self.assertTrue(open_rule.closed, "The existing rule should be closed")
+        self.assertTrue(
+            Rule.search(
+                [
+                    ("availability_plan_id", "=", self.test_room_type_availability1.id),
+                    ("room_type_id", "=", self.test_room_type_double.id),
+                    ("date", "=", today),
+                    ("pms_property_id", "=", self.pms_property3.id),
+                    ("closed", "=", True),
+                ]
+            ),
+            "The missing rule should be created closed",
+        )
+        self.assertFalse(
+            Rule.search(
+                [
+                    ("room_type_id", "=", self.test_room_type_single.id),
+                    ("pms_property_id", "=", self.pms_property1.id),
+                ]
+            ),
+            "The room types of a property should not be closed in other properties",
+        )
@@ -4,6 +4,7 @@ from freezegun import freeze_time
 
 from odoo import fields
 
+from ..models.product_pricelist import ITEMS_CACHE_DATA_KEY
 from .common import TestPms
 
 
@@ -79,6 +80,13 @@ class TestPmsBookingEngine(TestPms):
             }
         )
 
+    def setUp(self):
+        super().setUp()
+        # The tests are rolled back with ROLLBACK TO SAVEPOINT, that doesn't
+        # run the cursor hooks, so the pricelist items resolved by a test
+        # are dropped here to not be served to the next ones
+        self.addCleanup(self.cr.precommit.data.pop, ITEMS_CACHE_DATA_KEY, None)
+
     def test_price_wizard_correct(self):
         # TEST CASE
         """
@@ -737,6 +745,67 @@ class TestPmsBookingEngine(TestPms):
 
         self.assertEqual(room_type_plan_avail, 0, "Quota not applied in Wizard Folio")
 
+    def test_availability_matrix_same_as_availability(self):
+        """
+        Check that the availability matrix of the property returns for
+        each room type the same availability than the property
+        availability field with the room type in context.
+        -----------------
+        A reservation is created in a double room and then an availability
+        plan rule with quota = 2 is created for the second night. Then the
+        matrix is computed for a three nights stay and compared room type
+        by room type with the availability field.
+        """
+
+        # ARRANGE
+        checkin = fields.date.today()
+        checkout = fields.date.today() + datetime.timedelta(days=3)
+        self.env["pms.reservation"].create(
+            {
+                "checkin": checkin,
+                "checkout": checkout,
+                "room_type_id": self.test_room_type_double.id,
+                "partner_id": self.partner_id.id,
+                "pms_property_id": self.pms_property1.id,
+                "sale_channel_origin_id": self.sale_channel_direct1.id,
+            }
+        )
+        self.env["pms.availability.plan.rule"].create(
+            {
+                "quota": 2,
+                "room_type_id": self.test_room_type_double.id,
+                "availability_plan_id": self.availability_plan1.id,
+                "date": fields.date.today() + datetime.timedelta(days=1),
+                "pms_property_id": self.pms_property1.id,
+            }
+        )
+
+        # ACT
+        matrix = self.pms_property1.get_availability_matrix(
+            checkin=checkin,
+            checkout=checkout,
+            pricelist_id=self.pricelist1.id,
+        )
+
+        # ASSERT
+        for room_type_id, room_type_avail in matrix.items():
+            with self.subTest(room_type_id=room_type_id):
+                self.assertEqual(
+                    room_type_avail["availability"],
+                    self.pms_property1.with_context(
+                        checkin=checkin,
+                        checkout=checkout,
+                        room_type_id=room_type_id,
+                        pricelist_id=self.pricelist1.id,
+                    ).availability,
+                    "The availability matrix doesn't match the availability",
+                )
+        self.assertEqual(
+            matrix[self.test_room_type_double.id]["availability"],
+            2,
+            "The quota of the rule should limit the availability",
+        )
+
     @freeze_time("2015-05-05")
     def test_price_total_with_board_service(self):
         """
@@ -1,5 +1,6 @@
 import datetime
 import logging
+from unittest.mock import patch
 
 from dateutil.relativedelta import relativedelta
 from freezegun import freeze_time
@@ -1660,3 +1661,86 @@ class TestPmsCheckinPartner(TestPms):
                         self.partner_id[key],
                         "The value of " + key + " is not correctly established",
                     )
+
+    def test_import_room_list(self):
+        """
+        Check that the room list rows with the same values are written
+        together and that the rows that can not be imported are reported
+        without preventing the import of the rest
+        ----------
+        Import four rows: two with the same gender and nationality, one with
+        an unknown identifier and one with an unknown nationality
+        """
+        # ARRANGE
+        checkin1, checkin2, checkin3 = self.reservation_1.checkin_partner_ids[:3]
+        checkin1.identifier = "ROOMLIST1"
+        checkin2.identifier = "ROOMLIST2"
+        checkin3.identifier = "ROOMLIST3"
+        nationality = self.env["res.country"].search([("code", "=", "ES")])
+        roomlist = [
+            {
+                "row": "Row 1",
+                "identifier": "ROOMLIST1",
+                "reservation_id": self.reservation_1.id,
+                "gender": "female",
+                "nationality_id": nationality.name,
+            },
+            {
+                "row": "Row 2",
+                "identifier": "ROOMLIST2",
+                "reservation_id": self.reservation_1.id,
+                "gender": "female",
+                "nationality_id": nationality.name,
+            },
+            {
+                "row": "Row 3",
+                "identifier": "ROOMLIST4",
+                "reservation_id": self.reservation_1.id,
+                "gender": "male",
+            },
+            {
+                "row": "Row 4",
+                "identifier": "ROOMLIST3",
+                "reservation_id": self.reservation_1.id,
+                "gender": "male",
+                "nationality_id": "Unknown Country",
+            },
+        ]
+        CheckinPartner = type(self.env["pms.checkin.partner"])
+
+        # ACT
+        with patch.object(
+            CheckinPartner, "write", autospec=True, side_effect=CheckinPartner.write
+        ) as write:
+            errors = self.env["pms.checkin.partner"].import_room_list(roomlist)
+
+        # ASSERT
+        self.assertTrue(
+            any(
+                set(call[0][0].ids) == {checkin1.id, checkin2.id}
+                for call in write.call_args_list
+            ),
+            "The checkins with the same values should be written together",
+        )
+        self.assertEqual(
+            (checkin1 | checkin2).mapped("gender"),
+            ["female", "female"],
+            "The valid rows should be imported",
+        )
+        self.assertEqual(
+            (checkin1 | checkin2).nationality_id,
+            nationality,
+            "The nationality should be looked up by name",
+        )
+        self.assertEqual(len(errors), 2, "Each invalid row should be reported")
+        self.assertTrue(
+            errors[0].startswith("Row 3:") and "ROOMLIST4" in errors[0],
+            "The unknown identifier should be reported",
+        )
+        self.assertTrue(
+            errors[1].startswith("Row 4:") and "Unknown Country" in errors[1],
+            "The unknown nationality should be reported",
+        )
+        self.assertNotEqual(
+            checkin3.gender, "male", "The row with errors should not be imported"
+        )
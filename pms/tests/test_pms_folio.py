@@ -195,6 +195,59 @@ class TestPmsFolio(TestPms):
             self.commission, folio1.commission, "The folio compute commission is wrong"
         )
 
+    def test_defer_folio_recompute(self):
+        """
+        Check that the folio amounts are computed once at the end of a
+        deferral block with the values of all the changes of the block.
+        -------
+        Folio with one reservation of 3 nights at 20$, change the price
+        of each night to 30$ one by one reading the folio total inside a
+        deferral block and check that the total is the reservation total
+        after the block and that the computations inside the block were coalesced.
+        """
+        # ARRANGE
+        self.create_sale_channel_scenario()
+        folio1 = self.env["pms.folio"].create(
+            {
+                "agency_id": self.agency1.id,
+                "pms_property_id": self.pms_property1.id,
+            }
+        )
+        reservation = self.env["pms.reservation"].create(
+            {
+                "folio_id": folio1.id,
+                "room_type_id": self.room_type_double.id,
+                "reservation_line_ids": [
+                    (
+                        0,
+                        False,
+                        {
+                            "date": fields.date.today() + datetime.timedelta(days=d),
+                            "price": 20,
+                        },
+                    )
+                    for d in range(3)
+                ],
+            }
+        )
+        folio1.flush()
+        self.env["pms.folio"].reset_deferred_recompute_stats()
+        # ACT
+        with self.env["pms.folio"]._defer_recompute():
+            for line in reservation.reservation_line_ids:
+                line.price = 30
+                folio1.amount_total  # read inside the block
+        # ASSERT
+        self.assertEqual(
+            folio1.amount_total,
+            reservation.price_total,
+            "The folio total should include every change",
+        )
+        stats = self.env["pms.folio"].get_deferred_recompute_stats()
+        self.assertGreater(
+            stats["coalesced"], 0, "The folio computations should be coalesced"
+        )
+
     def test_folio_commission(self):
         """
         Check commission of a folio with several reservations that have commission
@@ -494,6 +547,111 @@ class TestPmsFolio(TestPms):
             does not correspond to the amount that it should",
         )
 
+    def _create_demo_reservation(self, room):
+        return self.env["pms.reservation"].create(
+            {
+                "pms_property_id": self.pms_property_demo.id,
+                "checkin": datetime.datetime.now(),
+                "checkout": datetime.datetime.now() + datetime.timedelta(days=1),
+                "adults": 2,
+                "partner_id": self.env.ref("base.res_partner_12").id,
+                "preferred_room_id": room.id,
+                "sale_channel_origin_id": self.sale_channel_direct1.id,
+            }
+        )
+
+    def _post_folios_payment(self, folios, amount, currency=False):
+        journal = self.env["account.journal"].browse(
+            folios[0].pms_property_id._get_payment_methods().ids[0]
+        )
+        payment = self.env["account.payment"].create(
+            {
+                "journal_id": journal.id,
+                "partner_id": self.env.ref("base.res_partner_12").id,
+                "amount": amount,
+                "currency_id": (currency or folios[0].currency_id).id,
+                "date": fields.date.today(),
+                "folio_ids": [(6, 0, folios.ids)],
+                "payment_type": "inbound",
+                "partner_type": "customer",
+            }
+        )
+        payment.action_post()
+        return payment
+
+    @freeze_time("2000-02-02")
+    def test_pay_folios_with_shared_payment(self):
+        """
+        A payment shared by two folios pays both folios when it covers
+        the total of the two folios.
+        -----
+        Create two reservations in different folios, pay both folios with
+        a single payment of the sum of their totals and check the pending
+        amount and the payment state of both folios
+        """
+        # ARRANGE
+        self.create_configuration_accounting_scenario()
+        folio1 = self._create_demo_reservation(self.double1).folio_id
+        folio2 = self._create_demo_reservation(self.double2).folio_id
+        # ACT
+        self._post_folios_payment(
+            folio1 | folio2, folio1.amount_total + folio2.amount_total
+        )
+        # ASSERT
+        self.assertEqual(
+            (folio1 | folio2).mapped("pending_amount"),
+            [0.0, 0.0],
+            "The folios paid with a shared payment should have nothing pending",
+        )
+        self.assertEqual(
+            (folio1 | folio2).mapped("payment_state"),
+            ["paid", "paid"],
+            "The folios paid with a shared payment should be paid",
+        )
+        self.assertTrue(folio1.payment_multi, "The payment should be multi folio")
+
+    @freeze_time("2000-02-02")
+    def test_partial_pay_folio_foreign_currency(self):
+        """
+        The payments in other currency are converted to the folio currency
+        at the payment date.
+        -----
+        Create a reservation and pay its folio in other currency with the
+        amount of the folio total minus 10 converted to that currency, the
+        pending amount must be 10 and the folio partially paid
+        """
+        # ARRANGE
+        self.create_configuration_accounting_scenario()
+        folio = self._create_demo_reservation(self.double1).folio_id
+        currency = self.env.ref("base.EUR")
+        if folio.currency_id == currency:
+            currency = self.env.ref("base.USD")
+        currency.active = True
+        self.env["res.currency.rate"].create(
+            {
+                "name": fields.date.today(),
+                "rate": folio.currency_id.rate * 2,
+                "currency_id": currency.id,
+                "company_id": folio.company_id.id,
+            }
+        )
+        amount = folio.currency_id._convert(
+            folio.amount_total - 10,
+            currency,
+            folio.company_id,
+            fields.date.today(),
+        )
+        # ACT
+        self._post_folios_payment(folio, amount, currency)
+        # ASSERT
+        self.assertAlmostEqual(
+            folio.pending_amount,
+            10.0,
+            places=2,
+            msg="The payment should be converted to the folio currency",
+        )
+        self.assertEqual(folio.payment_state, "partial")
+
     def test_reservation_type_folio(self):
         """
         Check that the reservation_type of a folio with
@@ -2,6 +2,8 @@ import datetime
 
 from odoo import fields
 
+from odoo.addons.queue_job.job import Job
+
 from .common import TestPms
 
 
@@ -711,6 +713,221 @@ class TestPmsFolioInvoice(TestPms):
             "The autoinvoice date in folio with property checkout policy is wrong",
         )
 
+    def test_autoinvoice_folios_by_batches(self):
+        """
+        Check that the folios to autoinvoice are split in batches of the
+        configured size and that the run summarizes them
+        --------------------------------------
+        Set the autoinvoicing batch size to 1, create two folios in the
+        same property, invoice them by batches and check that the run
+        has a batch for each folio and every folio is processed
+        """
+        # ARRANGE
+        self.create_configuration_accounting_scenario()
+        self.env["ir.config_parameter"].sudo().set_param(
+            "pms.autoinvoicing_batch_size", 1
+        )
+        folios = self.env["pms.folio"]
+        for room in (self.double1, self.double2):
+            folios |= (
+                self.env["pms.reservation"]
+                .create(
+                    {
+                        "pms_property_id": self.pms_property_demo.id,
+                        "checkin": datetime.date.today() - datetime.timedelta(days=2),
+                        "checkout": datetime.date.today(),
+                        "adults": 2,
+                        "room_type_id": self.demo_room_type_double.id,
+                        "preferred_room_id": room.id,
+                        "partner_id": self.partner_id.id,
+                        "sale_channel_origin_id": self.sale_channel_direct1.id,
+                    }
+                )
+                .folio_id
+            )
+        # ACT
+        run = self.env["pms.property"]._autoinvoice_folios_by_batches(
+            folios, fields.Date.today()
+        )
+        # ASSERT
+        self.assertEqual(
+            run.batch_ids.mapped("folio_ids"),
+            folios,
+            "Every folio should be in a batch of the run",
+        )
+        self.assertEqual(len(run.batch_ids), 2, "The run should have 2 batches")
+        self.assertEqual(run.state, "done", "Every batch should be processed")
+        self.assertEqual(
+            run.folio_count, 2, "The run should summarize the folios invoiced"
+        )
+        for batch in run.batch_ids:
+            self.assertEqual(
+                batch.invoice_ids,
+                batch.folio_ids.move_ids,
+                "The batch should register the invoices of its folio",
+            )
+        self.assertEqual(
+            len(run.batch_ids.invoice_ids), 2, "Each folio should be invoiced"
+        )
+        self.assertEqual(run.invoice_count, 2, "The run should count its invoices")
+
+    def test_autoinvoice_folios_by_batches_with_delay(self):
+        """
+        Check that the autoinvoicing batches of each property are enqueued
+        once in the sub-channel of their property and that the jobs invoice
+        their folios
+        --------------------------------------
+        Create a folio in two properties, enqueue the batches, perform the
+        jobs and check the channel and identity of the jobs and the
+        invoices of the run
+        """
+        # ARRANGE
+        self.create_configuration_accounting_scenario()
+        pms_property2 = self.env["pms.property"].create(
+            {
+                "name": "Property 2 Based on Company Demo",
+                "company_id": self.env.ref("base.main_company").id,
+                "default_pricelist_id": self.env.ref("product.list0").id,
+            }
+        )
+        self.demo_room_type_double.pms_property_ids |= pms_property2
+        room_property2 = self.env["pms.room"].create(
+            {
+                "pms_property_id": pms_property2.id,
+                "name": "Double 201",
+                "room_type_id": self.demo_room_type_double.id,
+                "capacity": 2,
+            }
+        )
+        folios = self.env["pms.folio"]
+        for pms_property, room in (
+            (self.pms_property_demo, self.double1),
+            (pms_property2, room_property2),
+        ):
+            folios |= (
+                self.env["pms.reservation"]
+                .create(
+                    {
+                        "pms_property_id": pms_property.id,
+                        "checkin": datetime.date.today() - datetime.timedelta(days=2),
+                        "checkout": datetime.date.today(),
+                        "adults": 2,
+                        "room_type_id": self.demo_room_type_double.id,
+                        "preferred_room_id": room.id,
+                        "partner_id": self.partner_id.id,
+                        "sale_channel_origin_id": self.sale_channel_direct1.id,
+                    }
+                )
+                .folio_id
+            )
+        channels_before = self.env["queue.job.channel"].search([])
+        jobs_before = self.env["queue.job"].search([])
+        # ACT
+        run = self.env["pms.property"]._autoinvoice_folios_by_batches(
+            folios, fields.Date.today(), with_delay=True
+        )
+        jobs = self.env["queue.job"].search([]) - jobs_before
+        for job in jobs:
+            Job.load(self.env, job.uuid).perform()
+        # ASSERT
+        self.assertEqual(len(jobs), 2, "Each batch should be a job")
+        self.assertEqual(
+            set(jobs.mapped("channel")),
+            {
+                "root.autoinvoicing folios.property_%s" % self.pms_property_demo.id,
+                "root.autoinvoicing folios.property_%s" % pms_property2.id,
+            },
+            "The batches of each property should be enqueued in its sub-channel",
+        )
+        self.assertEqual(
+            set(jobs.mapped("identity_key")),
+            {"pms_autoinvoicing_batch_%s" % batch.id for batch in run.batch_ids},
+            "Each job should be identified by its batch",
+        )
+        self.assertEqual(
+            self.env["queue.job.channel"].search([]),
+            channels_before,
+            "No queue channel should be created by the autoinvoicing",
+        )
+        self.assertEqual(run.state, "done", "Every batch should be processed")
+        self.assertEqual(
+            run.batch_ids.invoice_ids,
+            folios.move_ids,
+            "The jobs should register the invoices of the folios",
+        )
+        self.assertEqual(len(folios.move_ids), 2, "Each folio should be invoiced")
+
+    def test_autoreconcile_folio_payments_by_partner(self):
+        """
+        Check that the invoices of a folio are only reconciled with the
+        payments of their partner
+        --------------------------------------
+        Pay the whole folio by a partner, invoice the folio to other
+        partner and check that the invoice is not paid by the payment of
+        the first partner, then pay it by its partner and check that the
+        invoice is paid
+        """
+        # ARRANGE
+        self.create_configuration_accounting_scenario()
+        partner2 = self.env["res.partner"].create(
+            {
+                "name": "Sara",
+                "vat": "54235544A",
+                "country_id": self.env.ref("base.es").id,
+                "city": "Madrid",
+                "zip": "28013",
+                "street": "Street 321",
+            }
+        )
+        reservation = self.env["pms.reservation"].create(
+            {
+                "pms_property_id": self.pms_property_demo.id,
+                "checkin": datetime.date.today() - datetime.timedelta(days=2),
+                "checkout": datetime.date.today(),
+                "adults": 2,
+                "room_type_id": self.demo_room_type_double.id,
+                "partner_id": partner2.id,
+                "sale_channel_origin_id": self.sale_channel_direct1.id,
+            }
+        )
+        folio = reservation.folio_id
+        journal = self.env["account.journal"].browse(
+            folio.pms_property_id._get_payment_methods().ids[0]
+        )
+        folio.do_payment(
+            journal=journal,
+            receivable_account=journal.suspense_account_id,
+            user=self.env.user,
+            amount=folio.pending_amount,
+            folio=folio,
+            partner=partner2,
+            date=fields.date.today(),
+        )
+        # ACT
+        invoice = folio._create_invoices(partner_invoice_id=self.partner_id.id)
+        invoice.action_post()
+        payment_state_other_partner = invoice.payment_state
+        folio.do_payment(
+            journal=journal,
+            receivable_account=journal.suspense_account_id,
+            user=self.env.user,
+            amount=invoice.amount_residual,
+            folio=folio,
+            partner=self.partner_id,
+            date=fields.date.today(),
+        )
+        # ASSERT
+        self.assertEqual(
+            payment_state_other_partner,
+            "not_paid",
+            "The invoice should not be paid by other partner payments",
+        )
+        self.assertIn(
+            invoice.payment_state,
+            ("in_payment", "paid"),
+            "The invoice should be paid by the payments of its partner",
+        )
+
     def test_autoinvoice_paid_folio_overnights_partner_policy(self):
         """
         Test create and invoice the cron by partner preconfig automation
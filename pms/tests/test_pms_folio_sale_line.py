@@ -420,6 +420,49 @@ class TestPmsFolioSaleLine(TestPms):
             "deleted if it is not necessary",
         )
 
+    def test_comp_fsl_rooms_unchanged_group_keeps_sale_line(self):
+        """
+        Check that changing the price of a night keeps the sale lines of the
+        groups of nights that did not change.
+        ------------------
+        Create a reservation of 3 nights with a price of 25.0 and change
+        the price of the first night to 50.0. Then change the price of the
+        third night to 30.0 and check that the first night is still in the
+        same sale line and that the folio has 3 sale lines.
+        """
+        # ARRANGE
+        r_test = self.env["pms.reservation"].create(
+            {
+                "pms_property_id": self.pms_property1.id,
+                "checkin": datetime.datetime.now(),
+                "checkout": datetime.datetime.now() + datetime.timedelta(days=3),
+                "adults": 2,
+                "room_type_id": self.room_type_double.id,
+                "partner_id": self.env.ref("base.res_partner_12").id,
+                "sale_channel_origin_id": self.sale_channel_direct1.id,
+            }
+        )
+        nights = r_test.reservation_line_ids.sorted("date")
+        nights[0].price = 50
+        r_test.flush()
+        first_night_sale_line = nights[0].sale_line_ids
+
+        # ACT
+        nights[2].price = 30
+        r_test.flush()
+
+        # ASSERT
+        self.assertEqual(
+            nights[0].sale_line_ids,
+            first_night_sale_line,
+            "The sale line of a night that did not change should be kept",
+        )
+        self.assertEqual(
+            len(r_test.folio_id.sale_line_ids.filtered(lambda x: not x.display_type)),
+            3,
+            "Folio should contain 3 reservation sale lines",
+        )
+
     # BOARD SERVICES
     def test_comp_fsl_board_services_all_same_group(self):
 
@@ -256,6 +256,31 @@ class TestPmsMultiproperty(TestPms):
                         "pms_property_id"
                     ]
 
+    # AVAILABILITY
+    def test_ensure_avails_room_type_property_not_allowed(self):
+        """
+        Check that the availability records inserted in bulk are checked
+        against the properties of their room types, as in create()
+        ----------
+        Room type restricted to pms_property2, ensure the availability of
+        the room type in pms_property1 and check the exception
+        """
+        # ARRANGE
+        room_type = self.env["pms.room.type"].create(
+            {
+                "pms_property_ids": [(4, self.pms_property2.id)],
+                "name": "Room Type Property 2",
+                "default_code": "RTP2",
+                "class_id": self.room_type_class1.id,
+            }
+        )
+        date = fields.date.today() + datetime.timedelta(days=2)
+        # ACT & ASSERT
+        with self.assertRaises(UserError):
+            self.env["pms.availability"].ensure_avails(
+                [(room_type.id, date, self.pms_property1.id)]
+            )
+
     # BOARD SERVICE LINE
     def test_pms_bsl_product_property_integrity(self):
         """
@@ -0,0 +1,212 @@
+import datetime
+
+from odoo import SUPERUSER_ID, api, fields
+from odoo.tests import common
+
+from ..models import pms_occupancy_index
+
+
+@common.tagged("-at_install", "post_install")
+class TestPmsOccupancyIndex(common.TransactionCase):
+    """The occupancy index only contains committed reservation lines, so
+    these tests work with their own committed cursors and remove their
+    records when they finish."""
+
+    def setUp(self):
+        super().setUp()
+        self.checkin = fields.date.today() + datetime.timedelta(days=700)
+        self.checkout = self.checkin + datetime.timedelta(days=2)
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            self.pms_property_id = env.ref("pms.main_pms_property").id
+            room_type_class = env["pms.room.type.class"].create(
+                {"name": "Occupancy Index Class", "default_code": "OIC"}
+            )
+            room_type = env["pms.room.type"].create(
+                {
+                    "pms_property_ids": [self.pms_property_id],
+                    "name": "Occupancy Index Type",
+                    "default_code": "OIT",
+                    "class_id": room_type_class.id,
+                }
+            )
+            rooms = env["pms.room"].create(
+                [
+                    {
+                        "pms_property_id": self.pms_property_id,
+                        "name": name,
+                        "room_type_id": room_type.id,
+                        "capacity": 2,
+                    }
+                    for name in ("Occupancy Index 1", "Occupancy Index 2")
+                ]
+            )
+            sale_channel = env["pms.sale.channel"].create(
+                {"name": "Occupancy Index Channel", "channel_type": "direct"}
+            )
+            partner = env["res.partner"].create({"name": "Occupancy Index Guest"})
+            self.room1_id, self.room2_id = rooms.ids
+            self.room_type_id = room_type.id
+            self.sale_channel_id = sale_channel.id
+            self.partner_id = partner.id
+            self.records = [
+                ("res.partner", partner.ids),
+                ("pms.sale.channel", sale_channel.ids),
+                ("pms.room", rooms.ids),
+                ("pms.room.type", room_type.ids),
+                ("pms.room.type.class", room_type_class.ids),
+            ]
+        self.addCleanup(self._remove_records)
+        self._pop_index()
+
+    def _pop_index(self):
+        with pms_occupancy_index._INDEXES_LOCK:
+            pms_occupancy_index._INDEXES.get(self.cr.dbname, {}).pop(
+                self.pms_property_id, None
+            )
+
+    def _remove_records(self):
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            reservations = env["pms.reservation"].search(
+                [("preferred_room_id", "in", [self.room1_id, self.room2_id])]
+            )
+            folios = reservations.folio_id
+            reservations.unlink()
+            folios.unlink()
+            env["pms.availability"].search(
+                [("room_type_id", "in", [self.room_type_id])]
+            ).unlink()
+            for model, ids in self.records:
+                env[model].browse(ids).unlink()
+        self._pop_index()
+
+    def _create_reservation(self, env, room_id):
+        return env["pms.reservation"].create(
+            {
+                "partner_id": self.partner_id,
+                "preferred_room_id": room_id,
+                "checkin": self.checkin,
+                "checkout": self.checkout,
+                "pms_property_id": self.pms_property_id,
+                "sale_channel_origin_id": self.sale_channel_id,
+            }
+        )
+
+    def _get_rooms_not_avail(self, env):
+        return set(
+            env["pms.availability"].get_rooms_not_avail(
+                checkin=self.checkin,
+                checkout=self.checkout,
+                room_ids=[self.room1_id, self.room2_id],
+                pms_property_id=self.pms_property_id,
+            )
+        )
+
+    def test_index_built_and_patched_on_commit(self):
+        """
+        Check that the index is built with the committed reservation
+        lines and patched when other transaction commits its changes
+        ----------------
+        Commit a room1 reservation, read the not available rooms to build
+        the index, commit a room2 reservation and check that the same
+        index is patched and answers with both rooms
+        """
+        # ARRANGE
+        with self.registry.cursor() as cr:
+            self._create_reservation(
+                api.Environment(cr, SUPERUSER_ID, {}), self.room1_id
+            )
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            rooms_not_avail = self._get_rooms_not_avail(env)
+            index = env["pms.occupancy.index"]._get_property_index(
+                self.pms_property_id, [self.checkin]
+            )
+        version = index.version
+
+        # ACT
+        with self.registry.cursor() as cr:
+            self._create_reservation(
+                api.Environment(cr, SUPERUSER_ID, {}), self.room2_id
+            )
+
+        # ASSERT
+        self.assertEqual(
+            rooms_not_avail,
+            {self.room1_id},
+            "The index should only contain the room1 reservation",
+        )
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            self.assertIs(
+                env["pms.occupancy.index"]._get_property_index(
+                    self.pms_property_id, [self.checkin]
+                ),
+                index,
+                "The index should be patched instead of rebuilt",
+            )
+            self.assertEqual(
+                self._get_rooms_not_avail(env),
+                {self.room1_id, self.room2_id},
+                "The patched index should contain both reservations",
+            )
+        self.assertEqual(index.version, version + 1, "The index version is wrong")
+        self.assertEqual(
+            index.get_count(self.room2_id, self.checkin),
+            1,
+            "The room2 occupancy should be patched after the commit",
+        )
+
+    def test_index_not_used_by_older_transactions(self):
+        """
+        Check that a transaction that started before a commit doesn't use
+        the index patched with it, and that a transaction with uncommitted
+        changes doesn't use the index of the property
+        ----------------
+        Build the index in a transaction, commit a room2 reservation from
+        other transaction and check the not available rooms of both
+        """
+        # ARRANGE
+        with self.registry.cursor() as cr:
+            self._create_reservation(
+                api.Environment(cr, SUPERUSER_ID, {}), self.room1_id
+            )
+        with self.registry.cursor() as old_cr:
+            old_env = api.Environment(old_cr, SUPERUSER_ID, {})
+            self.assertEqual(
+                self._get_rooms_not_avail(old_env),
+                {self.room1_id},
+                "The index should only contain the room1 reservation",
+            )
+
+            # ACT
+            with self.registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                self._create_reservation(env, self.room2_id)
+                uncommitted_index = env["pms.occupancy.index"]._get_property_index(
+                    self.pms_property_id, [self.checkin]
+                )
+                uncommitted_rooms = self._get_rooms_not_avail(env)
+
+            # ASSERT
+            self.assertIsNone(
+                uncommitted_index,
+                "The index must not be used with uncommitted changes",
+            )
+            self.assertEqual(
+                uncommitted_rooms,
+                {self.room1_id, self.room2_id},
+                "The uncommitted reservation should be read from the database",
+            )
+            self.assertIsNone(
+                old_env["pms.occupancy.index"]._get_property_index(
+                    self.pms_property_id, [self.checkin]
+                ),
+                "The index must not be used by older transactions",
+            )
+            self.assertEqual(
+                self._get_rooms_not_avail(old_env),
+                {self.room1_id},
+                "The older transaction should not see the new reservation",
+            )
@@ -1,3 +1,5 @@
+import time
+
 from freezegun import freeze_time
 
 from odoo.tests.common import SavepointCase
@@ -10,6 +12,24 @@ class TestPmsPayment(SavepointCase):
     def setUpClass(cls):
         super().setUpClass()
 
+    def test_match_amounts_fewest_payments(self):
+        """
+        Check that the payments matcher gets the fewest amounts
+        summing the target, the first ones on a tie.
+        ------------
+        Between 40 amounts, 10050 is reached with [4, 7] and [5, 6]
+        and with three or more amounts, the expected match is [4, 7].
+        """
+        # ARRANGE
+        amounts = [100] * 40
+        amounts[4:8] = [5000, 4000, 6050, 5050]
+        # ACT
+        indexes = self.env["account.move"]._match_amounts(
+            amounts, 10050, time.monotonic() + 10, 10**6
+        )
+        # ASSERT
+        self.assertEqual(indexes, [4, 7], "The fewest first payments should match")
+
     # TODO: Test allowed manual payment
     # create a journal with allowed_pms_payments = True and
     # check that the _get_payment_methods property method return it
@@ -3,9 +3,10 @@ import datetime
 from freezegun import freeze_time
 
 from odoo import fields
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
 from odoo.tests import tagged
 
+from ..models.product_pricelist import ITEMS_CACHE_DATA_KEY
 from .common import TestPms
 
 
@@ -96,6 +97,13 @@ class TestPmsPricelist(TestPms):
             }
         )
 
+    def setUp(self):
+        super().setUp()
+        # The tests are rolled back with ROLLBACK TO SAVEPOINT, that doesn't
+        # run the cursor hooks, so the pricelist items resolved by a test
+        # are dropped here to not be served to the next ones
+        self.addCleanup(self.cr.precommit.data.pop, ITEMS_CACHE_DATA_KEY, None)
+
     @freeze_time("2000-01-01")
     def test_board_service_pricelist_item_apply_sale_dates(self):
         """
@@ -1270,3 +1278,209 @@ class TestPmsPricelist(TestPms):
 
                 # ASSERT
                 self.assertEqual(tc["expected_price"], reservation_price, tc["name"])
+
+    @freeze_time("2000-01-01")
+    def test_pricelist_items_cache_invalidated_on_item_write(self):
+        """
+        The pricelist items resolved for a night are reused while the
+        pricelist items are not modified.
+        ------------
+        A reservation is priced twice with the same pricelist item, and
+        then the item consumption dates are modified so that it only
+        applies to the second night, the items of each night must be
+        resolved again.
+        """
+        # ARRANGE
+        today = fields.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        product = self.room_type1.product_id
+        item = self.env["product.pricelist.item"].create(
+            {
+                "pricelist_id": self.pricelist2.id,
+                "compute_price": "fixed",
+                "applied_on": "0_product_variant",
+                "product_id": product.id,
+                "fixed_price": 60.0,
+                "pms_property_ids": [self.pms_property1.id],
+            }
+        )
+        reservation_vals = {
+            "partner_id": self.partner1.id,
+            "checkin": today,
+            "checkout": today + datetime.timedelta(days=2),
+            "pms_property_id": self.pms_property1.id,
+            "room_type_id": self.room_type1.id,
+            "pricelist_id": self.pricelist2.id,
+            "sale_channel_origin_id": self.sale_channel_direct1.id,
+        }
+
+        def get_items(consumption_date):
+            return self.pricelist2.with_context(
+                property=self.pms_property1.id,
+                consumption_date=consumption_date,
+            )._compute_price_rule_get_items(
+                [(product, 1, False)],
+                today,
+                product.uom_id.id,
+                product.product_tmpl_id.ids,
+                product.ids,
+                product.categ_id.ids,
+            )
+
+        self.env["pms.reservation"].create(reservation_vals)
+        stats = self.env["product.pricelist"].get_pms_items_cache_stats()
+        # ACT
+        reservation = self.env["pms.reservation"].create(reservation_vals)
+        hits = (
+            self.env["product.pricelist"].get_pms_items_cache_stats()["hits"]
+            - stats["hits"]
+        )
+        items_before = (get_items(today), get_items(tomorrow))
+        item.write({"date_start_consumption": tomorrow, "fixed_price": 70.0})
+        items_after = (get_items(today), get_items(tomorrow))
+        reservation.reservation_line_ids.with_context(
+            force_recompute=True
+        )._compute_price()
+        # ASSERT
+        self.assertTrue(hits, "The pricelist items should be reused")
+        self.assertEqual(
+            items_before,
+            (item, item),
+            "The item should apply to both nights before the change",
+        )
+        self.assertEqual(
+            items_after,
+            (self.env["product.pricelist.item"], item),
+            "The item should only apply to the second night after the change",
+        )
+        self.assertEqual(
+            reservation.reservation_line_ids.sorted("date")[1].price,
+            70.0,
+            "The pricelist items should be resolved again after an item changes",
+        )
+        self.assertNotEqual(
+            reservation.reservation_line_ids.sorted("date")[0].price,
+            60.0,
+            "The first night should not be priced with the modified item",
+        )
+
+    @freeze_time("2000-01-01")
+    def test_pricelist_items_cache_rolled_back_item(self):
+        """
+        The pricelist items resolved in a savepoint that is rolled back
+        are not reused after it.
+        ------------
+        The items of a night are resolved, then an item is created and the
+        items are resolved again in a savepoint that is rolled back, the
+        items resolved after the savepoint must be the initial ones.
+        """
+        # ARRANGE
+        today = fields.date.today()
+        product = self.room_type1.product_id
+
+        def get_items():
+            return self.pricelist2.with_context(
+                property=self.pms_property1.id,
+                consumption_date=today,
+            )._compute_price_rule_get_items(
+                [(product, 1, False)],
+                today,
+                product.uom_id.id,
+                product.product_tmpl_id.ids,
+                product.ids,
+                product.categ_id.ids,
+            )
+
+        items_before = get_items()
+        items_savepoint = self.env["product.pricelist.item"]
+        # ACT
+        with self.assertRaises(UserError):
+            with self.env.cr.savepoint():
+                item = self.env["product.pricelist.item"].create(
+                    {
+                        "pricelist_id": self.pricelist2.id,
+                        "compute_price": "fixed",
+                        "applied_on": "0_product_variant",
+                        "product_id": product.id,
+                        "fixed_price": 60.0,
+                        "pms_property_ids": [self.pms_property1.id],
+                    }
+                )
+                items_savepoint = get_items()
+                raise UserError("Rollback the savepoint")
+        items_after = get_items()
+        # ASSERT
+        self.assertIn(
+            item, items_savepoint, "The created item should apply in the savepoint"
+        )
+        self.assertEqual(
+            items_after.ids,
+            items_before.ids,
+            "The items resolved in the rolled back savepoint should not be reused",
+        )
+
+    @freeze_time("2000-01-01")
+    def test_price_stay_same_as_night_prices(self):
+        """
+        The prices of a stay computed in a single pricelist pass must be
+        the same as the prices computed night by night.
+        ------------
+        A pricelist based on other pricelist with a discount is created,
+        and the base pricelist has an item only for the second night.
+        """
+        # ARRANGE
+        checkin = fields.date.today()
+        dates = [checkin + datetime.timedelta(days=x) for x in range(3)]
+        self.env["product.pricelist.item"].create(
+            {
+                "pricelist_id": self.pricelist2.id,
+                "applied_on": "0_product_variant",
+                "product_id": self.room_type1.product_id.id,
+                "date_start_consumption": dates[1],
+                "date_end_consumption": dates[1],
+                "fixed_price": 80.0,
+                "pms_property_ids": [self.pms_property1.id],
+            }
+        )
+        pricelist3 = self.env["product.pricelist"].create(
+            {
+                "name": "pricelist_3",
+                "pms_property_ids": [self.pms_property1.id],
+                "availability_plan_id": self.availability_plan1.id,
+                "is_pms_available": True,
+                "item_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "applied_on": "3_global",
+                            "compute_price": "formula",
+                            "base": "pricelist",
+                            "base_pricelist_id": self.pricelist2.id,
+                            "price_discount": 10,
+                        },
+                    )
+                ],
+            }
+        )
+        product = self.room_type1.product_id.with_context(
+            quantity=1,
+            date=checkin,
+            pricelist=pricelist3.id,
+            property=self.pms_property1.id,
+        )
+        # ACT
+        stay_prices = pricelist3.price_stay(
+            self.pms_property1.id, product, dates, date=checkin
+        )[product.id]
+        # ASSERT
+        self.assertEqual(
+            [price for price, rule_id in stay_prices],
+            [product.with_context(consumption_date=date).price for date in dates],
+            "The prices of the stay should be the same as the night prices",
+        )
+        self.assertAlmostEqual(
+            stay_prices[1][0],
+            72.0,
+            msg="The base pricelist item of the night should be applied",
+        )
@@ -1,4 +1,5 @@
 import datetime
+from collections import Counter
 
 from freezegun import freeze_time
 
@@ -683,6 +684,46 @@ class TestPmsReservations(TestPms):
                 }
             )
 
+    @freeze_time("2012-01-14")
+    def test_assign_rooms_batch(self):
+        """
+        Check that the rooms of several reservations solved together
+        are assigned without collisions between them
+        ----------------
+        Create two reservations of three nights, remove the rooms of
+        their lines and assign them again in a single batch. Each
+        reservation must be in a different single room.
+        """
+        # ARRANGE
+        reservations = self.env["pms.reservation"]
+        for _i in range(2):
+            reservations |= self.env["pms.reservation"].create(
+                {
+                    "pms_property_id": self.pms_property1.id,
+                    "checkin": datetime.datetime.now(),
+                    "checkout": datetime.datetime.now() + datetime.timedelta(days=3),
+                    "adults": 2,
+                    "room_type_id": self.room_type_double.id,
+                    "partner_id": self.partner1.id,
+                    "sale_channel_origin_id": self.sale_channel_direct.id,
+                }
+            )
+        lines = reservations.reservation_line_ids
+        lines.with_context(avoid_availability_check=True).room_id = False
+        lines.flush()
+
+        # ACT
+        lines.assign_rooms()
+
+        # ASSERT
+        r1_rooms = reservations[0].reservation_line_ids.room_id
+        r2_rooms = reservations[1].reservation_line_ids.room_id
+        self.assertEqual(len(r1_rooms), 1, "The first reservation was splitted")
+        self.assertEqual(len(r2_rooms), 1, "The second reservation was splitted")
+        self.assertNotEqual(
+            r1_rooms, r2_rooms, "Both reservations were assigned to the same room"
+        )
+
     @freeze_time("2012-01-14")
     def test_manage_children_raise(self):
         # TEST CASE
@@ -1292,6 +1333,93 @@ class TestPmsReservations(TestPms):
             error_msm,
         )
 
+    def test_preferred_room_not_available_mixed_stay(self):
+        """
+        The preferred room can only be assigned without availability when
+        none of the nights of the stay occupy the room
+        ------
+        Create a two nights reservation in room1 whose second night is
+        reselling (doesn't occupy), with room1 occupied the first night
+        the assignment of the preferred room must fail
+        """
+        # ARRANGE
+        today = fields.date.today()
+        reservation = self.env["pms.reservation"].create(
+            {
+                "checkin": today,
+                "checkout": today + datetime.timedelta(days=2),
+                "preferred_room_id": self.room1.id,
+                "partner_id": self.partner1.id,
+                "pms_property_id": self.pms_property1.id,
+                "sale_channel_origin_id": self.sale_channel_direct.id,
+            }
+        )
+        lines = reservation.reservation_line_ids.sorted("date")
+        lines[1].is_reselling = True
+        graph = self.env["pms.availability"]._get_shared_rooms_graph(
+            self.pms_property1.id
+        )
+        occupancy = {today: Counter({self.room1.id: 1})}
+
+        # ACT & ASSERT
+        with self.assertRaises(ValidationError):
+            self.env["pms.reservation.line"]._solve_reservation_room_assignment(
+                reservation, lines, occupancy, graph
+            )
+
+    def test_confirm_arrival_priority_bucket_change(self):
+        """
+        The daily update only recomputes the priority formula of the
+        reservations that change of bucket, the rest are relative to today
+        ------
+        Create a reservation with checkin date on 21 days (4 * 21 = 84),
+        the next day the priority must be 4 * 20 = 80 with the same formula
+        and the day after it must be 3 * 19 = 57 with the new formula
+        """
+        # ARRANGE
+        freezer = freeze_time("1981-10-01")
+        freezer.start()
+        res = self.env["pms.reservation"].create(
+            {
+                "checkin": fields.date.today() + datetime.timedelta(days=21),
+                "checkout": fields.date.today() + datetime.timedelta(days=25),
+                "preferred_room_id": self.room2.id,
+                "partner_id": self.partner1.id,
+                "pms_property_id": self.pms_property1.id,
+                "sale_channel_origin_id": self.sale_channel_direct.id,
+            }
+        )
+        freezer.stop()
+
+        # ACT
+        freezer = freeze_time("1981-10-02")
+        freezer.start()
+        res.update_daily_priority_reservation()
+        same_bucket_priority = res.priority
+        same_bucket_factor = res.priority_factor
+        freezer.stop()
+        freezer = freeze_time("1981-10-03")
+        freezer.start()
+        res.update_daily_priority_reservation()
+        new_bucket_priority = res.priority
+        found_reservations = self.env["pms.reservation"].search(
+            [("id", "=", res.id), ("priority", "=", 57)]
+        )
+        folio_priority = res.folio_id.max_reservation_priority
+        found_folios = self.env["pms.folio"].search(
+            [("id", "=", res.folio_id.id), ("max_reservation_priority", "=", 57)]
+        )
+        freezer.stop()
+
+        # ASSERT
+        self.assertEqual(same_bucket_priority, 80)
+        self.assertEqual(same_bucket_factor, 4)
+        self.assertEqual(new_bucket_priority, 57)
+        self.assertEqual(res.priority_bucket_date, datetime.date(1981, 10, 20))
+        self.assertEqual(found_reservations, res)
+        self.assertEqual(folio_priority, 57)
+        self.assertEqual(found_folios, res.folio_id)
+
     @freeze_time("1981-11-10")
     def test_done_checkout_lt_15_days_before_all_paid_priority_reservation(self):
         """
@@ -0,0 +1,193 @@
+import datetime
+import logging
+import os
+import time
+
+from freezegun import freeze_time
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import TestPms
+
+_logger = logging.getLogger(__name__)
+
+# Synthetic reservations generated by the benchmark
+BENCHMARK_RESERVATIONS = int(os.environ.get("PMS_BENCHMARK_RESERVATIONS", 1000000))
+
+
+@tagged("-standard", "-at_install", "post_install", "pms_benchmark")
+class TestPmsReservationPriorityBenchmark(TestPms):
+    """Daily priority update over a synthetic dataset. It is not run with
+    the standard tests, run it with --test-tags pms_benchmark (the size of
+    the dataset is read from PMS_BENCHMARK_RESERVATIONS)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.room_type = cls.env["pms.room.type"].create(
+            {
+                "pms_property_ids": [cls.pms_property1.id],
+                "name": "Benchmark Room Type",
+                "default_code": "BRT",
+                "class_id": cls.room_type_class1.id,
+            }
+        )
+        cls.room = cls.env["pms.room"].create(
+            {
+                "pms_property_id": cls.pms_property1.id,
+                "name": "Benchmark Room",
+                "room_type_id": cls.room_type.id,
+                "capacity": 2,
+            }
+        )
+        cls.partner = cls.env["res.partner"].create({"name": "Benchmark Guest"})
+        cls.sale_channel = cls.env["pms.sale.channel"].create(
+            {"name": "Benchmark Channel", "channel_type": "direct"}
+        )
+
+    def _generate_reservations(self, template, count):
+        """Copy the template reservation row count times, with the checkin
+        spread over the next 400 days and the priority components of a
+        future reservation"""
+        self.env["pms.reservation"].flush()
+        self.env.cr.execute(
+            """
+            SELECT column_name
+            FROM   information_schema.columns
+            WHERE  table_schema = current_schema()
+               AND table_name = 'pms_reservation'
+               AND column_name NOT IN (
+                   'id', 'checkin', 'checkout', 'priority_base',
+                   'priority_factor', 'priority_date', 'priority_bucket_date'
+               )
+            """
+        )
+        columns = ", ".join(
+            '"%s"' % column_name for column_name, in self.env.cr.fetchall()
+        )
+        query = """
+            INSERT INTO pms_reservation (
+                {columns}, checkin, checkout, priority_base,
+                priority_factor, priority_date, priority_bucket_date
+            )
+            SELECT {columns}, day.checkin, day.checkin + 1, 0,
+                   CASE WHEN day.checkin - %(today)s < 3 THEN 2
+                        WHEN day.checkin - %(today)s < 20 THEN 3
+                        ELSE 4 END,
+                   day.checkin,
+                   CASE WHEN day.checkin - %(today)s < 3 THEN NULL
+                        WHEN day.checkin - %(today)s < 20 THEN day.checkin - 2
+                        ELSE day.checkin - 19 END
+            FROM   pms_reservation,
+                   LATERAL (
+                       SELECT %(today)s + (serie.n %% 400)::integer AS checkin
+                       FROM   generate_series(1, %(count)s) AS serie(n)
+                   ) AS day
+            WHERE  pms_reservation.id = %(template_id)s
+        """.format(
+            columns=columns
+        )
+        self.env.cr.execute(
+            query,
+            {
+                "today": fields.date.today(),
+                "count": count,
+                "template_id": template.id,
+            },
+        )
+        self.env["pms.reservation"].invalidate_cache()
+
+    def test_daily_priority_update(self):
+        """
+        The daily update only recomputes the reservations whose priority
+        formula changes that day
+        ------
+        Generate the synthetic reservations, with a checkin on each of the
+        next 400 days, and run the daily update the next day: only the
+        reservations with checkin in 3 days (3 -> 2 per day) and in 20 days
+        (4 -> 3 per day) change of formula
+        """
+        # ARRANGE
+        today = datetime.date(2030, 1, 1)
+        tomorrow = today + datetime.timedelta(days=1)
+        with freeze_time(today):
+            template = self.env["pms.reservation"].create(
+                {
+                    "checkin": today + datetime.timedelta(days=30),
+                    "checkout": today + datetime.timedelta(days=31),
+                    "preferred_room_id": self.room.id,
+                    "partner_id": self.partner.id,
+                    "pms_property_id": self.pms_property1.id,
+                    "sale_channel_origin_id": self.sale_channel.id,
+                }
+            )
+            template.action_assign()
+            start = time.time()
+            self._generate_reservations(template, BENCHMARK_RESERVATIONS)
+            _logger.info(
+                "Generated %s reservations in %.2fs",
+                BENCHMARK_RESERVATIONS,
+                time.time() - start,
+            )
+        Reservation = self.env["pms.reservation"]
+
+        # ACT
+        with freeze_time(tomorrow):
+            bucket_count = Reservation.search_count(
+                [("priority_bucket_date", "<=", tomorrow)]
+            )
+            start = time.time()
+            Reservation.update_daily_priority_reservation()
+            Reservation.flush()
+            update_time = time.time() - start
+            start = time.time()
+            top_reservations = Reservation.search(
+                [("priority", ">=", 0), ("folio_id", "=", template.folio_id.id)],
+                limit=80,
+            )
+            search_time = time.time() - start
+            priorities = {
+                (reservation.checkin - tomorrow).days: reservation.priority
+                for reservation in Reservation.search(
+                    [
+                        ("folio_id", "=", template.folio_id.id),
+                        (
+                            "checkin",
+                            "in",
+                            [
+                                tomorrow + datetime.timedelta(days=2),
+                                tomorrow + datetime.timedelta(days=19),
+                                tomorrow + datetime.timedelta(days=100),
+                            ],
+                        ),
+                    ],
+                    limit=1000,
+                )
+            }
+            found_folio = self.env["pms.folio"].search(
+                [
+                    ("id", "=", template.folio_id.id),
+                    ("max_reservation_priority", "=", 4 * 398),
+                ]
+            )
+        _logger.info(
+            "Daily priority update of %s of %s reservations in %.2fs, "
+            "priority search in %.2fs",
+            bucket_count,
+            BENCHMARK_RESERVATIONS,
+            update_time,
+            search_time,
+        )
+
+        # ASSERT
+        self.assertLessEqual(
+            bucket_count,
+            2 * (BENCHMARK_RESERVATIONS // 400 + 1),
+            "Only the reservations changing of formula should be recomputed",
+        )
+        self.assertTrue(top_reservations)
+        self.assertEqual(priorities[2], 2 * 2)
+        self.assertEqual(priorities[19], 3 * 19)
+        self.assertEqual(priorities[100], 4 * 100)
+        self.assertEqual(found_folio, template.folio_id)
@@ -4,6 +4,9 @@ from freezegun import freeze_time
 
 from odoo import fields
 
+from odoo.addons.queue_job.job import Job
+
+from ..wizards.wizard_massive_changes import MASSIVE_CHANGES_JOB_SIZE
 from .common import TestPms
 
 
@@ -1313,3 +1316,120 @@ class TestPmsWizardMassiveChanges(TestPms):
             ),
             "The wizard should create as many items as properties given.",
         )
+
+    def test_overwrite_rules_by_availability_plan(self):
+        """
+        The rules to overwrite are looked up by availability plan, room
+        type, date and property.
+        Create a rule with quota in a plan and apply max avail in that plan
+        and in another one. The rule must be overwritten keeping its quota
+        and a new rule must be created in the other plan.
+        """
+        # ARRANGE
+        room_type_double = self.env["pms.room.type"].create(
+            {
+                "pms_property_ids": [self.pms_property1.id],
+                "name": "Double Test",
+                "default_code": "DBL_Test",
+                "class_id": self.room_type_class1.id,
+            }
+        )
+        availability_plan2 = self.env["pms.availability.plan"].create(
+            {
+                "name": "Second availability plan for TEST",
+                "pms_property_ids": [self.pms_property1.id],
+            }
+        )
+        date = fields.date.today()
+        rule = self.env["pms.availability.plan.rule"].create(
+            {
+                "availability_plan_id": self.availability_plan1.id,
+                "room_type_id": room_type_double.id,
+                "date": date,
+                "quota": 20,
+                "pms_property_id": self.pms_property1.id,
+            }
+        )
+        # ACT
+        self.env["pms.massive.changes.wizard"].create(
+            {
+                "massive_changes_on": "availability_plan",
+                "availability_plan_ids": [
+                    (6, 0, [self.availability_plan1.id, availability_plan2.id])
+                ],
+                "start_date": date,
+                "end_date": date,
+                "room_type_ids": [(6, 0, [room_type_double.id])],
+                "apply_max_avail": True,
+                "max_avail": 2,
+                "pms_property_ids": [self.pms_property1.id],
+            }
+        ).apply_massive_changes()
+        # ASSERT
+        self.assertEqual(
+            (rule.quota, rule.max_avail),
+            (20, 2),
+            "The existing rule should be overwritten only with the applied values",
+        )
+        self.assertEqual(
+            availability_plan2.rule_ids.mapped("max_avail"),
+            [2],
+            "A rule should be created in the plan without rule for the day",
+        )
+
+    def test_massive_changes_queued_in_chunks(self):
+        """
+        Very large changes run in background are split in queue jobs of
+        MASSIVE_CHANGES_JOB_SIZE rules, and the wizard notifies that they
+        were queued instead of opening the created rules.
+        Apply closed on MASSIVE_CHANGES_JOB_SIZE + 1 days in background,
+        two jobs must be queued and the rules must be created by them.
+        """
+        # ARRANGE
+        room_type_double = self.env["pms.room.type"].create(
+            {
+                "pms_property_ids": [self.pms_property1.id],
+                "name": "Double Test",
+                "default_code": "DBL_Test",
+                "class_id": self.room_type_class1.id,
+            }
+        )
+        start_date = fields.date.today()
+        end_date = start_date + datetime.timedelta(days=MASSIVE_CHANGES_JOB_SIZE)
+        wizard = self.env["pms.massive.changes.wizard"].create(
+            {
+                "massive_changes_on": "availability_plan",
+                "availability_plan_ids": [(6, 0, [self.availability_plan1.id])],
+                "start_date": start_date,
+                "end_date": end_date,
+                "room_type_ids": [(6, 0, [room_type_double.id])],
+                "apply_closed": True,
+                "closed": True,
+                "pms_property_ids": [self.pms_property1.id],
+                "run_in_background": True,
+            }
+        )
+        jobs_before = self.env["queue.job"].search([])
+        # ACT
+        action = wizard.save_and_close()
+        jobs = self.env["queue.job"].search([]) - jobs_before
+        for job in jobs:
+            Job.load(self.env, job.uuid).perform()
+        # ASSERT
+        self.assertEqual(
+            action["tag"],
+            "display_notification",
+            "The wizard should notify that the changes were queued",
+        )
+        self.assertEqual(len(jobs), 2, "The rules should be created in two jobs")
+        self.assertEqual(
+            self.env["pms.availability.plan.rule"].search_count(
+                [
+                    ("availability_plan_id", "=", self.availability_plan1.id),
+                    ("room_type_id", "=", room_type_double.id),
+                    ("closed", "=", True),
+                ]
+            ),
+            MASSIVE_CHANGES_JOB_SIZE + 1,
+            "The queued jobs should create a rule per day",
+        )
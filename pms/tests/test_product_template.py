@@ -324,4 +324,59 @@ class TestProductTemplate(TestPms):
         reservation._check_adults()
         reservation.flush()
 
+    def test_property_field_values(self):
+        """
+        Check that the per property values of a field are set and read
+        for many records at once, and that changing one of them is seen
+        by the next reads.
+        """
+        # ARRANGE
+        pms_property2 = self.env["pms.property"].create(
+            {
+                "name": "Property 2",
+                "company_id": self.company1.id,
+                "default_pricelist_id": self.pricelist1.id,
+            }
+        )
+        products = self.env["product.template"].create(
+            [{"name": "Product %s" % i} for i in range(3)]
+        )
+        IrPmsProperty = self.env["ir.pms.property"]
+        # ACT
+        IrPmsProperty.set_field_values(
+            self.pms_property1.id,
+            "product.template",
+            "list_price",
+            {product.id: 10.0 + i for i, product in enumerate(products)},
+        )
+        IrPmsProperty.set_field_values(
+            pms_property2.id,
+            "product.template",
+            "list_price",
+            {product.id: 20.0 for product in products},
+        )
+        IrPmsProperty.set_field_value(
+            self.pms_property1.id,
+            "product.template",
+            "list_price",
+            products[0].id,
+            15.0,
+        )
+        # ASSERT
+        self.assertEqual(
+            list(
+                IrPmsProperty.get_field_values(
+                    self.pms_property1.id, products, "list_price"
+                ).values()
+            ),
+            [15.0, 11.0, 12.0],
+            "The prices of the first property should be the last ones set",
+        )
+        products.invalidate_cache()
+        self.assertEqual(
+            products.with_context(property=pms_property2.id).mapped("list_price"),
+            [20.0, 20.0, 20.0],
+            "The prices should be read from the property in the context",
+        )
+
     # TODO: pending tests (need review) -> per_day, per_person (with board service?)
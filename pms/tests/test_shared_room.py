@@ -507,3 +507,190 @@ class TestPmsSharedRoom(TestPms):
             2,
             "The child room avail dont update when " "cancel parent room reservation",
         )
+
+    def test_batch_real_avail_with_shared_rooms(self):
+        """
+        Check that the batch availability engine compute the real avail
+        of several days and room types at once, taking into account
+        the shared rooms
+        ----------------
+        Create a room1's bed reservation for two nights and check the
+        real avail of the room type and bed type records of both days
+        and of the day after checkout
+        """
+
+        # ARRANGE
+        today = fields.date.today()
+        checkout = today + datetime.timedelta(days=2)
+        self.env["pms.reservation"].create(
+            {
+                "partner_id": self.partner1.id,
+                "preferred_room_id": self.r1bed1.id,
+                "checkin": today,
+                "checkout": checkout,
+                "pms_property_id": self.pms_property1.id,
+                "sale_channel_origin_id": self.sale_channel_direct1.id,
+            }
+        )
+        Avail = self.env["pms.availability"]
+        avails = Avail
+        for room_type in self.room_type_test | self.room_type_bed:
+            for days in range(3):
+                vals = {
+                    "room_type_id": room_type.id,
+                    "pms_property_id": self.pms_property1.id,
+                    "date": today + datetime.timedelta(days=days),
+                }
+                avail = Avail.search([(k, "=", v) for k, v in vals.items()])
+                avails |= avail or Avail.create(vals)
+
+        # ACT
+        real_avails = avails._get_real_avail_batch()
+
+        # ASSERT
+        expected = {
+            (self.room_type_test.id, today): 0,
+            (self.room_type_test.id, today + datetime.timedelta(days=1)): 0,
+            (self.room_type_test.id, checkout): 1,
+            (self.room_type_bed.id, today): 1,
+            (self.room_type_bed.id, today + datetime.timedelta(days=1)): 1,
+            (self.room_type_bed.id, checkout): 2,
+        }
+        for avail in avails:
+            self.assertEqual(
+                real_avails[avail.id],
+                expected[(avail.room_type_id.id, avail.date)],
+                "The batch real avail is wrong for %s on %s"
+                % (avail.room_type_id.name, avail.date),
+            )
+
+    def test_rooms_not_avail_with_uncommitted_occupancy(self):
+        """
+        Check that the occupancy index is not used for a property whose
+        reservation lines were modified in the current transaction, and
+        that the not available rooms are read from the database
+        ----------------
+        Create a room1's bed reservation, check that the property index
+        is not available and that room1 and the bed are not available
+        """
+
+        # ARRANGE
+        today = fields.date.today()
+        tomorrow = fields.date.today() + datetime.timedelta(days=1)
+
+        # ACT
+        self.env["pms.reservation"].create(
+            {
+                "partner_id": self.partner1.id,
+                "preferred_room_id": self.r1bed1.id,
+                "checkin": today,
+                "checkout": tomorrow,
+                "pms_property_id": self.pms_property1.id,
+                "sale_channel_origin_id": self.sale_channel_direct1.id,
+            }
+        )
+        rooms_not_avail = self.env["pms.availability"].get_rooms_not_avail(
+            checkin=today,
+            checkout=tomorrow,
+            room_ids=(self.room1 | self.r1bed1 | self.r1bed2).ids,
+            pms_property_id=self.pms_property1.id,
+        )
+
+        # ASSERT
+        self.assertIsNone(
+            self.env["pms.occupancy.index"]._get_property_index(
+                self.pms_property1.id, [today]
+            ),
+            "The occupancy index must not be used with uncommitted changes",
+        )
+        self.assertEqual(
+            set(rooms_not_avail),
+            {self.room1.id, self.r1bed1.id},
+            "The shared room and the occupied bed should not be available",
+        )
+
+    def test_incremental_real_avail_with_shared_rooms(self):
+        """
+        Check that in incremental mode the real avail of the room type
+        and bed type is updated when a bed is occupied, and that the
+        reconciliation job doesn't find drift.
+        ----------------
+        Enable the incremental mode, create a room1's bed reservation and
+        check the real avail of both types and the reconciliation result
+        """
+        # ARRANGE
+        self.env["ir.config_parameter"].sudo().set_param(
+            "pms.real_avail_incremental", "True"
+        )
+        today = fields.date.today()
+        # ACT
+        self.env["pms.reservation"].create(
+            {
+                "partner_id": self.partner1.id,
+                "preferred_room_id": self.r1bed1.id,
+                "checkin": today,
+                "checkout": today + datetime.timedelta(days=1),
+                "pms_property_id": self.pms_property1.id,
+                "sale_channel_origin_id": self.sale_channel_direct1.id,
+            }
+        )
+        avails = self.env["pms.availability"].search(
+            [
+                ("pms_property_id", "=", self.pms_property1.id),
+                ("date", "=", today),
+            ]
+        )
+        drift = self.env["pms.availability"].reconcile_real_avail(
+            today, today, fix=False
+        )
+        # ASSERT
+        self.assertEqual(
+            {avail.room_type_id: avail.real_avail for avail in avails},
+            {self.room_type_test: 0, self.room_type_bed: 1},
+            "The real avail of the shared room and its beds should be updated",
+        )
+        self.assertFalse(drift, "The real avail counters shouldn't drift")
+
+    def test_reconcile_real_avail_fix_drift(self):
+        """
+        Check that the reconciliation job reports and fixes the real
+        avail counters that don't match the reservation lines.
+        ----------------
+        Create a room1's bed reservation, corrupt the stored real avail
+        of the bed type and run the reconciliation job
+        """
+        # ARRANGE
+        today = fields.date.today()
+        self.env["pms.reservation"].create(
+            {
+                "partner_id": self.partner1.id,
+                "preferred_room_id": self.r1bed1.id,
+                "checkin": today,
+                "checkout": today + datetime.timedelta(days=1),
+                "pms_property_id": self.pms_property1.id,
+                "sale_channel_origin_id": self.sale_channel_direct1.id,
+            }
+        )
+        avail = self.env["pms.availability"].search(
+            [
+                ("pms_property_id", "=", self.pms_property1.id),
+                ("room_type_id", "=", self.room_type_bed.id),
+                ("date", "=", today),
+            ]
+        )
+        avail.flush()
+        self.env.cr.execute(
+            "UPDATE pms_availability SET real_avail = 5 WHERE id = %s", (avail.id,)
+        )
+        avail.invalidate_cache()
+        # ACT
+        drift = self.env["pms.availability"].reconcile_real_avail(today, today)
+        # ASSERT
+        self.assertEqual(
+            drift,
+            [{"avail_id": avail.id, "stored": 5, "real": 1}],
+            "The reconciliation job should report the drifted counter",
+        )
+        self.assertEqual(
+            avail.real_avail, 1, "The drifted counter should be recomputed"
+        )
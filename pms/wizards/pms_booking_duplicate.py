@@ -552,11 +552,35 @@ class PmsReservationDuplicate(models.TransientModel):
                 - {record.preferred_room_id.id}
             )
 
-    @api.depends("room_type_id", "board_service_room_id", "checkin", "checkout")
+    @api.depends(
+        "room_type_id",
+        "board_service_room_id",
+        "checkin",
+        "checkout",
+        "pricelist_id",
+        "booking_duplicate_id.recompute_prices",
+    )
     def _compute_price_total(self):
         self.price_total = 0
         for record in self.filtered("checkout"):
-            record.price_total = record.reference_reservation_id.price_room_services_set
+            reservation = record.reference_reservation_id
+            if (
+                record.booking_duplicate_id.recompute_prices
+                and record.room_type_id
+                and record.pricelist_id
+            ):
+                record.price_total = (
+                    self.env["pms.booking.engine"]._get_price_stay_by_room_type(
+                        room_type_ids=[record.room_type_id.id],
+                        checkin=record.checkin,
+                        checkout=record.checkout,
+                        pricelist_id=record.pricelist_id.id,
+                        pms_property_id=record.pms_property_id.id,
+                    )[record.room_type_id.id]
+                    + reservation.price_services
+                )
+            else:
+                record.price_total = reservation.price_room_services_set
 
     @api.depends("reference_reservation_id")
     def _compute_service_ids(self):
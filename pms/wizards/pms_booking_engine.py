@@ -1,4 +1,5 @@
 import datetime
+from collections import defaultdict
 
 from odoo import _, api, fields, models
 
@@ -191,21 +192,27 @@ class BookingEngine(models.TransientModel):
 
                 cmds = [(5, 0, 0)]
 
-                for room_type_iterator in self.env["pms.room.type"].search(
+                room_types = self.env["pms.room.type"].search(
                     [
                         "|",
                         ("pms_property_ids", "=", False),
                         ("pms_property_ids", "in", record.pms_property_id.id),
                     ]
-                ):
-                    pms_property = record.pms_property_id
-                    pms_property = pms_property.with_context(
-                        checkin=record.start_date,
-                        checkout=record.end_date,
-                        room_type_id=room_type_iterator.id,
-                        pricelist_id=record.pricelist_id.id,
+                )
+                availability_matrix = {}
+                if record.pms_property_id:
+                    availability_matrix = (
+                        record.pms_property_id.get_availability_matrix(
+                            checkin=record.start_date,
+                            checkout=record.end_date,
+                            pricelist_id=record.pricelist_id.id,
+                            room_type_ids=room_types.ids,
+                        )
                     )
-                    num_rooms_available = pms_property.availability
+                for room_type_iterator in room_types:
+                    num_rooms_available = availability_matrix.get(
+                        room_type_iterator.id, {}
+                    ).get("availability", 0)
 
                     cmds.append(
                         (
@@ -220,16 +227,16 @@ class BookingEngine(models.TransientModel):
                             },
                         )
                     )
-                    # remove old items
-                    old_lines = record.availability_results.mapped("id")
-                    for old_line in old_lines:
-                        cmds.append((2, old_line))
+                # remove old items
+                old_lines = record.availability_results.mapped("id")
+                for old_line in old_lines:
+                    cmds.append((2, old_line))
 
-                    record.availability_results = cmds
+                record.availability_results = cmds
 
-                    record.availability_results = record.availability_results.sorted(
-                        key=lambda s: s.num_rooms_available, reverse=True
-                    )
+                record.availability_results = record.availability_results.sorted(
+                    key=lambda s: s.num_rooms_available, reverse=True
+                )
 
     def create_folio(self):
         for record in self:
@@ -376,15 +383,31 @@ class AvailabilityWizard(models.TransientModel):
 
     @api.depends("room_type_id", "checkin", "checkout")
     def _compute_num_rooms_available(self):
+        # The lines of the same stay share one availability matrix
+        stays = {}
         for record in self:
-            pms_property = record.booking_engine_id.pms_property_id
-            pms_property = pms_property.with_context(
-                checkin=record.checkin,
-                checkout=record.checkout,
-                room_type_id=record.room_type_id.id,
-                pricelist_id=record.booking_engine_id.pricelist_id.id,
+            stay_key = (
+                record.booking_engine_id.pms_property_id,
+                record.checkin,
+                record.checkout,
+                record.booking_engine_id.pricelist_id.id,
+            )
+            stays.setdefault(stay_key, self.browse())
+            stays[stay_key] |= record
+        for (pms_property, checkin, checkout, pricelist_id), records in stays.items():
+            if not pms_property or not checkin or not checkout:
+                records.num_rooms_available = 0
+                continue
+            availability_matrix = pms_property.get_availability_matrix(
+                checkin=checkin,
+                checkout=checkout,
+                pricelist_id=pricelist_id,
+                room_type_ids=records.room_type_id.ids,
             )
-            record.num_rooms_available = pms_property.availability
+            for record in records:
+                record.num_rooms_available = availability_matrix.get(
+                    record.room_type_id.id, {}
+                ).get("availability", 0)
 
     @api.depends("num_rooms_available")
     def _compute_num_rooms_selected(self):
@@ -419,15 +442,39 @@ class AvailabilityWizard(models.TransientModel):
 
     @api.depends("room_type_id", "board_service_room_id", "checkin", "checkout")
     def _compute_price_per_room(self):
+        records_by_stay = defaultdict(self.browse)
         for record in self:
-            record.price_per_room = self._get_price_by_room_type(
-                room_type_id=record.room_type_id.id,
-                board_service_room_id=record.board_service_room_id.id,
-                checkin=record.checkin,
-                checkout=record.checkout,
-                pricelist_id=record.booking_engine_id.pricelist_id.id,
-                pms_property_id=record.booking_engine_id.pms_property_id.id,
+            records_by_stay[
+                (
+                    record.booking_engine_id.pricelist_id,
+                    record.booking_engine_id.pms_property_id,
+                    record.checkin,
+                    record.checkout,
+                )
+            ] |= record
+        for (
+            pricelist,
+            pms_property,
+            checkin,
+            checkout,
+        ), records in records_by_stay.items():
+            room_prices = self._get_price_stay_by_room_type(
+                room_type_ids=records.mapped("room_type_id").ids,
+                checkin=checkin,
+                checkout=checkout,
+                pricelist_id=pricelist.id,
+                pms_property_id=pms_property.id,
             )
+            for record in records:
+                record.price_per_room = room_prices.get(
+                    record.room_type_id.id, 0
+                ) + self._get_board_service_price(
+                    room_type_id=record.room_type_id.id,
+                    checkin=checkin,
+                    checkout=checkout,
+                    board_service_room_id=record.board_service_room_id.id,
+                    pms_property_id=pms_property.id,
+                )
 
     @api.depends("price_per_room", "value_num_rooms_selected")
     def _compute_price_total(self):
@@ -445,31 +492,74 @@ class AvailabilityWizard(models.TransientModel):
         pms_property_id,
         adults=False,
     ):
-        room_type_total_price_per_room = 0
-        room_type = self.env["pms.room.type"].browse(room_type_id)
+        room_type_total_price_per_room = self._get_price_stay_by_room_type(
+            room_type_ids=[room_type_id],
+            checkin=checkin,
+            checkout=checkout,
+            pricelist_id=pricelist_id,
+            pms_property_id=pms_property_id,
+        ).get(room_type_id, 0)
+        room_type_total_price_per_room += self._get_board_service_price(
+            room_type_id=room_type_id,
+            checkin=checkin,
+            checkout=checkout,
+            board_service_room_id=board_service_room_id,
+            pms_property_id=pms_property_id,
+            adults=adults,
+        )
+        return room_type_total_price_per_room
+
+    @api.model
+    def _get_price_stay_by_room_type(
+        self, room_type_ids, checkin, checkout, pricelist_id, pms_property_id
+    ):
+        """Total price of the nights of the stay for each room type,
+        with a single pricelist pass for all the room types"""
+        if not room_type_ids or not pricelist_id or not checkin or not checkout:
+            return {}
+        room_types = self.env["pms.room.type"].browse(room_type_ids)
         pms_property = self.env["pms.property"].browse(pms_property_id)
-        for date_iterator in [
+        products = room_types.mapped("product_id")
+        products = products.with_company(pms_property.company_id).with_context(
+            quantity=1,
+            date=fields.Date.today(),
+            pricelist=pricelist_id,
+            property=pms_property_id,
+        )
+        dates = [
             checkin + datetime.timedelta(days=x)
             for x in range(0, (checkout - checkin).days)
-        ]:
-            product = room_type.product_id
-            product = product.with_company(pms_property.company_id).with_context(
-                quantity=1,
-                date=fields.Date.today(),
-                consumption_date=date_iterator,
-                pricelist=pricelist_id,
-                uom=product.uom_id.id,
-                property=pms_property_id,
+        ]
+        prices = (
+            self.env["product.pricelist"]
+            .browse(pricelist_id)
+            .with_company(pms_property.company_id)
+            .with_context(products._context)
+            .price_stay(pms_property_id, products, dates, date=fields.Date.today())
+        )
+        return {
+            room_type.id: sum(
+                price for price, rule_id in prices[room_type.product_id.id]
             )
-            room_type_total_price_per_room += product.price
+            for room_type in room_types
+        }
 
-        if board_service_room_id:
-            board_service_room = self.env["pms.board.service.room.type"].browse(
-                board_service_room_id
-            )
-            nights = (checkout - checkin).days
-            adults = adults or room_type.get_room_type_capacity(pms_property_id)
-            room_type_total_price_per_room += (
-                board_service_room.amount * nights * adults
-            )
-        return room_type_total_price_per_room
+    @api.model
+    def _get_board_service_price(
+        self,
+        room_type_id,
+        checkin,
+        checkout,
+        board_service_room_id,
+        pms_property_id,
+        adults=False,
+    ):
+        if not board_service_room_id:
+            return 0
+        room_type = self.env["pms.room.type"].browse(room_type_id)
+        board_service_room = self.env["pms.board.service.room.type"].browse(
+            board_service_room_id
+        )
+        nights = (checkout - checkin).days
+        adults = adults or room_type.get_room_type_capacity(pms_property_id)
+        return board_service_room.amount * nights * adults
@@ -294,6 +294,11 @@ class WizardFolioChanges(models.TransientModel):
         self.new_checkout = max(self.reservation_ids.mapped("checkout"), default=False)
 
     def button_change(self):
+        # The folios are computed once after all the changes
+        with self.env["pms.folio"]._defer_recompute():
+            self._apply_changes()
+
+    def _apply_changes(self):
         week_days_to_apply = (
             self.apply_on_monday,
             self.apply_on_tuesday,
@@ -1,6 +1,14 @@
 import datetime
+import logging
 
 from odoo import _, api, fields, models
+from odoo.exceptions import ValidationError
+
+_logger = logging.getLogger(__name__)
+
+# Very large changes run in background are split in queue jobs of this size
+MASSIVE_CHANGES_JOB_SIZE = 5000
+MASSIVE_CHANGES_MODELS = ("product.pricelist.item", "pms.availability.plan.rule")
 
 
 class AvailabilityWizard(models.TransientModel):
@@ -260,6 +268,11 @@ class AvailabilityWizard(models.TransientModel):
         readonly=True,
         store=False,
     )
+    run_in_background = fields.Boolean(
+        string="Run in background",
+        help="Very large changes are split in queue jobs",
+        default=False,
+    )
     avail_readonly = fields.Boolean(
         string="Avialability Readonly",
         default=lambda self: self._default_avail_readonly(),
@@ -678,7 +691,29 @@ class AvailabilityWizard(models.TransientModel):
         date,
         date_types,
     ):
-        new_items = []
+        vals_list = self._prepare_pricelists_items_room_types(
+            room_types,
+            pricelist_ids,
+            price,
+            min_quantity,
+            pms_property,
+            date,
+            date_types,
+        )
+        return self.env["product.pricelist.item"].create(vals_list).ids
+
+    @api.model
+    def _prepare_pricelists_items_room_types(
+        self,
+        room_types,
+        pricelist_ids,
+        price,
+        min_quantity,
+        pms_property,
+        date,
+        date_types,
+    ):
+        vals_list = []
         for room_type in room_types:
             for pricelist in pricelist_ids:
                 vals = {
@@ -690,11 +725,8 @@ class AvailabilityWizard(models.TransientModel):
                     "min_quantity": min_quantity,
                     "pms_property_ids": [pms_property.id],
                 }
-                vals = self.generate_dates_vals(date_types, vals, date)
-
-                pricelist_item = self.env["product.pricelist.item"].create(vals)
-                new_items.append(pricelist_item.id)
-        return new_items
+                vals_list.append(self.generate_dates_vals(date_types, vals, date))
+        return vals_list
 
     @api.model
     def create_pricelists_items_board_services(
@@ -708,44 +740,81 @@ class AvailabilityWizard(models.TransientModel):
         date_types,
         date,
     ):
-        new_items = []
+        vals_list = self._prepare_pricelists_items_board_services(
+            board_service_room_type_ids,
+            pricelist_ids,
+            board_service,
+            price,
+            min_quantity,
+            pms_property,
+            date_types,
+            date,
+        )
+        return self.env["product.pricelist.item"].create(vals_list).ids
+
+    @api.model
+    def _prepare_pricelists_items_board_services(
+        self,
+        board_service_room_type_ids,
+        pricelist_ids,
+        board_service,
+        price,
+        min_quantity,
+        pms_property,
+        date_types,
+        date,
+    ):
+        vals_list = []
         for bs_room_type in board_service_room_type_ids:
             for pricelist in pricelist_ids:
                 if board_service:
+                    products = board_service
+                else:
+                    products = (
+                        bs_room_type.pms_board_service_id.board_service_line_ids.mapped(
+                            "product_id"
+                        )
+                    )
+                for product in products:
                     vals = {
                         "pricelist_id": pricelist.id,
                         "compute_price": "fixed",
                         "applied_on": "0_product_variant",
-                        "product_id": board_service.id,
+                        "product_id": product.id,
                         "board_service_room_type_id": bs_room_type.id,
                         "fixed_price": price,
                         "min_quantity": min_quantity,
                         "pms_property_ids": [pms_property.id],
                     }
-                    vals = self.generate_dates_vals(date_types, vals, date)
-
-                    pricelist_item = self.env["product.pricelist.item"].create(vals)
-                    new_items.append(pricelist_item.id)
+                    vals_list.append(self.generate_dates_vals(date_types, vals, date))
+        return vals_list
 
-                else:
-                    for (
-                        board_service_line
-                    ) in bs_room_type.pms_board_service_id.board_service_line_ids:
-                        vals = {
-                            "pricelist_id": pricelist.id,
-                            "compute_price": "fixed",
-                            "applied_on": "0_product_variant",
-                            "product_id": board_service_line.product_id.id,
-                            "board_service_room_type_id": bs_room_type.id,
-                            "fixed_price": price,
-                            "min_quantity": min_quantity,
-                            "pms_property_ids": [pms_property.id],
-                        }
-                        vals = self.generate_dates_vals(date_types, vals, date)
-
-                        pricelist_item = self.env["product.pricelist.item"].create(vals)
-                        new_items.append(pricelist_item.id)
-        return new_items
+    @api.model
+    def _prepare_pricelists_items_service(
+        self,
+        pricelist_ids,
+        service,
+        price,
+        min_quantity,
+        pms_property,
+        date_types,
+        date,
+    ):
+        vals_list = []
+        if not service:
+            return vals_list
+        for pricelist in pricelist_ids:
+            vals = {
+                "pricelist_id": pricelist.id,
+                "compute_price": "fixed",
+                "applied_on": "0_product_variant",
+                "product_id": service.id,
+                "fixed_price": price,
+                "min_quantity": min_quantity,
+                "pms_property_ids": [pms_property.id],
+            }
+            vals_list.append(self.generate_dates_vals(date_types, vals, date))
+        return vals_list
 
     @api.model
     def create_availability_plans_rules(
@@ -774,67 +843,157 @@ class AvailabilityWizard(models.TransientModel):
         rules_to_overwrite,
         pms_property,
     ):
-        new_items = []
-        for room_type in room_types:
-            for avail_plan_id in availability_plan_ids:
-                vals = {}
-                vals.update({"min_stay": min_stay} if apply_min_stay else {})
-                vals.update(
-                    {"min_stay_arrival": min_stay_arrival}
-                    if apply_min_stay_arrival
-                    else {}
-                )
-                vals.update({"max_stay": max_stay} if apply_max_stay else {})
+        vals, write_vals = self._get_availability_plans_rules_vals(
+            {
+                "min_stay": min_stay,
+                "min_stay_arrival": min_stay_arrival,
+                "max_stay": max_stay,
+                "max_stay_arrival": max_stay_arrival,
+                "quota": quota,
+                "max_avail": max_avail,
+                "closed": closed,
+                "closed_arrival": closed_arrival,
+                "closed_departure": closed_departure,
+            },
+            {
+                "min_stay": apply_min_stay,
+                "min_stay_arrival": apply_min_stay_arrival,
+                "max_stay": apply_max_stay,
+                "max_stay_arrival": apply_max_stay_arrival,
+                "quota": apply_quota,
+                "max_avail": apply_max_avail,
+                "closed": apply_closed,
+                "closed_arrival": apply_closed_arrival,
+                "closed_departure": apply_closed_departure,
+            },
+        )
+        vals_list, rules_to_write = self._prepare_availability_plans_rules(
+            room_types,
+            availability_plan_ids,
+            vals,
+            date,
+            pms_property,
+            self._get_rules_overwrite_index(rules_to_overwrite),
+        )
+        rules_to_write.write(write_vals)
+        new_rules = self.env["pms.availability.plan.rule"].create(vals_list)
+        return rules_to_write.ids + new_rules.ids
 
-                vals.update(
-                    {"max_stay_arrival": max_stay_arrival}
-                    if apply_max_stay_arrival
-                    else {}
-                )
-                vals.update({"quota": quota} if apply_quota else {})
-                vals.update({"max_avail": max_avail} if apply_max_avail else {})
+    @api.model
+    def _get_rules_overwrite_index(self, rules):
+        return {
+            (
+                rule.availability_plan_id.id,
+                rule.room_type_id.id,
+                rule.date,
+                rule.pms_property_id.id,
+            ): rule.id
+            for rule in rules
+        }
 
-                vals.update({"closed": closed} if apply_closed else {})
-                vals.update(
-                    {"closed_arrival": closed_arrival} if apply_closed_arrival else {}
-                )
-                vals.update(
-                    {"closed_departure": closed_departure}
-                    if apply_closed_departure
-                    else {}
+    @api.model
+    def _prepare_availability_plans_rules(
+        self,
+        room_types,
+        availability_plan_ids,
+        vals,
+        date,
+        pms_property,
+        overwrite_index,
+    ):
+        """
+        :param overwrite_index: dict {(availability plan id, room type id,
+            date, property id): rule id} of the rules to overwrite
+        :return: tuple (list of vals of the rules to create,
+            rules to overwrite)
+        """
+        vals_list = []
+        rule_ids_to_write = []
+        for room_type in room_types:
+            for avail_plan_id in availability_plan_ids:
+                rule_id = overwrite_index.get(
+                    (avail_plan_id.id, room_type.id, date, pms_property.id)
                 )
-
-                if date in rules_to_overwrite.mapped(
-                    "date"
-                ) and room_type in rules_to_overwrite.mapped("room_type_id"):
-                    overwrite = rules_to_overwrite.filtered(
-                        lambda x: x.room_type_id == room_type
-                        and x.date == date
-                        and x.pms_property_id.id == pms_property.id
-                    )
-                    overwrite.write(vals)
-                    new_items += overwrite.ids
+                if rule_id:
+                    rule_ids_to_write.append(rule_id)
                 else:
-                    plan_rule = self.env["pms.availability.plan.rule"].create(
-                        {
-                            "availability_plan_id": avail_plan_id.id,
-                            "date": date,
-                            "room_type_id": room_type.id,
-                            "quota": quota,
-                            "max_avail": max_avail,
-                            "min_stay": min_stay,
-                            "min_stay_arrival": min_stay_arrival,
-                            "max_stay": max_stay,
-                            "max_stay_arrival": max_stay_arrival,
-                            "closed": closed,
-                            "closed_arrival": closed_arrival,
-                            "closed_departure": closed_departure,
-                            "pms_property_id": pms_property.id,
-                        }
+                    vals_list.append(
+                        dict(
+                            vals,
+                            availability_plan_id=avail_plan_id.id,
+                            date=date,
+                            room_type_id=room_type.id,
+                            pms_property_id=pms_property.id,
+                        )
                     )
-                    new_items.append(plan_rule.id)
+        return (
+            vals_list,
+            self.env["pms.availability.plan.rule"].browse(rule_ids_to_write),
+        )
 
-        return new_items
+    def _get_availability_plans_rules_vals(self, vals=None, fields_to_apply=None):
+        """
+        :param vals: dict {field: value} of the rules, the values of the
+            wizard by default
+        :param fields_to_apply: dict {field: bool} of the values to apply
+            on the overwritten rules, the apply fields of the wizard by default
+        :return: tuple (vals of the new rules, vals of the overwritten rules)
+        """
+        if vals is None:
+            self.ensure_one()
+            fields_to_apply = {
+                "min_stay": self.apply_min_stay,
+                "min_stay_arrival": self.apply_min_stay_arrival,
+                "max_stay": self.apply_max_stay,
+                "max_stay_arrival": self.apply_max_stay_arrival,
+                "quota": self.apply_quota,
+                "max_avail": self.apply_max_avail,
+                "closed": self.apply_closed,
+                "closed_arrival": self.apply_closed_arrival,
+                "closed_departure": self.apply_closed_departure,
+            }
+            vals = {field: self[field] for field in fields_to_apply}
+        write_vals = {
+            field: value for field, value in vals.items() if fields_to_apply[field]
+        }
+        return vals, write_vals
+
+    def _create_massive_changes(self, model_name, vals_list):
+        """
+        Create the records with a single create, or split in queue jobs
+        of MASSIVE_CHANGES_JOB_SIZE records if the change is very large
+        and the wizard is run in background.
+        :return: tuple (ids of the records created, number of queued jobs)
+        """
+        self.ensure_one()
+        if not self.run_in_background or len(vals_list) <= MASSIVE_CHANGES_JOB_SIZE:
+            return self.env[model_name].create(vals_list).ids, 0
+        chunks = [
+            vals_list[index : index + MASSIVE_CHANGES_JOB_SIZE]
+            for index in range(0, len(vals_list), MASSIVE_CHANGES_JOB_SIZE)
+        ]
+        for number, chunk in enumerate(chunks, 1):
+            self.browse().with_delay(
+                description=_("Massive changes on %s: part %s of %s")
+                % (self.env[model_name]._description, number, len(chunks))
+            ).create_massive_changes_chunk(model_name, chunk, number, len(chunks))
+        return [], len(chunks)
+
+    @api.model
+    def create_massive_changes_chunk(self, model_name, vals_list, number, total):
+        if model_name not in MASSIVE_CHANGES_MODELS:
+            raise ValidationError(
+                _("Massive changes can not create records of %s") % model_name
+            )
+        records = self.env[model_name].create(vals_list)
+        _logger.info(
+            "Massive changes on %s: part %s of %s, %s records created",
+            model_name,
+            number,
+            total,
+            len(records),
+        )
+        return _("%s records created (part %s of %s)") % (len(records), number, total)
 
     def continue_massive_changes(self):
         self.apply_massive_changes()
@@ -858,7 +1017,19 @@ class AvailabilityWizard(models.TransientModel):
         }
 
     def save_and_close(self):
-        items = self.apply_massive_changes()
+        items, queued_jobs = self._apply_massive_changes()
+        if queued_jobs:
+            return {
+                "type": "ir.actions.client",
+                "tag": "display_notification",
+                "params": {
+                    "title": _("Massive changes queued"),
+                    "message": _("The changes are applied in background in %s jobs")
+                    % queued_jobs,
+                    "sticky": False,
+                    "next": {"type": "ir.actions.act_window_close"},
+                },
+            }
         if self.massive_changes_on == "pricelist" and not self.pricelist_readonly:
             action = {
                 "view": self.env.ref("pms.product_pricelist_item_action2").read()[0]
@@ -876,6 +1047,13 @@ class AvailabilityWizard(models.TransientModel):
             return action["view"]
 
     def apply_massive_changes(self):
+        return self._apply_massive_changes()[0]
+
+    def _apply_massive_changes(self):
+        """
+        :return: tuple (ids of the records created or overwritten, number
+            of jobs queued to create the rest)
+        """
         self.ensure_one()
         self.pricelist_items_to_overwrite.unlink()
         week_days_to_apply = (
@@ -887,9 +1065,24 @@ class AvailabilityWizard(models.TransientModel):
             self.apply_on_saturday,
             self.apply_on_sunday,
         )
+        if not self.room_type_ids:
+            room_types = self.env["pms.room.type"].search(
+                [
+                    "|",
+                    ("pms_property_ids", "=", False),
+                    ("pms_property_ids", "in", self.pms_property_ids.ids),
+                ]
+            )
+        else:
+            room_types = self.room_type_ids
+        rule_vals, rule_write_vals = self._get_availability_plans_rules_vals()
+        overwrite_index = {}
+        if self.massive_changes_on == "availability_plan":
+            overwrite_index = self._get_rules_overwrite_index(self.rules_to_overwrite)
+        rules_to_write = self.env["pms.availability.plan.rule"]
 
         # dates between start and end (both included)
-        items = []
+        vals_list = []
         for date in [
             self.start_date + datetime.timedelta(days=x)
             for x in range(0, (self.end_date - self.start_date).days + 1)
@@ -901,23 +1094,12 @@ class AvailabilityWizard(models.TransientModel):
             ):
                 continue
 
-            if not self.room_type_ids:
-                room_types = self.env["pms.room.type"].search(
-                    [
-                        "|",
-                        ("pms_property_ids", "=", False),
-                        ("pms_property_ids", "in", self.pms_property_ids.ids),
-                    ]
-                )
-            else:
-                room_types = self.room_type_ids
-
             for pms_property in self.pms_property_ids:
                 if (
                     self.massive_changes_on == "pricelist"
                     and self.apply_pricelists_on == "room_types"
                 ):
-                    new_items = self.create_pricelists_items_room_types(
+                    vals_list += self._prepare_pricelists_items_room_types(
                         room_types,
                         self.pricelist_ids,
                         self.price,
@@ -926,13 +1108,11 @@ class AvailabilityWizard(models.TransientModel):
                         date,
                         self.date_types,
                     )
-                    items = items + new_items if new_items else items
-
                 elif (
                     self.massive_changes_on == "pricelist"
                     and self.apply_pricelists_on == "board_services"
                 ):
-                    new_items = self.create_pricelists_items_board_services(
+                    vals_list += self._prepare_pricelists_items_board_services(
                         self.board_service_room_type_ids,
                         self.pricelist_ids,
                         self.board_service,
@@ -942,55 +1122,39 @@ class AvailabilityWizard(models.TransientModel):
                         self.date_types,
                         date,
                     )
-                    items = items + new_items if new_items else items
-
                 elif (
                     self.massive_changes_on == "pricelist"
                     and self.apply_pricelists_on == "service"
                 ):
-                    for pricelist in self.pricelist_ids:
-                        if self.service:
-                            vals = {
-                                "pricelist_id": pricelist.id,
-                                "compute_price": "fixed",
-                                "applied_on": "0_product_variant",
-                                "product_id": self.service.id,
-                                "fixed_price": self.price,
-                                "min_quantity": self.min_quantity,
-                                "pms_property_ids": [pms_property.id],
-                            }
-                            vals = self.generate_dates_vals(self.date_types, vals, date)
-
-                            pricelist_item = self.env["product.pricelist.item"].create(
-                                vals
-                            )
-                            items.append(pricelist_item.id)
+                    vals_list += self._prepare_pricelists_items_service(
+                        self.pricelist_ids,
+                        self.service,
+                        self.price,
+                        self.min_quantity,
+                        pms_property,
+                        self.date_types,
+                        date,
+                    )
                 elif self.massive_changes_on == "availability_plan":
-
-                    new_items = self.create_availability_plans_rules(
+                    (
+                        new_vals_list,
+                        new_rules_to_write,
+                    ) = self._prepare_availability_plans_rules(
                         room_types,
                         self.availability_plan_ids,
-                        self.min_stay,
-                        self.apply_min_stay,
-                        self.min_stay_arrival,
-                        self.apply_min_stay_arrival,
-                        self.max_stay,
-                        self.apply_max_stay,
-                        self.max_stay_arrival,
-                        self.apply_max_stay_arrival,
-                        self.quota,
-                        self.apply_quota,
-                        self.max_avail,
-                        self.apply_max_avail,
-                        self.closed,
-                        self.apply_closed,
-                        self.closed_arrival,
-                        self.apply_closed_arrival,
-                        self.closed_departure,
-                        self.apply_closed_departure,
+                        rule_vals,
                         date,
-                        self.rules_to_overwrite,
                         pms_property,
+                        overwrite_index,
                     )
-                    items = items + new_items if new_items else items
-        return items
+                    vals_list += new_vals_list
+                    rules_to_write |= new_rules_to_write
+
+        if self.massive_changes_on == "pricelist":
+            return self._create_massive_changes("product.pricelist.item", vals_list)
+        if rule_write_vals:
+            rules_to_write.write(rule_write_vals)
+        rule_ids, queued_jobs = self._create_massive_changes(
+            "pms.availability.plan.rule", vals_list
+        )
+        return rules_to_write.ids + rule_ids, queued_jobs
@@ -245,6 +245,48 @@ class ReservationSplitJoinSwapWizard(models.TransientModel):
             lambda x: x.date == date
         ).room_id = room.id
 
+    @api.model
+    def reservation_split_lines(self, reservation, rooms_by_date):
+        """
+        Split the reservation changing the room of several nights at once,
+        checking the availability of all of them with the occupancy of the
+        stay loaded once.
+        :param rooms_by_date: dict {date: pms.room}
+        """
+        if not reservation:
+            raise UserError(_("Invalid reservation"))
+        Avail = self.env["pms.availability"]
+        pms_property_id = reservation.pms_property_id.id
+        graph = Avail._get_shared_rooms_graph(pms_property_id)
+        occupied_by_date = Avail._get_occupied_rooms_by_date(
+            pms_property_id,
+            list(rooms_by_date),
+            graph["room_ids"],
+            current_lines=reservation.reservation_line_ids.ids,
+        )
+        class_room_ids = [
+            room_id
+            for room_type_id, room_ids in graph["rooms_by_type"].items()
+            if self.env["pms.room.type"].browse(room_type_id).class_id
+            == reservation.room_type_id.class_id
+            for room_id in room_ids
+        ]
+        lines_by_room = {}
+        for date, room in rooms_by_date.items():
+            line = reservation.reservation_line_ids.filtered(lambda x: x.date == date)
+            if not line:
+                raise UserError(_("Invalid date for reservation line "))
+            if not room:
+                raise UserError(_("The room does not exist"))
+            if room.id not in class_room_ids or Avail._filter_rooms_not_avail(
+                [room.id], occupied_by_date.get(date, set()), graph
+            ):
+                raise UserError(_("The room is not available"))
+            lines_by_room.setdefault(room, line.browse())
+            lines_by_room[room] |= line
+        for room, lines in lines_by_room.items():
+            lines.write({"room_id": room.id})
+
     @api.model
     def reservation_join(self, reservation, room):
         pms_property = reservation.pms_property_id
@@ -258,12 +300,7 @@ class ReservationSplitJoinSwapWizard(models.TransientModel):
         rooms_available = pms_property.free_room_ids
 
         if room in rooms_available:
-            for line in (
-                self.env["pms.reservation"]
-                .search([("id", "=", reservation.id)])
-                .reservation_line_ids
-            ):
-                line.room_id = room.id
+            reservation.reservation_line_ids.write({"room_id": room.id})
         else:
             raise UserError(_("Room {} not available.".format(room.name)))
 
@@ -299,22 +336,26 @@ class ReservationSplitJoinSwapWizard(models.TransientModel):
                 line_room_target.room_id = source
 
     def action_split(self):
-        for record in self:
-            for line in record.reservation_lines_to_change:
-                self.reservation_split(
+        with self.env["pms.folio"]._defer_recompute():
+            for record in self:
+                self.reservation_split_lines(
                     record.reservation_id,
-                    line.date,
-                    line.room_id,
+                    {
+                        line.date: line.room_id
+                        for line in record.reservation_lines_to_change
+                    },
                 )
 
     def action_join(self):
-        for record in self:
-            self.reservation_join(record.reservation_id, record.room_target)
+        with self.env["pms.folio"]._defer_recompute():
+            for record in self:
+                self.reservation_join(record.reservation_id, record.room_target)
 
     def action_swap(self):
-        self.reservations_swap(
-            self.checkin, self.checkout, self.room_source.id, self.room_target.id
-        )
+        with self.env["pms.folio"]._defer_recompute():
+            self.reservations_swap(
+                self.checkin, self.checkout, self.room_source.id, self.room_target.id
+            )
 
 
 class ReservationLinesToSplit(models.TransientModel):
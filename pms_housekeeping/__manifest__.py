@@ -13,11 +13,14 @@
         "pms",
         "hr",
         "pms_hr_property",
+        "queue_job",
     ],
     "data": [
         "security/ir.model.access.csv",
         "data/pms_housekeeping_data.xml",
         "data/cron_jobs.xml",
+        "data/queue_data.xml",
+        "data/queue_job_function_data.xml",
         "views/hr_employee_views.xml",
         "views/pms_housekeeping_task_type_views.xml",
         "views/pms_housekeeping_views.xml",
@@ -258,157 +258,166 @@ class PmsHouseKeepingTask(models.Model):
                 ]
             rec.allowed_housekeeper_ids = self.env["hr.employee"].search(domain).ids
 
-    @api.model
-    def create(self, vals):
-        task_type_id = vals.get("task_type_id")
-        pms_housekeeping_task_type = self.env["pms.housekeeping.task.type"].browse(
-            task_type_id
-        )
-        room_id = vals.get("room_id")
-        pms_room = self.env["pms.room"].browse(room_id)
-        pms_room.housekeeping_state = (
-            "to_inspect" if pms_housekeeping_task_type.is_inspection else "dirty"
-        )
+    @api.model_create_multi
+    def create(self, vals_list):
+        room_states = {}
+        for vals in vals_list:
+            if not vals.get("room_id"):
+                continue
+            task_type = self.env["pms.housekeeping.task.type"].browse(
+                vals.get("task_type_id")
+            )
+            room_states[vals["room_id"]] = (
+                "to_inspect" if task_type.is_inspection else "dirty"
+            )
+        room_ids_by_state = {}
+        for room_id, state in room_states.items():
+            room_ids_by_state.setdefault(state, []).append(room_id)
+        for state, room_ids in room_ids_by_state.items():
+            self.env["pms.room"].browse(room_ids).housekeeping_state = state
 
-        return super(PmsHouseKeepingTask, self).create(vals)
+        return super(PmsHouseKeepingTask, self).create(vals_list)
 
     @api.model
     def generate_tasks(self, pms_property_id):
-        for room in self.env["pms.room"].search(
+        today = fields.Date.today()
+        rooms = self.env["pms.room"].search(
             [("pms_property_id", "=", pms_property_id.id)]
-        ):
-            for task_type in self.env["pms.housekeeping.task.type"].search(
-                [
-                    "|",
-                    ("pms_property_ids", "in", [pms_property_id.id]),
-                    ("pms_property_ids", "=", False),
-                ],
-                order="priority asc",
-            ):
-                if task_type.is_checkout:
-                    reservations_with_checkout_today = self.env[
-                        "pms.reservation"
-                    ].search(
-                        [
-                            ("checkout", "=", fields.Date.today()),
-                        ]
-                    )
-                    reservation_line_with_checkout_today = self.env[
-                        "pms.reservation.line"
-                    ].search(
-                        [
-                            (
-                                "reservation_id",
-                                "in",
-                                reservations_with_checkout_today.ids,
-                            ),
-                            ("room_id", "=", room.id),
-                        ]
-                    )
-                    if reservation_line_with_checkout_today:
-                        self.create_housekeeping_tasks(room, task_type)
-                        break
-
-                if task_type.is_overnight:
-                    reservation_line_today = self.env["pms.reservation.line"].search(
-                        [
-                            ("room_id", "=", room.id),
-                            ("date", "=", fields.Date.today() + timedelta(days=-1)),
-                            ("occupies_availability", "=", True),
-                        ]
+        )
+        task_types = self.env["pms.housekeeping.task.type"].search(
+            [
+                "|",
+                ("pms_property_ids", "in", [pms_property_id.id]),
+                ("pms_property_ids", "=", False),
+            ],
+            order="priority asc",
+        )
+        occupancy = self._get_rooms_occupancy(pms_property_id, rooms, today)
+        vals_list = []
+        for room in rooms:
+            for task_type in task_types:
+                if self._is_task_type_due(task_type, room.id, occupancy, today):
+                    vals_list.append(
+                        self._get_housekeeping_task_vals(room, task_type, today)
                     )
-                    if reservation_line_today and len(reservation_line_today) == 1:
-                        reservation_checkin = (
-                            self.env["pms.reservation"]
-                            .browse(reservation_line_today.reservation_id.id)
-                            .checkin
-                        )
+                    break
+        return self.create(vals_list)
 
-                        days_between_checkin_and_today = (
-                            fields.Date.today()
-                        ) - reservation_checkin
-                        if (
-                            days_between_checkin_and_today.days
-                            % task_type.days_after_clean_overnight
-                            == 0
-                        ):
-                            self.create_housekeeping_tasks(room, task_type)
-                            break
-                if task_type.is_checkin:
-                    reservations_with_checkin_today = self.env[
-                        "pms.reservation"
-                    ].search(
-                        [
-                            ("checkin", "=", fields.Date.today()),
-                        ]
-                    )
-                    reservation_line_with_checkout_today = self.env[
-                        "pms.reservation.line"
-                    ].search(
-                        [
-                            (
-                                "reservation_id",
-                                "in",
-                                reservations_with_checkin_today.ids,
-                            ),
-                            ("room_id", "=", room.id),
-                        ]
-                    )
-                    if reservation_line_with_checkout_today:
-                        self.create_housekeeping_tasks(room, task_type)
-                        break
-                if task_type.is_empty:
-                    previous_reservations = self.env["pms.reservation"].search(
-                        [
-                            ("checkout", "<", fields.Date.today()),
-                            ("pms_property_id", "=", pms_property_id.id),
-                        ]
-                    )
-                    checkouts = (
-                        self.env["pms.reservation.line"]
-                        .search(
-                            [
-                                ("reservation_id", "in", previous_reservations.ids),
-                                ("room_id", "=", room.id),
-                            ],
-                        )
-                        .mapped("date")
-                    )
+    @api.model
+    def _get_rooms_occupancy(self, pms_property, rooms, today):
+        """
+        Load the occupancy of the rooms needed to plan the tasks of the day
+        :return: dict with the rooms with checkout and checkin today, the
+            checkin of the rooms occupied by a single stay last night and
+            the last night occupied by a past reservation of the property
+        """
+        occupancy = {
+            "checkout_room_ids": set(),
+            "checkin_room_ids": set(),
+            "overnight_checkins": {},
+            "last_checkouts": {},
+        }
+        for line in self.env["pms.reservation.line"].search(
+            [
+                ("room_id", "in", rooms.ids),
+                "|",
+                ("reservation_id.checkout", "=", today),
+                ("reservation_id.checkin", "=", today),
+            ]
+        ):
+            if line.reservation_id.checkout == today:
+                occupancy["checkout_room_ids"].add(line.room_id.id)
+            if line.reservation_id.checkin == today:
+                occupancy["checkin_room_ids"].add(line.room_id.id)
 
-                    if checkouts:
-                        last_checkout = max(checkouts)
-                        days_between_last_checkout_and_today = (fields.Date.today()) - (
-                            last_checkout + timedelta(days=1)
-                        )
-                        if (
-                            days_between_last_checkout_and_today.days
-                            % task_type.days_after_clean_empty
-                            == 0
-                        ):
-                            self.create_housekeeping_tasks(room, task_type)
-                            break
+        overnight_lines = {}
+        for line in self.env["pms.reservation.line"].search(
+            [
+                ("room_id", "in", rooms.ids),
+                ("date", "=", today + timedelta(days=-1)),
+                ("occupies_availability", "=", True),
+            ]
+        ):
+            overnight_lines.setdefault(line.room_id.id, []).append(line)
+        for room_id, lines in overnight_lines.items():
+            if len(lines) == 1:
+                occupancy["overnight_checkins"][room_id] = lines[
+                    0
+                ].reservation_id.checkin
 
-    def create_housekeeping_tasks(self, room, task_type):
-        task = self.env["pms.housekeeping.task"].create(
-            {
-                "name": task_type.name + " " + room.name,
-                "room_id": room.id,
-                "task_type_id": task_type.id,
-                "task_date": fields.Date.today(),
-            }
-        )
+        for group in self.env["pms.reservation.line"].read_group(
+            [
+                ("room_id", "in", rooms.ids),
+                ("reservation_id.checkout", "<", today),
+                ("reservation_id.pms_property_id", "=", pms_property.id),
+            ],
+            ["room_id", "date:max"],
+            ["room_id"],
+        ):
+            occupancy["last_checkouts"][group["room_id"][0]] = group["date"]
+        return occupancy
 
-        for task_type_child in task_type.child_ids:
-            self.env["pms.housekeeping.task"].create(
-                {
-                    "name": task_type_child.name + " " + room.name,
-                    "task_type_id": task_type_child.id,
-                    "room_id": room.id,
-                    "task_date": fields.Date.today(),
-                    "parent_id": task.id,
-                }
+    @api.model
+    def _is_task_type_due(self, task_type, room_id, occupancy, today):
+        if task_type.is_checkout and room_id in occupancy["checkout_room_ids"]:
+            return True
+        if task_type.is_overnight and room_id in occupancy["overnight_checkins"]:
+            days_between_checkin_and_today = (
+                today - occupancy["overnight_checkins"][room_id]
+            )
+            if (
+                days_between_checkin_and_today.days
+                % task_type.days_after_clean_overnight
+                == 0
+            ):
+                return True
+        if task_type.is_checkin and room_id in occupancy["checkin_room_ids"]:
+            return True
+        if task_type.is_empty and room_id in occupancy["last_checkouts"]:
+            days_between_last_checkout_and_today = today - (
+                occupancy["last_checkouts"][room_id] + timedelta(days=1)
             )
+            if (
+                days_between_last_checkout_and_today.days
+                % task_type.days_after_clean_empty
+                == 0
+            ):
+                return True
+        return False
+
+    @api.model
+    def _get_housekeeping_task_vals(self, room, task_type, task_date):
+        return {
+            "name": task_type.name + " " + room.name,
+            "room_id": room.id,
+            "task_type_id": task_type.id,
+            "task_date": task_date,
+            "child_ids": [
+                (
+                    0,
+                    0,
+                    {
+                        "name": task_type_child.name + " " + room.name,
+                        "task_type_id": task_type_child.id,
+                        "room_id": room.id,
+                        "task_date": task_date,
+                    },
+                )
+                for task_type_child in task_type.child_ids
+            ],
+        }
 
-    def generate_task_properties(self):
+    def create_housekeeping_tasks(self, room, task_type):
+        return self.env["pms.housekeeping.task"].create(
+            self._get_housekeeping_task_vals(room, task_type, fields.Date.today())
+        )
+
+    def generate_task_properties(self, with_delay=False):
         for pms_property in self.env["pms.property"].search([]):
-            self.generate_tasks(pms_property)
+            if with_delay:
+                self.with_delay(
+                    description=_("Generate housekeeping tasks of %s")
+                    % pms_property.name
+                ).generate_tasks(pms_property)
+            else:
+                self.generate_tasks(pms_property)
@@ -519,3 +519,66 @@ class TestPmsHousekeepingTask(TestPms):
             [("room_id", "=", self.room1.id)]
         )
         self.assertFalse(housekeeping_task.child_ids, "Child task shouldn´t be created")
+
+    @freeze_time("2000-01-04")
+    def test_task_generate_tasks_several_rooms(self):
+        # ARRANGE
+        room2 = self.env["pms.room"].create(
+            {
+                "name": "Room 102",
+                "pms_property_id": self.pms_property1.id,
+                "room_type_id": self.room_type1.id,
+            }
+        )
+        checkout_task_type = self.env["pms.housekeeping.task.type"].create(
+            {
+                "name": "Checkout",
+                "is_checkout": True,
+            }
+        )
+        child_task_type = self.env["pms.housekeeping.task.type"].create(
+            {
+                "name": "Checkout Child",
+                "is_inspection": True,
+                "parent_id": checkout_task_type.id,
+            }
+        )
+        checkin_task_type = self.env["pms.housekeeping.task.type"].create(
+            {
+                "name": "Checkin",
+                "is_checkin": True,
+            }
+        )
+        for room, checkin in (
+            (self.room1, datetime.today() + timedelta(days=-3)),
+            (room2, datetime.today()),
+        ):
+            self.env["pms.reservation"].create(
+                {
+                    "checkin": checkin,
+                    "checkout": checkin + timedelta(days=3),
+                    "preferred_room_id": room.id,
+                    "partner_id": self.partner1.id,
+                    "pms_property_id": self.pms_property1.id,
+                    "pricelist_id": self.pricelist1.id,
+                    "sale_channel_origin_id": self.sale_channel1.id,
+                }
+            )
+        # ACT
+        tasks = self.env["pms.housekeeping.task"].generate_tasks(self.pms_property1)
+        # ASSERT
+        self.assertEqual(
+            {(task.room_id, task.task_type_id) for task in tasks},
+            {(self.room1, checkout_task_type), (room2, checkin_task_type)},
+            "A checkout task and a checkin task should be created",
+        )
+        self.assertEqual(
+            tasks.filtered(lambda t: t.room_id == self.room1).child_ids.task_type_id,
+            child_task_type,
+            "The child task of the checkout task should be created",
+        )
+        self.assertEqual(
+            (self.room1.housekeeping_state, room2.housekeeping_state),
+            ("to_inspect", "dirty"),
+            "The housekeeping state of the rooms should follow their tasks",
+        )
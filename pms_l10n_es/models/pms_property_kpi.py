@@ -0,0 +1,27 @@
+from odoo import api, fields, models
+from odoo.tools import sql
+
+
+class PmsPropertyKpi(models.Model):
+    _inherit = "pms.property.kpi"
+
+    in_ine = fields.Boolean(
+        string="In INE",
+        help="Whether the rooms are active and taken into account "
+        "to generate INE statistics",
+        readonly=True,
+    )
+
+    def _auto_init(self):
+        load_in_ine = not sql.column_exists(self.env.cr, self._table, "in_ine")
+        res = super()._auto_init()
+        if load_in_ine and sql.table_exists(self.env.cr, "pms_property_kpi_dirty"):
+            self._mark_all_dirty()
+        return res
+
+    @api.model
+    def _get_kpi_dimensions(self):
+        dimensions = super()._get_kpi_dimensions()
+        # The archived rooms are out of the room_id.in_ine domains
+        dimensions["in_ine"] = ("room.active AND room.in_ine", "room_id.in_ine")
+        return dimensions
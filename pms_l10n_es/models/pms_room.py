@@ -8,3 +8,9 @@ class PmsRoom(models.Model):
         help="Take it into account to generate INE statistics",
         default=True,
     )
+
+    def _write(self, vals):
+        res = super()._write(vals)
+        if "in_ine" in vals or "active" in vals:
+            self.env["pms.property.kpi"]._mark_lines_dirty("room_id", self.ids)
+        return res
@@ -37,6 +37,14 @@ class PmsSesCommunication(models.Model):
         string="Query status time",
         help="Date and time of the last state query",
     )
+    request_count = fields.Integer(
+        string="Requests",
+        help="Requests sent to SES for this communication, retries included",
+    )
+    request_duration = fields.Float(
+        string="Request duration (s)",
+        help="Seconds spent in the last request to SES, retries included",
+    )
 
     state = fields.Selection(
         string="State",
@@ -1,8 +1,47 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
 from odoo import fields
 from odoo.tools.safe_eval import datetime
 
+from odoo.addons.pms_l10n_es.wizards.traveller_report import SES_MAX_ATTEMPTS
+
 from .common import TestPms
 
+SES_PROCESSED_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+    <S:Body>
+        <respuesta>
+            <codigo>0</codigo>
+            <descripcion>Ok</descripcion>
+            <resultado>
+                <codigoEstado>1</codigoEstado>
+            </resultado>
+        </respuesta>
+    </S:Body>
+</S:Envelope>
+"""
+
+
+class SesStubHandler(BaseHTTPRequestHandler):
+    """Local SES SOAP server answering every request as processed"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.clients.append(self.client_address)
+        body = SES_PROCESSED_RESPONSE.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
 
 class TestPmsSesCommunication(TestPms):
     def setUp(self):
@@ -283,3 +322,93 @@ class TestPmsSesCommunication(TestPms):
             last_notification,
             "Notification should be created when checkin partner is on board",
         )
+
+    def _create_communications_to_process(self, count):
+        self.pms_property1.write(
+            {
+                "institution_user": "user",
+                "institution_password": "password",
+                "institution_lessor_id": "0000000001",
+            }
+        )
+        communications = self.env["pms.ses.communication"]
+        for day in range(count):
+            reservation = self.env["pms.reservation"].create(
+                {
+                    "pms_property_id": self.pms_property1.id,
+                    "room_type_id": self.room_type.id,
+                    "checkin": fields.date.today() + datetime.timedelta(days=day),
+                    "checkout": fields.date.today() + datetime.timedelta(days=day + 1),
+                    "adults": 2,
+                    "children": 0,
+                    "sale_channel_origin_id": self.sale_channel_direct1.id,
+                    "partner_name": "Test reservation",
+                }
+            )
+            communications |= self.env["pms.ses.communication"].search(
+                [("reservation_id", "=", reservation.id)]
+            )
+        communications.write({"state": "to_process", "communication_id": "123"})
+        return communications
+
+    def test_process_communications_with_pooled_session(self):
+        """
+        Check that the communications of a property are processed
+        against the SES server reusing the same connection.
+        """
+        # ARRANGE
+        server = HTTPServer(("127.0.0.1", 0), SesStubHandler)
+        server.clients = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        communications = self._create_communications_to_process(3)
+        self.pms_property1.ses_url = "http://127.0.0.1:%s/ses" % server.server_port
+        # ACT
+        self.env["traveller.report.wizard"].ses_process_communications()
+        # ASSERT
+        self.assertEqual(
+            communications.mapped("state"),
+            ["processed"] * 3,
+            "The communications should be processed with the server response",
+        )
+        self.assertEqual(
+            communications.mapped("request_count"),
+            [1, 1, 1],
+            "Each communication should be sent once",
+        )
+        self.assertEqual(
+            len(set(server.clients)),
+            1,
+            "The communications of a property should share the connection",
+        )
+
+    def test_process_communications_retry_connection_errors(self):
+        """
+        Check that the requests that can not connect to the SES server
+        are retried and the communications keep pending processing.
+        """
+        # ARRANGE
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        communications = self._create_communications_to_process(1)
+        self.pms_property1.ses_url = "http://127.0.0.1:%s/ses" % port
+        # ACT
+        self.env["traveller.report.wizard"].ses_process_communications()
+        # ASSERT
+        self.assertEqual(
+            communications.request_count,
+            SES_MAX_ATTEMPTS,
+            "The request should be retried when the connection fails",
+        )
+        self.assertEqual(
+            communications.state,
+            "to_process",
+            "The communication should keep pending processing",
+        )
+        self.assertIn(
+            "Cannot establish the connection",
+            communications.processing_result,
+            "The connection error should be recorded",
+        )
@@ -821,6 +821,61 @@ class TestWizardINE(TestPms):
             monthly_adr,
         )
 
+    def test_calculate_monthly_adr_after_price_change(self):
+        """
+        The reservation line changes are read before the daily KPIs are
+        refreshed, and the domains out of their dimensions give the same ADR.
+        +-------------+-------+-------+-------+
+        |             |  01   |  02   |  03   |
+        +-------------+-------+-------+-------+
+        | r1          | 35.00 |       |       |
+        | r2          |       | 21.00 |       |
+        | r3          |       | 25.00 | 25.00 |
+        | r4          |       | 21.50 | 21.50 |
+        +-------------+-------+-------+-------+
+        | adr         | 35.00 | 22.50 | 23.25 |
+        +-------------+-------+-------+-------+
+        | monthly adr |        26.92          |
+        +-------------+-------+-------+-------+
+        """
+        # ARRANGE
+        self.ideal_scenario()
+        start_date = datetime.date(2021, 2, 1)
+        end_date = datetime.date(2021, 2, 28)
+        wizard = self.env["pms.ine.wizard"].new(
+            {
+                "pms_property_id": self.pms_property1.id,
+                "start_date": start_date,
+                "end_date": end_date,
+            }
+        )
+        Kpi = self.env["pms.property.kpi"]
+        Kpi.refresh_kpis()
+
+        # ACT
+        self.reservation_1.reservation_line_ids.price = 35.0
+        monthly_adr = wizard.ine_calculate_adr(start_date, end_date)
+        lines_monthly_adr = wizard.ine_calculate_adr(
+            start_date, end_date, [("reservation_id.agency_id", "=", False)]
+        )
+        Kpi.refresh_kpis()
+        refreshed_monthly_adr = wizard.ine_calculate_adr(start_date, end_date)
+
+        # ASSERT
+        self.assertEqual(monthly_adr, 26.92)
+        self.assertEqual(lines_monthly_adr, 26.92)
+        self.assertEqual(refreshed_monthly_adr, 26.92)
+        self.assertFalse(
+            Kpi.search_count(
+                [
+                    ("pms_property_id", "=", self.pms_property1.id),
+                    ("date", "=", datetime.date(2021, 2, 1)),
+                    ("revenue", "!=", 35.0),
+                ]
+            ),
+            "The KPIs of the modified day should be recomputed by the refresh",
+        )
+
     def test_calculate_monthly_revpar(self):
         """
         +----------------+-------+-------+-------+
@@ -1,9 +1,26 @@
+import csv
 import datetime
+import logging
+import time
 
+import requests
 from freezegun import freeze_time
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from odoo.exceptions import ValidationError
+from odoo.modules.module import get_module_resource
+
+from odoo.addons.pms_l10n_es.wizards.traveller_report import (
+    SES_MAX_ATTEMPTS,
+    _get_zip_municipality_index,
+    _ses_post_requests,
+    _ses_xml_municipality_code,
+)
 
 from .common import TestPms
 
+_logger = logging.getLogger(__name__)
+
 
 @freeze_time("2021-02-01")
 class TestWizardTravellerReport(TestPms):
@@ -235,3 +252,99 @@ class TestWizardTravellerReport(TestPms):
 
         # ASSERT
         self.assertIn(self.checkin1.document_number, result_checkin_list)
+
+    def test_municipality_code_index(self):
+        """
+        Check that the ZIP -> municipality index returns the same codes
+        as scanning the csv file, and compare the cost of both lookups.
+        """
+
+        # ARRANGE
+        def scan_municipality_code(residence_zip):
+            with open(
+                get_module_resource(
+                    "pms_l10n_es",
+                    "static/src/",
+                    "pms.ine.zip.municipality.ine.relation.csv",
+                ),
+                "r",
+                newline="",
+            ) as f:
+                for fila in csv.reader(f):
+                    if residence_zip in fila[0]:
+                        return fila[1][:5]
+            return False
+
+        def index_municipality_code(residence_zip):
+            try:
+                return _ses_xml_municipality_code(residence_zip)
+            except ValidationError:
+                return False
+
+        _get_zip_municipality_index(reload=True)
+        zips = ["08001", "28013", "01012", "99999", "0800", "080011", "digo"]
+        rows = _get_zip_municipality_index()["rows"]
+        zips += [zip_code for zip_code, code in rows[1:200]]
+        # ACT
+        start = time.perf_counter()
+        scan_codes = [scan_municipality_code(zip_code) for zip_code in zips]
+        scan_time = time.perf_counter() - start
+        start = time.perf_counter()
+        index_codes = [index_municipality_code(zip_code) for zip_code in zips]
+        index_time = time.perf_counter() - start
+        _logger.info(
+            "Municipality code of %s zips: %.4fs scanning the file, "
+            "%.4fs with the index",
+            len(zips),
+            scan_time,
+            index_time,
+        )
+        # ASSERT
+        self.assertEqual(
+            index_codes, scan_codes, "The index should match the file scan"
+        )
+
+    def test_ses_post_requests_retry(self):
+        """
+        Only the requests that did not reach the server are retried
+        ------------
+        Post a payload through a session that fails to open the connection
+        and through a session whose connection is dropped once the request
+        is sent: only the first one is retried
+        """
+        # ARRANGE
+        url = "https://hospedajes.example.com"
+
+        class FailingSession:
+            def __init__(self, error):
+                self.error = error
+                self.posts = 0
+
+            def post(self, *args, **kwargs):
+                self.posts += 1
+                raise self.error
+
+        not_connected = FailingSession(
+            requests.exceptions.ConnectionError(
+                MaxRetryError(None, url, NewConnectionError(None, "Connection refused"))
+            )
+        )
+        dropped = FailingSession(
+            requests.exceptions.ConnectionError("Connection aborted.")
+        )
+        # ACT
+        not_connected_results = _ses_post_requests(
+            not_connected, url, [(1, "payload")], True
+        )
+        dropped_results = _ses_post_requests(dropped, url, [(2, "payload")], True)
+        # ASSERT
+        self.assertEqual(
+            not_connected.posts,
+            SES_MAX_ATTEMPTS,
+            "The request that could not connect should be retried",
+        )
+        self.assertEqual(not_connected_results[0][3], SES_MAX_ATTEMPTS)
+        self.assertEqual(
+            dropped.posts, 1, "The request sent to the server must not be retried"
+        )
+        self.assertIs(dropped_results[0][1], dropped.error)
@@ -5,13 +5,16 @@ import io
 import json
 import logging
 import re
+import threading
 import time
 import xml.etree.cElementTree as ET
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from bs4 import BeautifulSoup as bs
 from dateutil.relativedelta import relativedelta
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 
 from odoo import _, api, fields, models
 from odoo.exceptions import MissingError, ValidationError
@@ -32,6 +35,16 @@ XML_PENDING = "5"
 CREATE_OPERATION_CODE = "A"
 DELETE_OPERATION_CODE = "B"
 
+# SES requests: concurrent workers (one per property credentials at a time),
+# seconds to wait for a response and attempts when the connection fails
+SES_MAX_WORKERS = 4
+SES_REQUEST_TIMEOUT = 60
+SES_MAX_ATTEMPTS = 3
+
+# ZIP -> INE municipality code index, loaded lazily once per worker
+_ZIP_MUNICIPALITY_INDEX = None
+_ZIP_MUNICIPALITY_LOCK = threading.Lock()
+
 
 # Disable insecure request warnings
 # requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
@@ -200,7 +213,7 @@ def _ses_xml_person_personal_info_elements(persona, checkin_partner):
     )
 
 
-def _ses_xml_municipality_code(residence_zip):
+def _load_zip_municipality_index():
     with open(
         get_module_resource(
             "pms_l10n_es", "static/src/", "pms.ine.zip.municipality.ine.relation.csv"
@@ -208,10 +221,44 @@ def _ses_xml_municipality_code(residence_zip):
         "r",
         newline="",
     ) as f:
-        lector = csv.reader(f)
-        for fila in lector:
-            if residence_zip in fila[0]:
-                return fila[1][:5]
+        rows = [(fila[0], fila[1][:5]) for fila in csv.reader(f)]
+    codes = {}
+    for zip_code, municipality_code in rows[1:]:
+        codes.setdefault(zip_code, municipality_code)
+    zip_lengths = {len(zip_code) for zip_code in codes}
+    return {
+        "rows": rows,
+        "header": rows[0][0] if rows else "",
+        "codes": codes,
+        "zip_length": zip_lengths.pop() if len(zip_lengths) == 1 else None,
+    }
+
+
+def _get_zip_municipality_index(reload=False):
+    """Return the ZIP -> INE municipality index, loading the csv file
+    only once per worker (or again if reload is set)"""
+    global _ZIP_MUNICIPALITY_INDEX
+    with _ZIP_MUNICIPALITY_LOCK:
+        if reload or _ZIP_MUNICIPALITY_INDEX is None:
+            _ZIP_MUNICIPALITY_INDEX = _load_zip_municipality_index()
+        return _ZIP_MUNICIPALITY_INDEX
+
+
+def _ses_xml_municipality_code(residence_zip):
+    """Return the INE municipality code of the first zip of the csv
+    file containing residence_zip"""
+    index = _get_zip_municipality_index()
+    # All the zips of the file have the same length, so a zip of that
+    # length is only contained in an equal zip (or in the header)
+    if len(residence_zip) == index["zip_length"] and residence_zip not in (
+        index["header"]
+    ):
+        if residence_zip in index["codes"]:
+            return index["codes"][residence_zip]
+    else:
+        for zip_code, municipality_code in index["rows"]:
+            if residence_zip in zip_code:
+                return municipality_code
     raise ValidationError(_("The guest does not have a valid zip code."))
 
 
@@ -365,6 +412,68 @@ def _handle_request_exception(communication, e):
         communication.sending_result = f"Unexpected error: {e}"
 
 
+def _ses_request_not_sent(e):
+    """Return whether the request exception was raised before the request
+    reached the server: a connection timeout or a connection that could not
+    be established (DNS failure, connection refused...)"""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(e, requests.exceptions.ConnectionError):
+        return False
+    reasons = list(e.args)
+    while reasons:
+        reason = reasons.pop()
+        if isinstance(reason, NewConnectionError):
+            return True
+        if isinstance(reason, MaxRetryError):
+            reasons.append(reason.reason)
+    return False
+
+
+def _ses_post_requests(session, url, requests_data, verify):
+    """Post the payloads to the url one after another through the session.
+    It runs in a worker thread, so it does not use the ORM.
+    :param requests_data: list of (communication id, payload)
+    :return: list of (communication id, response text or request exception,
+        seconds spent, attempts)
+    """
+    results = []
+    for communication_id, payload in requests_data:
+        start = time.monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                response = session.post(
+                    url, data=payload, verify=verify, timeout=SES_REQUEST_TIMEOUT
+                )
+                result = response.text
+            # Only the requests that could not reach the server are retried,
+            # so that a communication is never submitted twice
+            except requests.exceptions.RequestException as e:
+                if _ses_request_not_sent(e) and attempts < SES_MAX_ATTEMPTS:
+                    continue
+                result = e
+            break
+        results.append((communication_id, result, time.monotonic() - start, attempts))
+    return results
+
+
+def _ses_handle_sending_response(communication, response_text):
+    root = ET.fromstring(response_text)
+    communication.sending_result = root.find(".//descripcion").text
+    communication.response_communication_soap = response_text
+    result_code = root.find(".//codigo").text
+    if result_code == REQUEST_CODE_OK:
+        communication.communication_id = root.find(".//lote").text
+        if communication.operation == CREATE_OPERATION_CODE:
+            communication.state = "to_process"
+        else:
+            communication.state = "processed"
+    else:
+        communication.state = "error_sending"
+
+
 class TravellerReport(models.TransientModel):
     _name = "traveller.report.wizard"
     _description = "Traveller Report"
@@ -1057,8 +1166,68 @@ class TravellerReport(models.TransientModel):
             return xml_str
 
     @api.model
-    def ses_send_communications(self, entity):
+    def _ses_send_requests(self, payloads, verify):
+        """
+        Send the SOAP payloads of the communications concurrently: the
+        communications of the same property credentials are sent in
+        order through a keep-alive session, and the sessions run in a
+        bounded pool of threads so a slow endpoint does not block the rest.
+        :param payloads: {communication: payload}
+        :param verify: certificate to verify the SES server
+        :return: {communication: response text or request exception}
+        """
+        responses = {}
+        groups = {}
+        for communication, payload in payloads.items():
+            try:
+                headers = _get_auth_headers(communication)
+            except Exception as e:
+                responses[communication] = e
+                continue
+            key = (
+                communication.reservation_id.pms_property_id.ses_url,
+                tuple(sorted(headers.items())),
+            )
+            groups.setdefault(key, []).append((communication.id, payload))
+        if not groups:
+            return responses
+        max_workers = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("pms_l10n_es.ses_max_workers", SES_MAX_WORKERS)
+        )
+        start = time.monotonic()
+        sessions = []
+        futures = []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(groups))) as pool:
+            for (url, headers), requests_data in groups.items():
+                session = requests.Session()
+                session.headers.update(dict(headers))
+                sessions.append(session)
+                futures.append(
+                    pool.submit(_ses_post_requests, session, url, requests_data, verify)
+                )
+        for session in sessions:
+            session.close()
+        for future in futures:
+            for communication_id, result, duration, attempts in future.result():
+                communication = self.env["pms.ses.communication"].browse(
+                    communication_id
+                )
+                communication.request_count += attempts
+                communication.request_duration = duration
+                responses[communication] = result
+        _logger.info(
+            "SES: %s requests to %s endpoints sent in %.2fs",
+            sum(len(requests_data) for requests_data in groups.values()),
+            len(groups),
+            time.monotonic() - start,
+        )
+        return responses
 
+    @api.model
+    def ses_send_communications(self, entity):
+        payloads = {}
         for communication in self.env["pms.ses.communication"].search(
             [
                 ("state", "=", "to_send"),
@@ -1103,27 +1272,18 @@ class TravellerReport(models.TransientModel):
                 )
                 communication.communication_soap = payload
                 communication.communication_time = fields.Datetime.now()
+                payloads[communication] = payload
+            except Exception as e:
+                _handle_request_exception(communication, e)
 
-                soap_response = requests.request(
-                    "POST",
-                    communication.reservation_id.pms_property_id.ses_url,
-                    headers=_get_auth_headers(communication),
-                    data=payload,
-                    verify=get_module_resource("pms_l10n_es", "static", "cert.pem"),
-                )
-                root = ET.fromstring(soap_response.text)
-                communication.sending_result = root.find(".//descripcion").text
-                communication.response_communication_soap = soap_response.text
-                result_code = root.find(".//codigo").text
-                if result_code == REQUEST_CODE_OK:
-                    communication.communication_id = root.find(".//lote").text
-                    if communication.operation == CREATE_OPERATION_CODE:
-                        communication.state = "to_process"
-                    else:
-                        communication.state = "processed"
-                else:
-                    communication.state = "error_sending"
-
+        responses = self._ses_send_requests(
+            payloads, get_module_resource("pms_l10n_es", "static", "cert.pem")
+        )
+        for communication, response in responses.items():
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                _ses_handle_sending_response(communication, response)
             except requests.exceptions.RequestException as e:
                 _handle_request_exception(communication, e)
             except Exception as e:
@@ -1133,6 +1293,7 @@ class TravellerReport(models.TransientModel):
     def ses_send_incomplete_traveller_reports(
         self, hours_after_first_checkin_to_inform
     ):
+        payloads = {}
         # iterate through incomplete communications
         for communication in self.env["pms.ses.communication"].search(
             [
@@ -1167,29 +1328,18 @@ class TravellerReport(models.TransientModel):
                     )
                     communication.communication_soap = payload
                     communication.communication_time = fields.Datetime.now()
+                    payloads[communication] = payload
+            except Exception as e:
+                _handle_request_exception(communication, e)
 
-                    soap_response = requests.request(
-                        "POST",
-                        communication.reservation_id.pms_property_id.ses_url,
-                        headers=_get_auth_headers(communication),
-                        data=payload,
-                        verify=get_module_resource(
-                            "pms_l10n_es", "static", "ses_cert.pem"
-                        ),
-                    )
-                    root = ET.fromstring(soap_response.text)
-                    communication.sending_result = root.find(".//descripcion").text
-                    communication.response_communication_soap = soap_response.text
-                    result_code = root.find(".//codigo").text
-                    if result_code == REQUEST_CODE_OK:
-                        communication.communication_id = root.find(".//lote").text
-                        if communication.operation == CREATE_OPERATION_CODE:
-                            communication.state = "to_process"
-                        else:
-                            communication.state = "processed"
-                    else:
-                        communication.state = "error_sending"
-
+        responses = self._ses_send_requests(
+            payloads, get_module_resource("pms_l10n_es", "static", "ses_cert.pem")
+        )
+        for communication, response in responses.items():
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                _ses_handle_sending_response(communication, response)
             except requests.exceptions.RequestException as e:
                 _handle_request_exception(communication, e)
             except Exception as e:
@@ -1197,6 +1347,7 @@ class TravellerReport(models.TransientModel):
 
     @api.model
     def ses_process_communications(self):
+        payloads = {}
         for communication in self.env["pms.ses.communication"].search(
             [
                 ("state", "=", "to_process"),
@@ -1220,18 +1371,21 @@ class TravellerReport(models.TransientModel):
                 )
                 communication.query_status_soap = payload
                 communication.query_status_time = fields.Datetime.now()
+                payloads[communication] = payload
+            except Exception as e:
+                _handle_request_exception(communication, e)
 
-                soap_response = requests.request(
-                    "POST",
-                    communication.reservation_id.pms_property_id.ses_url,
-                    headers=_get_auth_headers(communication),
-                    data=payload,
-                    verify=get_module_resource("pms_l10n_es", "static", "cert.pem"),
-                )
-                root = ET.fromstring(soap_response.text)
-                communication.response_communication_soap = soap_response.text
+        responses = self._ses_send_requests(
+            payloads, get_module_resource("pms_l10n_es", "static", "cert.pem")
+        )
+        for communication, response in responses.items():
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                root = ET.fromstring(response)
+                communication.response_communication_soap = response
                 result_code = root.find(".//codigo").text
-                communication.response_query_status_soap = soap_response.text
+                communication.response_query_status_soap = response
                 if result_code == REQUEST_CODE_OK:
                     result_status = root.find(".//codigoEstado").text
                     if result_status == XML_OK:
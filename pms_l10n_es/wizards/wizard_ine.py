@@ -57,132 +57,124 @@ class WizardIne(models.TransientModel):
         """
         # result object
         rooms = dict()
-
-        # iterate days between start_date and end_date
-        for p_date in [
-            start_date + datetime.timedelta(days=x)
-            for x in range(0, (end_date - start_date).days + 1)
-        ]:
-
-            # rooms with capacity 2 but only 1 adult using them
-            double_rooms_single_use = (
-                self.env["pms.reservation.line"]
-                .search(
-                    [
-                        ("pms_property_id", "=", pms_property_id.id),
-                        ("occupies_availability", "=", True),
-                        ("reservation_id.reservation_type", "=", "normal"),
-                        ("room_id.in_ine", "=", True),
-                        ("date", "=", p_date),
-                        ("room_id.capacity", "=", 2),
-                        (
-                            "reservation_id.state",
-                            "in",
-                            ["confirmed", "onboard", "done"],
-                        ),
-                    ]
-                )
-                .filtered(
-                    lambda l: len(
-                        l.reservation_id.checkin_partner_ids.filtered(
-                            lambda c: c.state
-                            not in ["dummy", "draft", "cancel", "precheckin"]
-                        )
-                    )
-                    == 1
-                )
-                .mapped("room_id")
+        reservation_states = ["confirmed", "onboard", "done"]
+
+        # occupied INE rooms of the period
+        lines = self.env["pms.reservation.line"].search_read(
+            [
+                ("pms_property_id", "=", pms_property_id.id),
+                ("occupies_availability", "=", True),
+                ("reservation_id.reservation_type", "=", "normal"),
+                ("room_id.in_ine", "=", True),
+                ("date", ">=", start_date),
+                ("date", "<=", end_date),
+                ("reservation_id.state", "in", reservation_states),
+            ],
+            ["date", "room_id", "reservation_id"],
+        )
+        room_capacities = {
+            room["id"]: room["capacity"]
+            for room in self.env["pms.room"]
+            .browse({line["room_id"][0] for line in lines})
+            .read(["capacity"])
+        }
+        # num. of guests with checkin data of each reservation
+        reservation_ids = list({line["reservation_id"][0] for line in lines})
+        guests = {
+            entry["reservation_id"][0]: entry["__count"]
+            for entry in self.env["pms.checkin.partner"].read_group(
+                [
+                    ("reservation_id", "in", reservation_ids),
+                    ("state", "not in", ["dummy", "draft", "cancel", "precheckin"]),
+                ],
+                ["reservation_id"],
+                ["reservation_id"],
+                lazy=False,
             )
-
-            # rooms with capacity 2 with 2 adult using them
-            double_rooms_double_use = (
-                self.env["pms.reservation.line"]
-                .search(
-                    [
-                        ("pms_property_id", "=", pms_property_id.id),
-                        ("occupies_availability", "=", True),
-                        ("reservation_id.reservation_type", "=", "normal"),
-                        ("room_id.in_ine", "=", True),
-                        ("date", "=", p_date),
-                        ("room_id.capacity", "=", 2),
-                        (
-                            "reservation_id.state",
-                            "in",
-                            ["confirmed", "onboard", "done"],
-                        ),
-                    ]
-                )
-                .filtered(
-                    lambda l: len(
-                        l.reservation_id.checkin_partner_ids.filtered(
-                            lambda c: c.state
-                            not in ["dummy", "draft", "cancel", "precheckin"]
-                        )
-                    )
-                    == 2
-                )
-                .mapped("room_id")
+        }
+        # rooms with guests by date, by use
+        rooms_by_date = dict()
+        for line in lines:
+            num_guests = guests.get(line["reservation_id"][0], 0)
+            if not num_guests:
+                continue
+            room_id = line["room_id"][0]
+            date_rooms = rooms_by_date.setdefault(
+                line["date"],
+                {
+                    "double_rooms_single_use": set(),
+                    "double_rooms_double_use": set(),
+                    "all_rooms": set(),
+                },
             )
-
-            # service lines with extra beds
-            extra_bed_service_lines = self.env["pms.service.line"].search(
+            date_rooms["all_rooms"].add(room_id)
+            if room_capacities[room_id] == 2 and num_guests == 1:
+                date_rooms["double_rooms_single_use"].add(room_id)
+            elif room_capacities[room_id] == 2 and num_guests == 2:
+                date_rooms["double_rooms_double_use"].add(room_id)
+
+        # service lines with extra beds
+        extra_bed_service_lines = self.env["pms.service.line"].search_read(
+            [
+                ("pms_property_id", "=", pms_property_id.id),
+                ("product_id.is_extra_bed", "=", True),
+                ("reservation_id.reservation_type", "=", "normal"),
+                ("reservation_id.state", "in", reservation_states),
+                ("date", ">=", start_date),
+                ("date", "<=", end_date),
+            ],
+            ["date", "day_qty", "reservation_id"],
+        )
+        extra_bed_reservation_ids = {
+            ebsl["reservation_id"][0] for ebsl in extra_bed_service_lines
+        }
+        # reservation days in INE rooms of the service lines
+        extra_bed_reservation_dates = {
+            (line["reservation_id"][0], line["date"])
+            for line in self.env["pms.reservation.line"]
+            .with_context(active_test=False)
+            .search_read(
                 [
-                    ("pms_property_id", "=", pms_property_id.id),
-                    ("product_id.is_extra_bed", "=", True),
-                    ("reservation_id.reservation_type", "=", "normal"),
-                    ("reservation_id.state", "in", ["confirmed", "onboard", "done"]),
-                    ("date", "=", p_date),
-                ]
+                    ("reservation_id", "in", list(extra_bed_reservation_ids)),
+                    ("date", ">=", start_date),
+                    ("date", "<=", end_date),
+                    ("room_id.in_ine", "=", True),
+                    ("occupies_availability", "=", True),
+                ],
+                ["date", "reservation_id"],
             )
-
-            extra_beds = 0
-
-            # get num. extra beds
-            for ebsl in extra_bed_service_lines:
-                reservation_lines = ebsl.reservation_id.reservation_line_ids.filtered(
-                    lambda x: x.date == ebsl.date
-                    and x.room_id.in_ine
-                    and x.occupies_availability
+        }
+        children_occupying = {
+            reservation["id"]: reservation["children_occupying"]
+            for reservation in self.env["pms.reservation"]
+            .browse(extra_bed_reservation_ids)
+            .read(["children_occupying"])
+        }
+        # get num. extra beds
+        extra_beds_by_date = dict()
+        for ebsl in extra_bed_service_lines:
+            reservation_id = ebsl["reservation_id"][0]
+            if (reservation_id, ebsl["date"]) in extra_bed_reservation_dates:
+                # children occuppying do not have checkin partner data
+                extra_beds_by_date[ebsl["date"]] = (
+                    extra_beds_by_date.get(ebsl["date"], 0)
+                    + ebsl["day_qty"]
+                    - children_occupying[reservation_id]
                 )
-                if reservation_lines:
-                    extra_beds += (
-                        ebsl.day_qty
-                        - reservation_lines.reservation_id.children_occupying
-                    )
-                    # children occuppying do not have checkin partner data
 
-            # search all rooms
-            all_rooms = (
-                self.env["pms.reservation.line"]
-                .search(
-                    [
-                        ("date", "=", p_date),
-                        ("occupies_availability", "=", True),
-                        ("reservation_id.reservation_type", "=", "normal"),
-                        ("room_id.in_ine", "=", True),
-                        ("pms_property_id", "=", pms_property_id.id),
-                        (
-                            "reservation_id.state",
-                            "in",
-                            ["confirmed", "onboard", "done"],
-                        ),
-                    ]
-                )
-                .filtered(
-                    lambda l: len(
-                        l.reservation_id.checkin_partner_ids.filtered(
-                            lambda c: c.state
-                            not in ["dummy", "draft", "cancel", "precheckin"]
-                        )
-                    )
-                    > 0
-                )
-                .mapped("room_id")
-            )
+        # iterate days between start_date and end_date
+        for p_date in [
+            start_date + datetime.timedelta(days=x)
+            for x in range(0, (end_date - start_date).days + 1)
+        ]:
+            date_rooms = rooms_by_date.get(p_date, {})
+            double_rooms_single_use = date_rooms.get("double_rooms_single_use", set())
+            double_rooms_double_use = date_rooms.get("double_rooms_double_use", set())
+            extra_beds = extra_beds_by_date.get(p_date, 0)
 
             # other rooms = all rooms - double rooms
             other_rooms = (
-                all_rooms - double_rooms_double_use
+                date_rooms.get("all_rooms", set()) - double_rooms_double_use
             ) - double_rooms_single_use
 
             # no room movements -> no dict entrys
@@ -229,170 +221,212 @@ class WizardIne(models.TransientModel):
         }
         """
 
-        def ine_add_arrivals_departures_pernoctations(
-            date, type_of_entry, read_group_result
-        ):
-            """
-            date = date to add the entry to dic
-            type_of_entry =  'arrivals' | 'departures' | 'pernoctations'
-            read_group_result = result of read_group by type_of_entry
-            """
-
-            for entry in read_group_result:
-                if not entry["residence_country_id"]:
-                    guests_with_no_residence_country = self.env[
-                        "pms.checkin.partner"
-                    ].search(entry["__domain"])
-                    guests_with_no_residence_country = (
-                        str(guests_with_no_residence_country.mapped("name"))
-                        .replace("[", "")
-                        .replace("]", "")
-                    )
-                    raise ValidationError(
-                        _(
-                            "The following guests have no residence country set :%s.",
-                            guests_with_no_residence_country,
-                        )
-                    )
-                # get residence_country_id from group set read_group results
-                residence_country_id_code = (
-                    self.env["res.country"]
-                    .search([("id", "=", entry["residence_country_id"][0])])
-                    .code
-                )
-                # all countries except Spain
-                if residence_country_id_code != CODE_SPAIN:
-
-                    # get count of each result
-                    num = entry["__count"]
-
-                    # update/create dicts for countries & dates and set num. arrivals
-                    if not countries.get(residence_country_id_code):
-                        countries[residence_country_id_code] = dict()
-                    if not countries[residence_country_id_code].get(date):
-                        countries[residence_country_id_code][date] = dict()
-                    countries[residence_country_id_code][date][type_of_entry] = num
-                else:
-                    # arrivals grouped by state_id (Spain "provincias")
-                    read_by_arrivals_spain = self.env["pms.checkin.partner"].read_group(
-                        entry["__domain"],
-                        ["residence_state_id"],
-                        ["residence_state_id"],
-                        lazy=False,
-                    )
-                    # iterate read_group results from Spain
-                    for entry_from_spain in read_by_arrivals_spain:
-                        if not entry_from_spain["residence_state_id"]:
-                            spanish_guests_with_no_state = self.env[
-                                "pms.checkin.partner"
-                            ].search(entry_from_spain["__domain"])
-                            spanish_guests_with_no_state = (
-                                str(spanish_guests_with_no_state.mapped("name"))
-                                .replace("[", "")
-                                .replace("]", "")
-                            )
-                            raise ValidationError(
-                                _(
-                                    "The following spanish guests have no state set :%s.",
-                                    spanish_guests_with_no_state,
-                                )
-                            )
-                        residence_state_id = self.env["res.country.state"].browse(
-                            entry_from_spain["residence_state_id"][0]
-                        )  # .ine_code
-                        ine_code = residence_state_id.ine_code
-
-                        if not ine_code:
-                            raise ValidationError(
-                                _(
-                                    "%s does not have the INE Code configured"
-                                    % residence_state_id.name
-                                )
-                            )
-                        # get count of each result
-                        num_spain = entry_from_spain["__count"]
-
-                        # update/create dicts for states & dates and set num. arrivals
-                        if not countries.get(CODE_SPAIN):
-                            countries[CODE_SPAIN] = dict()
-
-                        if not countries[CODE_SPAIN].get(ine_code):
-                            countries[CODE_SPAIN][ine_code] = dict()
-
-                        if not countries[CODE_SPAIN][ine_code].get(date):
-                            countries[CODE_SPAIN][ine_code][date] = dict()
-                        countries[CODE_SPAIN][ine_code][date][type_of_entry] = num_spain
-
         # result object
         countries = dict()
 
+        hosts_by_date = self._ine_get_hosts_by_date(
+            start_date, end_date, pms_property_id
+        )
+        hosts = [host for entry_hosts in hosts_by_date.values() for host in entry_hosts]
+        residence_countries = self.env["res.country"].search(
+            [
+                (
+                    "id",
+                    "in",
+                    [
+                        host["residence_country_id"][0]
+                        for host in hosts
+                        if host["residence_country_id"]
+                    ],
+                )
+            ]
+        )
+        residence_states = self.env["res.country.state"].search(
+            [
+                (
+                    "id",
+                    "in",
+                    [
+                        host["residence_state_id"][0]
+                        for host in hosts
+                        if host["residence_state_id"]
+                    ],
+                )
+            ]
+        )
+
         # iterate days between start_date and end_date
         for p_date in [
             start_date + datetime.timedelta(days=x)
             for x in range(0, (end_date - start_date).days + 1)
         ]:
-            # search for checkin partners
-            hosts = self.env["pms.checkin.partner"].search(
-                [
-                    ("reservation_id.pms_property_id", "=", pms_property_id),
-                    ("reservation_id.checkin", "<=", p_date),
-                    ("reservation_id.checkout", ">=", p_date),
-                    ("reservation_id.reservation_type", "=", "normal"),
-                    ("state", "not in", ["dummy", "draft", "cancel", "precheckin"]),
-                ]
+            for type_of_entry in ["arrivals", "departures", "pernoctations"]:
+                entry_hosts = hosts_by_date.get((p_date, type_of_entry))
+                if entry_hosts:
+                    self._ine_add_arrivals_departures_pernoctations(
+                        countries,
+                        p_date,
+                        type_of_entry,
+                        entry_hosts,
+                        residence_countries,
+                        residence_states,
+                    )
+
+        return countries
+
+    @api.model
+    def _ine_get_guest_names(self, entry_hosts):
+        return (
+            str(
+                self.env["pms.checkin.partner"]
+                .browse([host["id"] for host in entry_hosts])
+                .mapped("name")
             )
-            hosts = hosts.filtered(
-                lambda x: all(
-                    x.reservation_id.reservation_line_ids.mapped("room_id.in_ine")
+            .replace("[", "")
+            .replace("]", "")
+        )
+
+    @api.model
+    def _ine_add_arrivals_departures_pernoctations(
+        self,
+        countries,
+        date,
+        type_of_entry,
+        entry_hosts,
+        residence_countries,
+        residence_states,
+    ):
+        """
+        countries = result dict of ine_countries to add the entry to
+        date = date to add the entry to dic
+        type_of_entry =  'arrivals' | 'departures' | 'pernoctations'
+        entry_hosts = hosts of the date by type_of_entry
+        residence_countries, residence_states = residences of the hosts,
+        sorted as grouped by read_group
+        """
+        hosts_by_country = dict()
+        for host in entry_hosts:
+            country_id = (
+                host["residence_country_id"] and host["residence_country_id"][0]
+            )
+            hosts_by_country.setdefault(country_id, []).append(host)
+        if False in hosts_by_country:
+            raise ValidationError(
+                _(
+                    "The following guests have no residence country set :%s.",
+                    self._ine_get_guest_names(hosts_by_country[False]),
                 )
             )
+        for country in residence_countries:
+            if country.id not in hosts_by_country:
+                continue
+            # all countries except Spain
+            if country.code != CODE_SPAIN:
+                # get count of each result
+                num = len(hosts_by_country[country.id])
+
+                # update/create dicts for countries & dates and set num. arrivals
+                if not countries.get(country.code):
+                    countries[country.code] = dict()
+                if not countries[country.code].get(date):
+                    countries[country.code][date] = dict()
+                countries[country.code][date][type_of_entry] = num
+                continue
+            # arrivals grouped by state_id (Spain "provincias")
+            hosts_by_state = dict()
+            for host in hosts_by_country[country.id]:
+                state_id = host["residence_state_id"] and host["residence_state_id"][0]
+                hosts_by_state.setdefault(state_id, []).append(host)
+            if False in hosts_by_state:
+                raise ValidationError(
+                    _(
+                        "The following spanish guests have no state set :%s.",
+                        self._ine_get_guest_names(hosts_by_state[False]),
+                    )
+                )
+            for residence_state_id in residence_states:
+                if residence_state_id.id not in hosts_by_state:
+                    continue
+                ine_code = residence_state_id.ine_code
 
-            # arrivals
-            arrivals = hosts.filtered(lambda x: x.reservation_id.checkin == p_date)
-
-            # arrivals grouped by residence_country_id
-            read_by_arrivals = self.env["pms.checkin.partner"].read_group(
-                [("id", "in", arrivals.ids)],
-                ["residence_country_id"],
-                ["residence_country_id"],
-                orderby="residence_country_id",
-                lazy=False,
-            )
+                if not ine_code:
+                    raise ValidationError(
+                        _(
+                            "%s does not have the INE Code configured"
+                            % residence_state_id.name
+                        )
+                    )
+                # get count of each result
+                num_spain = len(hosts_by_state[residence_state_id.id])
 
-            # departures
-            departures = hosts.filtered(lambda x: x.reservation_id.checkout == p_date)
+                # update/create dicts for states & dates and set num. arrivals
+                if not countries.get(CODE_SPAIN):
+                    countries[CODE_SPAIN] = dict()
 
-            # departures grouped by residence_country_id
-            read_by_departures = self.env["pms.checkin.partner"].read_group(
-                [("id", "in", departures.ids)],
-                ["residence_country_id"],
-                ["residence_country_id"],
-                orderby="residence_country_id",
-                lazy=False,
-            )
+                if not countries[CODE_SPAIN].get(ine_code):
+                    countries[CODE_SPAIN][ine_code] = dict()
 
-            # pernoctations
-            pernoctations = hosts - departures
+                if not countries[CODE_SPAIN][ine_code].get(date):
+                    countries[CODE_SPAIN][ine_code][date] = dict()
+                countries[CODE_SPAIN][ine_code][date][type_of_entry] = num_spain
 
-            # pernoctations grouped by residence_country_id
-            read_by_pernoctations = self.env["pms.checkin.partner"].read_group(
-                [("id", "in", pernoctations.ids)],
-                ["residence_country_id"],
-                ["residence_country_id"],
-                orderby="residence_country_id",
+    @api.model
+    def _ine_get_hosts_by_date(self, start_date, end_date, pms_property_id):
+        """
+        Load the checkin partners of the period in INE rooms and return
+        them (as read dicts) by (date, type of entry), where type of entry
+        is 'arrivals', 'departures' or 'pernoctations'
+        """
+        hosts = self.env["pms.checkin.partner"].search_read(
+            [
+                ("reservation_id.pms_property_id", "=", pms_property_id),
+                ("reservation_id.checkin", "<=", end_date),
+                ("reservation_id.checkout", ">=", start_date),
+                ("reservation_id.reservation_type", "=", "normal"),
+                ("state", "not in", ["dummy", "draft", "cancel", "precheckin"]),
+            ],
+            ["reservation_id", "residence_country_id", "residence_state_id"],
+        )
+        reservation_ids = list({host["reservation_id"][0] for host in hosts})
+        reservations = {
+            reservation["id"]: reservation
+            for reservation in self.env["pms.reservation"]
+            .browse(reservation_ids)
+            .read(["checkin", "checkout"])
+        }
+        # reservations with some room not in INE
+        reservations_not_in_ine = {
+            entry["reservation_id"][0]
+            for entry in self.env["pms.reservation.line"]
+            .with_context(active_test=False)
+            .read_group(
+                [
+                    ("reservation_id", "in", reservation_ids),
+                    ("room_id.in_ine", "=", False),
+                ],
+                ["reservation_id"],
+                ["reservation_id"],
                 lazy=False,
             )
-            ine_add_arrivals_departures_pernoctations(
-                p_date, "arrivals", read_by_arrivals
-            )
-            ine_add_arrivals_departures_pernoctations(
-                p_date, "departures", read_by_departures
-            )
-            ine_add_arrivals_departures_pernoctations(
-                p_date, "pernoctations", read_by_pernoctations
-            )
-
-        return countries
+        }
+        hosts_by_date = dict()
+        for host in hosts:
+            reservation = reservations[host["reservation_id"][0]]
+            if reservation["id"] in reservations_not_in_ine:
+                continue
+            p_date = max(reservation["checkin"], start_date)
+            while p_date <= min(reservation["checkout"], end_date):
+                types_of_entry = []
+                if p_date == reservation["checkin"]:
+                    types_of_entry.append("arrivals")
+                if p_date == reservation["checkout"]:
+                    types_of_entry.append("departures")
+                else:
+                    types_of_entry.append("pernoctations")
+                for type_of_entry in types_of_entry:
+                    hosts_by_date.setdefault((p_date, type_of_entry), []).append(host)
+                p_date += datetime.timedelta(days=1)
+        return hosts_by_date
 
     def ine_calculate_adr(self, start_date, end_date, domain=False):
         """
@@ -436,11 +470,12 @@ class WizardIne(models.TransientModel):
             ("date", ">=", start_date),
             ("date", "<=", end_date),
         ]
-        total_reservations = self.env["pms.reservation.line"].search(total_domain)
+        Kpi = self.env["pms.property.kpi"]
+        total_room_nights = Kpi.read_line_totals(total_domain)[0]["room_nights"]
         domain.extend(total_domain)
-        filter_reservations = self.env["pms.reservation.line"].search(domain)
-        if len(filter_reservations) > 0:
-            filter_percent = len(filter_reservations) * 100 / len(total_reservations)
+        filter_room_nights = Kpi.read_line_totals(domain)[0]["room_nights"]
+        if filter_room_nights > 0:
+            filter_percent = filter_room_nights * 100 / total_room_nights
             # round to 2 decimals, but if the result is > 0 and < 0.01, return 0.01
             filter_percent = (
                 math.ceil(filter_percent * 100) / 100
@@ -17,6 +17,6 @@
         "wizard/import_rooming_xlsx.xml",
         "views/pms_folio.xml",
     ],
-    "external_dependencies": {"python": ["xlrd"]},
+    "external_dependencies": {"python": ["openpyxl", "xlrd"]},
     "installable": True,
 }
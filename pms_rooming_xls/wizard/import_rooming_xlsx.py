@@ -2,10 +2,9 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
 import base64
-import json
-import tempfile
-from collections import OrderedDict
+from io import BytesIO
 
+import openpyxl
 import xlrd
 
 from odoo import _, fields, models
@@ -20,12 +19,11 @@ class ImportRoomingXlsx(models.TransientModel):
     name = fields.Char("File name")
     file = fields.Binary("File")
     type = fields.Selection([("xlsx", "XLSX")], default="xlsx", string="File type.")
+    result = fields.Text("Result", readonly=True)
 
     def import_rooming(self):
         self.ensure_one()
         if self.type == "xlsx":
-            CheckinPartner = self.env["pms.checkin.partner"]
-            checkin_fields = CheckinPartner._checkin_partner_fields()
             if not self.file or not self.name.lower().endswith(
                 (
                     ".xls",
@@ -33,58 +31,150 @@ class ImportRoomingXlsx(models.TransientModel):
                 )
             ):
                 raise ValidationError(_("Please Select an .xls file to Import"))
-            temp_path = tempfile.gettempdir()
-            file_data = base64.decodestring(self.file)
-            fp = open(temp_path + "/xsl_file.xls", "wb+")
-            fp.write(file_data)
-            fp.close()
-            wb = xlrd.open_workbook(temp_path + "/xsl_file.xls")
-            data_list = []
-            header_list = []
-            headers_dict = {}
-            roomlist = []
-            for sheet in wb.sheets():
-                # Checkin data xlsx
-                for rownum in range(sheet.nrows):
-                    if rownum == 0:
-                        header_list = [x for x in sheet.row_values(rownum)]
-                        headers_dict = {
-                            "identifier": header_list.index("Code"),
-                            "folio_id": header_list.index("Folio"),
-                            "reservation_id": header_list.index("Room"),
-                        }
-                        for header in header_list:
-                            for field_str in checkin_fields:
-                                if CheckinPartner._fields[field_str].string == header:
-                                    headers_dict[field_str] = header_list.index(header)
-                                    break
-                    if rownum >= 1:
-                        data_list.append(sheet.row_values(rownum))
-                count = 1
-                for row in data_list:
-                    count += 1
-                    checkin_dict = OrderedDict()
-                    folio = self.env["pms.folio"].search(
-                        [("name", "=", row[headers_dict["folio_id"]])]
-                    )
-                    reservation = self.env["pms.reservation"].search(
-                        [
-                            ("folio_id", "=", folio.id),
-                            ("rooms", "=", row[headers_dict["reservation_id"]]),
-                        ]
-                    )
-                    checkin_dict["folio_id"] = folio.id
-                    checkin_dict["reservation_id"] = reservation.id
-                    if not (reservation and folio):
-                        raise ValidationError(
-                            _("Not found reservation (%s)"),
-                            row[headers_dict["reservation_id"]],
-                        )
-                    for key, value in headers_dict.items():
-                        if key in ("reservation_id", "folio_id"):
-                            continue
-                        checkin_dict[key] = row[value]
-                    roomlist.append(checkin_dict)
-                self.env["pms.checkin.partner"].import_room_list_json(
-                    json.dumps(roomlist)
+            file_data = base64.b64decode(self.file)
+            if self.name.lower().endswith(".xlsx"):
+                rows = self._read_xlsx_rows(file_data)
+            else:
+                rows = self._read_rows(file_data)
+            roomlist, errors = self._get_roomlist(rows)
+            import_errors = self.env["pms.checkin.partner"].import_room_list(roomlist)
+            if not errors and not import_errors:
+                return {"type": "ir.actions.act_window_close"}
+            errors += import_errors
+            self.result = _("%s rows imported, %s rows with errors:\n%s") % (
+                len(roomlist) - len(import_errors),
+                len(errors),
+                "\n".join(errors),
+            )
+            return {
+                "type": "ir.actions.act_window",
+                "res_model": self._name,
+                "res_id": self.id,
+                "view_mode": "form",
+                "target": "new",
+            }
+
+    def _read_xlsx_rows(self, file_data):
+        """
+        Yield (sheet name, row number, row values) of a .xlsx file, reading
+        it from memory in read-only mode, row by row
+        """
+        workbook = openpyxl.load_workbook(
+            BytesIO(file_data), read_only=True, data_only=True
+        )
+        try:
+            for sheet in workbook.worksheets:
+                for rownum, row in enumerate(sheet.iter_rows(values_only=True), 1):
+                    yield sheet.title, rownum, list(row)
+        finally:
+            workbook.close()
+
+    def _read_rows(self, file_data):
+        """
+        Yield (sheet name, row number, row values) of a .xls file, reading
+        it from memory and loading the sheets one by one (xlrd only reads
+        the .xls format since its version 2.0)
+        """
+        workbook = xlrd.open_workbook(file_contents=file_data, on_demand=True)
+        try:
+            for sheet_name in workbook.sheet_names():
+                sheet = workbook.sheet_by_name(sheet_name)
+                for rownum, row in enumerate(sheet.get_rows(), 1):
+                    yield sheet_name, rownum, [
+                        xlrd.xldate_as_datetime(cell.value, workbook.datemode)
+                        if cell.ctype == xlrd.XL_CELL_DATE
+                        else cell.value
+                        for cell in row
+                    ]
+                workbook.unload_sheet(sheet_name)
+        finally:
+            workbook.release_resources()
+
+    def _get_headers_dict(self, header_list):
+        CheckinPartner = self.env["pms.checkin.partner"]
+        header_list = [self._get_cell_str(header) for header in header_list]
+        missing_headers = {"Code", "Folio", "Room"} - set(header_list)
+        if missing_headers:
+            raise ValidationError(
+                _("Missing columns in the file: %s") % ", ".join(missing_headers)
+            )
+        headers_dict = {
+            "identifier": header_list.index("Code"),
+            "folio_id": header_list.index("Folio"),
+            "reservation_id": header_list.index("Room"),
+        }
+        for field_str in CheckinPartner._checkin_partner_fields():
+            header = CheckinPartner._fields[field_str].string
+            if header in header_list:
+                headers_dict[field_str] = header_list.index(header)
+        return headers_dict
+
+    def _get_cell_str(self, value):
+        # Numeric codes and room names are read as floats
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if value is None or value is False:
+            return ""
+        return str(value).strip()
+
+    def _get_roomlist(self, rows):
+        """
+        Build the room list to import from the rows of the file, looking
+        up the folios and reservations of all the rows at once.
+        :return: (list of check-in dicts, list of errors of the rows
+            that can not be imported)
+        """
+        lines = []
+        headers_dict = {}
+        for sheet_name, rownum, row in rows:
+            if rownum == 1:
+                headers_dict = self._get_headers_dict(row)
+                continue
+            if not any(self._get_cell_str(value) for value in row):
+                continue
+            lines.append(
+                (
+                    _("Sheet %s, row %s") % (sheet_name, rownum),
+                    headers_dict,
+                    row,
                 )
+            )
+        folio_names = {
+            self._get_cell_str(row[headers["folio_id"]])
+            for label, headers, row in lines
+        }
+        folios = self.env["pms.folio"].search([("name", "in", list(folio_names))])
+        folio_ids_by_name = {folio.name: folio.id for folio in folios}
+        reservations_by_room = {}
+        reservations = self.env["pms.reservation"].search(
+            [("folio_id", "in", folios.ids)]
+        )
+        for reservation in reservations:
+            reservations_by_room.setdefault(
+                (reservation.folio_id.id, reservation.rooms), []
+            ).append(reservation.id)
+        roomlist = []
+        errors = []
+        for label, headers, row in lines:
+            folio_name = self._get_cell_str(row[headers["folio_id"]])
+            room = self._get_cell_str(row[headers["reservation_id"]])
+            folio_id = folio_ids_by_name.get(folio_name)
+            reservation_ids = reservations_by_room.get((folio_id, room), [])
+            if not folio_id:
+                errors.append(_("%s: Not found folio (%s)") % (label, folio_name))
+                continue
+            if len(reservation_ids) != 1:
+                errors.append(_("%s: Not found reservation (%s)") % (label, room))
+                continue
+            checkin_dict = {
+                "row": label,
+                "folio_id": folio_id,
+                "reservation_id": reservation_ids[0],
+            }
+            for key, index in headers.items():
+                if key in ("reservation_id", "folio_id"):
+                    continue
+                checkin_dict[key] = row[index] if index < len(row) else False
+            checkin_dict["identifier"] = self._get_cell_str(checkin_dict["identifier"])
+            roomlist.append(checkin_dict)
+        return roomlist, errors